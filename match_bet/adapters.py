@@ -0,0 +1,150 @@
+import re
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+import soupsieve
+from django.utils.module_loading import import_string
+
+# Schedule-site adapters: everything the scraper needs to know about one site's match
+# list. An adapter turns the text of the selected cells into sets (group), a set into a
+# fixture (decode) and the site's date cells into datetimes (parse_date). Sources pick
+# their adapter by name in scrape_sources.json ("adapter", DEFAULT_ADAPTER if missing),
+# an adapter living outside this module is registered with @register or given by its
+# dotted path. Selectors are compiled once and date cells parsed once per distinct text
+
+DEFAULT_ADAPTER = 'leaguepedia'
+DATE_CACHE_SIZE = 8192
+
+MONTHS = {'January': 1, 'February': 2, 'March': 3, 'April': 4, 'May': 5, 'June': 6,
+          'July': 7, 'August': 8, 'September': 9, 'October': 10, 'November': 11, 'December': 12}
+
+ADAPTERS = {}
+
+
+@lru_cache(maxsize=None)
+def compile_selector(selector):
+    # Compiled soupsieve pattern, accepted by BeautifulSoup's select() and css.iselect()
+    return soupsieve.compile(selector)
+
+
+def register(adapter_class):
+    ADAPTERS[adapter_class.name] = adapter_class()
+    return adapter_class
+
+
+def get_adapter(name=None):
+    # Raises ValueError for an unknown name
+    name = name or DEFAULT_ADAPTER
+    adapter = ADAPTERS.get(name)
+    if adapter is None:
+        try:
+            adapter_class = import_string(name)
+        except ImportError:
+            raise ValueError(f"Unknown schedule adapter {name}, one of {', '.join(sorted(ADAPTERS))} "
+                             f"or the dotted path of an adapter class")
+        try:
+            adapter = adapter_class()
+        except TypeError as e:
+            # e.g. a ScheduleAdapter subclass missing one of the abstract methods
+            raise ValueError(f'Invalid schedule adapter {name}: {e}')
+        # Also under its own name, the one written to scrape_data.json
+        ADAPTERS[name] = ADAPTERS[adapter.name] = adapter
+    return adapter
+
+
+class ScheduleAdapter(ABC):
+    # group, decode and parse_date are abstract, an adapter missing one fails when it's
+    # registered or created instead of partway through a scrape
+    name = None
+    # CSS selector of the match list cells, used when the source doesn't give one
+    selector = None
+    # Added to the UTC times of the parsed dates before they're stored
+    shift = timedelta(0)
+
+    def __init__(self):
+        self.parse_date = lru_cache(maxsize=DATE_CACHE_SIZE)(self.parse_date)
+
+    def compiled_selector(self, selector=None):
+        return compile_selector(selector or self.selector)
+
+    @abstractmethod
+    def group(self, elements):
+        # Yields the sets (lists of cell texts) of an iterable of cell texts
+        pass
+
+    @abstractmethod
+    def decode(self, cells):
+        # (team1, team2, date text, score1, score2) of a set, scores are None for an
+        # upcoming match. None if the set should be ignored
+        pass
+
+    @abstractmethod
+    def parse_date(self, text):
+        # Aware datetime of a date cell, raises ValueError
+        pass
+
+    def fixtures(self, sets):
+        # Yields (team1, team2, datetime, score1, score2) of the sets that aren't ignored
+        decode = self.decode
+        parse_date = self.parse_date
+        for cells in sets:
+            fixture = decode(cells)
+            if fixture is not None:
+                team1, team2, date_text, score1, score2 = fixture
+                yield team1, team2, parse_date(date_text), score1, score2
+
+
+@register
+class LeaguepediaAdapter(ScheduleAdapter):
+    # lol.fandom.com match lists: a set is 'TEAM1⁠⁠', ['score1', 'score2',] date, '⁠⁠TEAM2',
+    # the team cells carry two word joiners on the side facing the middle of the row
+    name = 'leaguepedia'
+    selector = 'tr.ml-row:nth-of-type(n+8) td'
+    separator = '\u2060\u2060'
+    # Matches were always stored in Philippine time (UTC+8) labelled as UTC, kept so
+    # re-scrapes find the existing matches
+    shift = timedelta(hours=8)
+
+    # The set's cells joined with \x1f: team1, optional scores, date, team2
+    row_pattern = re.compile(r'([^\x1f]*)\x1f(?:\s*(\d+)\s*\x1f\s*(\d+)\s*\x1f)?([^\x1f]*)\x1f([^\x1f]*)')
+    # e.g. '19 November 2023 08:00:00 +0000', anything after the offset is ignored
+    date_pattern = re.compile(r'(\d{1,2}) ([A-Z][a-z]+) (\d{4}) (\d{2}):(\d{2}):(\d{2}) ([+-]\d{2}\d{2})')
+
+    def group(self, elements):
+        separator = self.separator
+        current_set = []
+        for element in elements:
+            current_set.append(element)
+            if element.startswith(separator):
+                yield current_set
+                current_set = []
+
+    def decode(self, cells):
+        match = self.row_pattern.fullmatch('\x1f'.join(cells))
+        if match is None:
+            return None
+        team1, score1, score2, date_text, team2 = match.groups()
+        team1 = team1.replace(self.separator, '')
+        team2 = team2.replace(self.separator, '')
+        if 'TBD' in team1 or 'TBD' in team2:  # Eliminate matches with a TBD contender
+            return None
+        if score1 is None:  # Upcoming match
+            return team1, team2, date_text, None, None
+        return team1, team2, date_text, int(score1), int(score2)
+
+    def parse_date(self, text):
+        match = self.date_pattern.match(text)
+        if match is None or match[2] not in MONTHS:
+            raise ValueError(f'Unrecognized date {text!r}')
+        day, month, year, hour, minute, second, offset = match.groups()
+        return (datetime(int(year), MONTHS[month], int(day), int(hour), int(minute), int(second), tzinfo=timezone.utc)
+                + utc_adjustment(offset, self.shift))
+
+
+@lru_cache(maxsize=None)
+def utc_adjustment(offset, shift):
+    # What to add to a time read as UTC when it is at the '+hhmm' / '-hhmm' offset,
+    # shift included
+    sign = -1 if offset[0] == '-' else 1
+    return shift - sign * timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
@@ -1,20 +1,62 @@
 from django.contrib import admin
-from .models import Match, Team, Bet, User, MatchTeamRelation
+from .models import Match, Team, Tournament, Bet, Exposure, User, MatchTeamRelation
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from django.shortcuts import render
+from .management.commands.scrape_matches import update_best_of
 
 # Register your models here.
 admin.site.register(Bet)
 admin.site.register(User)
 
+
+@admin.register(Tournament)
+class TournamentAdmin(admin.ModelAdmin):
+    list_display = ('name', 'slug')
+    prepopulated_fields = {'slug': ('name',)}
+
+
+@admin.register(Exposure)
+class ExposureAdmin(admin.ModelAdmin):
+    # Maintained by bet placement and settlement only
+    list_display = ('match', 'team', 'bet_count', 'total_stake', 'total_payout')
+    list_select_related = ('match', 'team')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 class MatchTeamRelationInline(admin.TabularInline):
     model = MatchTeamRelation
     extra = 0
 
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.remote_field.model is self.parent_model:
+            # Replaced by the inline's parent key, never rendered
+            return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+        object_id = request.resolver_match.kwargs.get('object_id')
+        if object_id:
+            # Only the teams / matches of the parent's tournament
+            parent_tournament = self.parent_model.objects.filter(pk=object_id).values('tournament_id')
+            kwargs['queryset'] = db_field.remote_field.model.objects.filter(tournament_id__in=parent_tournament)
+        formfield = super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+        # Every inline row renders the same team/match choices, load them once per request
+        choices_cache = request.__dict__.setdefault('_inline_choices_cache', {})
+        if db_field.name not in choices_cache:
+            choices_cache[db_field.name] = list(iter(formfield.choices))
+        formfield.choices = choices_cache[db_field.name]
+        return formfield
+
 class MatchAdmin(admin.ModelAdmin):
     inlines = [MatchTeamRelationInline]
     list_display = ('formatted_datetime', 'stage', 'best_of_display', 'display_info', 'display_current_odds','winner', 'result')
+    list_select_related = ('winner',)
+    list_filter = ('tournament',)
 
     def display_current_odds(self, obj):
         # Format the current_odds data
@@ -27,8 +69,7 @@ class MatchAdmin(admin.ModelAdmin):
 
 
     def display_info(self, obj):
-        teams = " vs ".join([team.name for team in obj.teams.all()])
-        return f"{teams}"
+        return obj.matchup
     
     
     display_info.short_description = 'Matchup'
@@ -53,6 +94,12 @@ class MatchAdmin(admin.ModelAdmin):
             else:
                 kwargs['queryset'] = Team.objects.none()
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Teams may have been changed through the inline
+        form.instance.refresh_matchup()
+        form.instance.save(update_fields=['matchup'])
     
     #--admin actions--#
     
@@ -81,9 +128,9 @@ class MatchAdmin(admin.ModelAdmin):
         # Retrieve the selected products from session data
         selected_match_ids = request.session.get('selected_matches', [])
 
-        # Retrieve the products based on the IDs
-        selected_matches = Match.objects.filter(
-            id__in=selected_match_ids)
+        # Retrieve the products based on the IDs, the template only needs the matchup labels
+        selected_matches = list(Match.objects.filter(
+            id__in=selected_match_ids).only('id', 'datetime', 'matchup'))
 
         context = {
             'selected_matches': selected_matches,
@@ -95,23 +142,13 @@ class MatchAdmin(admin.ModelAdmin):
         # Retrieve the selected products from session data
         selected_product_ids = request.session.get('selected_matches', [])
 
-        # Retrieve the products based on the IDs
-        selected_matches = Match.objects.filter(id__in=selected_product_ids)
-
-        success_updates = []
         error_updates = []
 
         # # Retrieve the new attribute values from the form input
         new_match_count = int(request.POST.get('new_match_count'))
 
-        # Loop through the selected matches
-        for match in selected_matches:
-            # Update the match attribute
-            match.best_of = new_match_count
-            match.save()
-
-            # Append the updated match to the success list
-            success_updates.append(match)
+        # Update all selected matches at once, re-evaluating which ones are concluded
+        success_updates, concluded, reopened = update_best_of(selected_product_ids, new_match_count)
 
         # Generate a message to inform the user about the results
         success_message = f"Updated {len(success_updates)} products successfully."
@@ -124,7 +161,9 @@ class MatchAdmin(admin.ModelAdmin):
             'success_message': success_message,
             'error_message': error_message,
             'success_updates': success_updates,
-            'error_updates': error_updates
+            'error_updates': error_updates,
+            'concluded_updates': concluded,
+            'reopened_updates': reopened,
         }
 
         return render(request, 'admin/summary_screen.html', context)
@@ -134,8 +173,15 @@ class TeamAdmin(admin.ModelAdmin):
     inlines = [MatchTeamRelationInline]
 
     list_display = ('name', 'acronym', 'base_pr', 'current_pr', 'origin', 'seed')
+    list_filter = ('tournament',)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'name' in form.changed_data:
+            Match.refresh_matchups(obj.matches.all())
 
     def display_matches(self, obj):
+        # str(match) reads the denormalized matchup label, no query per match
         return ", ".join([str(match) for match in obj.matches.all()])
 
     display_matches.short_description = 'Matches'
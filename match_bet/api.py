@@ -0,0 +1,200 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import (HttpResponseBadRequest, HttpResponseNotAllowed, HttpResponseNotFound, JsonResponse,
+                         StreamingHttpResponse)
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import etag, require_GET, require_POST
+
+from .betting import BetRejected, place_bet
+from .feed import broker, change_poller, stream_events
+from .models import DataVersion, Match, MatchTeamRelation, Team, Tournament, User
+from .odds import odds_matrix
+
+# Public read-only JSON API. Every response carries a strong ETag derived from the
+# data version and the request's query string, so a poll with a matching
+# If-None-Match gets a 304 without running the listing queries. Lists are of one
+# tournament, ?tournament=<slug> (settings.DEFAULT_TOURNAMENT if not given).
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+CURSOR_DATETIME_FORMAT = '%Y%m%dT%H%M%S%f'
+
+MATCH_FIELDS = ('id', 'tournament_id', 'datetime', 'stage', 'best_of', 'result', 'winner_id',
+                'is_concluded', 'current_odds', 'matchup')
+TEAM_FIELDS = ('id', 'tournament_id', 'name', 'acronym', 'base_pr', 'current_pr', 'origin', 'seed')
+
+
+def data_etag(request, *args, **kwargs):
+    query_hash = hashlib.sha1(request.get_full_path().encode()).hexdigest()[:12]
+    return f'{DataVersion.current()}-{query_hash}'
+
+
+def attach_teams(matches):
+    # Adds the teams (team 1 first) of each match row with a single query
+    teams = {}
+    relations = (MatchTeamRelation.objects
+                 .filter(match_id__in=[match['id'] for match in matches])
+                 .order_by('-is_team1', 'id')
+                 .values('match_id', 'team_id', 'is_winner', 'match_score', 'pr_delta'))
+    for relation in relations:
+        teams.setdefault(relation.pop('match_id'), []).append(relation)
+    for match in matches:
+        match['teams'] = teams.get(match['id'], [])
+    return matches
+
+
+def get_tournament_id(request):
+    slug = request.GET.get('tournament') or settings.DEFAULT_TOURNAMENT
+    return Tournament.objects.filter(slug=slug).values_list('id', flat=True).first()
+
+
+def get_limit(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        return None
+    return limit if 0 < limit <= MAX_LIMIT else None
+
+
+@require_GET
+@etag(data_etag)
+def matches_view(request):
+    # Matches ordered by (datetime, id), paged with the 'next' cursor of the previous page.
+    # ?concluded=true|false limits the list to results or upcoming matches
+    limit = get_limit(request)
+    if limit is None:
+        return HttpResponseBadRequest(f'limit must be between 1 and {MAX_LIMIT}')
+    tournament_id = get_tournament_id(request)
+    if tournament_id is None:
+        return HttpResponseNotFound('Unknown tournament')
+
+    matches = Match.objects.filter(tournament_id=tournament_id).order_by('datetime', 'id')
+
+    concluded = request.GET.get('concluded')
+    if concluded is not None:
+        matches = matches.filter(is_concluded=concluded.lower() in ('1', 'true', 'yes'))
+
+    cursor = request.GET.get('after')
+    if cursor:
+        try:
+            after_datetime, after_id = cursor.rsplit('_', 1)
+            after_datetime = datetime.strptime(after_datetime, CURSOR_DATETIME_FORMAT).replace(tzinfo=timezone.utc)
+            after_id = int(after_id)
+        except ValueError:
+            return HttpResponseBadRequest('Invalid cursor')
+        matches = matches.filter(
+            Q(datetime__gt=after_datetime) | Q(datetime=after_datetime, id__gt=after_id))
+
+    results = list(matches.values(*MATCH_FIELDS)[:limit + 1])
+    has_next = len(results) > limit
+    results = results[:limit]
+
+    attach_teams(results)
+
+    next_cursor = None
+    if has_next:
+        last = results[-1]
+        next_cursor = f"{last['datetime'].astimezone(timezone.utc).strftime(CURSOR_DATETIME_FORMAT)}_{last['id']}"
+
+    return JsonResponse({'results': results, 'next': next_cursor})
+
+
+@require_GET
+@etag(data_etag)
+def teams_view(request):
+    # Teams ordered by id, paged with the 'next' cursor of the previous page
+    limit = get_limit(request)
+    if limit is None:
+        return HttpResponseBadRequest(f'limit must be between 1 and {MAX_LIMIT}')
+    tournament_id = get_tournament_id(request)
+    if tournament_id is None:
+        return HttpResponseNotFound('Unknown tournament')
+
+    teams = Team.objects.filter(tournament_id=tournament_id).order_by('id')
+
+    cursor = request.GET.get('after')
+    if cursor:
+        try:
+            teams = teams.filter(id__gt=int(cursor))
+        except ValueError:
+            return HttpResponseBadRequest('Invalid cursor')
+
+    results = list(teams.values(*TEAM_FIELDS)[:limit + 1])
+    next_cursor = str(results[limit - 1]['id']) if len(results) > limit else None
+
+    return JsonResponse({'results': results[:limit], 'next': next_cursor})
+
+
+@require_GET
+@etag(data_etag)
+def odds_view(request):
+    # Current odds of any pairing of teams of the same tournament, ?team1=<id>&team2=<id>,
+    # read from the cached odds matrix
+    try:
+        team1_id, team2_id = int(request.GET['team1']), int(request.GET['team2'])
+        odds1, odds2 = odds_matrix.odds(team1_id, team2_id)
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest('team1 and team2 must be ids of teams of the same tournament')
+
+    return JsonResponse({'team1': team1_id, 'team2': team2_id, 'odds': [odds1, odds2]})
+
+
+def request_bettor(request):
+    # The betting user of the request's 'Authorization: Bearer <token>' header, None
+    # if the header is missing or the token unknown
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer':
+        return None
+    return User.from_api_token(token.strip())
+
+
+# Authenticated by the bearer token only, never by the session cookie, so a cross-site
+# request can't place bets and there's no CSRF token to check
+@csrf_exempt
+@require_POST
+def bets_view(request):
+    # Places a bet of the token's user from a JSON body {"match", "team", "stake"}, the
+    # odds are the match's current odds for the team. 401 without a valid token, 409
+    # when the bet is rejected
+    user = request_bettor(request)
+    if user is None:
+        response = JsonResponse({'error': 'A valid bearer token is required'}, status=401)
+        response['WWW-Authenticate'] = 'Bearer'
+        return response
+
+    try:
+        body = json.loads(request.body)
+        match_id, team_id = int(body['match']), int(body['team'])
+        stake = float(body['stake'])
+    except (KeyError, TypeError, ValueError):
+        return HttpResponseBadRequest('match, team and stake are required')
+
+    try:
+        bet = place_bet(user.id, match_id, team_id, stake)
+    except BetRejected as e:
+        return JsonResponse({'error': str(e)}, status=409)
+
+    return JsonResponse({'id': bet.id, 'user': user.id, 'match': match_id, 'team': team_id,
+                         'odds': bet.odds, 'stake': bet.stake}, status=201)
+
+
+async def feed_view(request):
+    # Server-sent events: 'matches' (new matches and results, same rows as the matches
+    # list), 'odds' (changed team PRs and the stored and PR odds of their upcoming
+    # matches) and 'resync' (events were dropped, re-read the lists). Needs an ASGI server
+    if request.method != 'GET':
+        # require_GET wraps views synchronously
+        return HttpResponseNotAllowed(['GET'])
+
+    subscriber = broker.subscribe()
+    # Picks up the scraper's writes while clients are connected
+    change_poller.start()
+    response = StreamingHttpResponse(stream_events(subscriber), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MatchBetConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'match_bet'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,153 @@
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import Bet, Exposure, Match, MatchTeamRelation, User
+from .odds import odds_repricer
+
+
+class BetRejected(Exception):
+    pass
+
+
+def place_bet(user_id, match_id, team_id, stake):
+    # Debits the stake and records the bet at the match's current odds, in one
+    # transaction. Raises BetRejected (and debits nothing) when the bet can't be placed
+    if not stake > 0:
+        raise BetRejected('Stake must be positive')
+
+    with transaction.atomic():
+        # Conditional debit instead of read-modify-write: concurrent bets of the same user
+        # can never overdraw the balance or overwrite each other's debit. Being the first
+        # statement it also takes SQLite's write lock (waiting up to the connection
+        # timeout), so the match can't conclude between the checks below and the insert
+        debited = User.objects.filter(id=user_id, balance__gte=stake).update(balance=F('balance') - stake)
+        if not debited:
+            if not User.objects.filter(id=user_id).exists():
+                raise BetRejected('Unknown user')
+            raise BetRejected('Insufficient balance')
+
+        match = (Match.objects.select_for_update().filter(id=match_id)
+                 .values('is_concluded', 'current_odds').first())
+        if match is None:
+            raise BetRejected('Unknown match')
+        if match['is_concluded']:
+            raise BetRejected('Match has concluded')
+
+        is_team1 = (MatchTeamRelation.objects.filter(match_id=match_id, team_id=team_id)
+                    .values_list('is_team1', flat=True).first())
+        if is_team1 is None:
+            raise BetRejected('Team does not play in this match')
+
+        odds = match['current_odds']
+        if not odds or len(odds) != 2:
+            raise BetRejected('Match has no odds')
+
+        # The odds are locked in at placement, later odds changes don't affect the bet
+        bet = Bet.objects.create(user_id=user_id, match_id=match_id, team_id=team_id,
+                                 odds=odds[0 if is_team1 else 1], stake=stake)
+        add_exposure(match_id, team_id, stake, stake * bet.odds, 1)
+        # The bet shifts the match's odds, coalesced with the other bets on the match
+        transaction.on_commit(lambda: odds_repricer.request(match_id))
+        return bet
+
+
+def settle_matches(match_ids):
+    # Pays out the open bets of the concluded matches among match_ids: bets on the winner
+    # are credited stake x odds, bets on a match without a winner are refunded and the
+    # rest pay nothing. Settled bets leave the exposure table. A reopened match's bets are
+    # reopened with unsettle_matches(). Returns the number of settled bets
+    with transaction.atomic():
+        winners = dict(Match.objects.filter(id__in=match_ids, is_concluded=True).values_list('id', 'winner_id'))
+        bets = list(Bet.objects.select_for_update().filter(match_id__in=winners, payout__isnull=True)
+                    .only('id', 'user_id', 'match_id', 'team_id', 'stake', 'odds'))
+        if not bets:
+            return 0
+
+        credits = {}
+        settled = {}  # (match id, team id) -> [stake, payout, count]
+        for bet in bets:
+            winner_id = winners[bet.match_id]
+            if winner_id is None:
+                bet.payout = bet.stake
+            elif bet.team_id == winner_id:
+                bet.payout = bet.stake * bet.odds
+            else:
+                bet.payout = 0
+            credits[bet.user_id] = credits.get(bet.user_id, 0) + bet.payout
+
+            totals = settled.setdefault((bet.match_id, bet.team_id), [0, 0, 0])
+            totals[0] += bet.stake
+            totals[1] += bet.stake * bet.odds
+            totals[2] += 1
+
+        Bet.objects.bulk_update(bets, ['payout'], batch_size=500)
+        for user_id, credit in credits.items():
+            if credit:
+                User.objects.filter(id=user_id).update(balance=F('balance') + credit)
+        for (match_id, team_id), (stake, payout, count) in settled.items():
+            add_exposure(match_id, team_id, -stake, -payout, -count)
+        Exposure.objects.filter(match_id__in=winners, bet_count=0).delete()
+
+    return len(bets)
+
+
+def unsettle_matches(match_ids):
+    # Reverses settle_matches() for matches that are no longer concluded: the payouts are
+    # debited back (a balance can go negative if the payout was already staked again),
+    # the bets are open again and back in the exposure table. Returns the number of
+    # reopened bets
+    with transaction.atomic():
+        bets = list(Bet.objects.select_for_update().filter(match_id__in=match_ids, payout__isnull=False)
+                    .only('id', 'user_id', 'match_id', 'team_id', 'stake', 'odds', 'payout'))
+        if not bets:
+            return 0
+
+        debits = {}
+        reopened = {}  # (match id, team id) -> [stake, payout, count]
+        for bet in bets:
+            debits[bet.user_id] = debits.get(bet.user_id, 0) + bet.payout
+            bet.payout = None
+
+            totals = reopened.setdefault((bet.match_id, bet.team_id), [0, 0, 0])
+            totals[0] += bet.stake
+            totals[1] += bet.stake * bet.odds
+            totals[2] += 1
+
+        Bet.objects.bulk_update(bets, ['payout'], batch_size=500)
+        for user_id, debit in debits.items():
+            if debit:
+                User.objects.filter(id=user_id).update(balance=F('balance') - debit)
+        for (match_id, team_id), (stake, payout, count) in reopened.items():
+            add_exposure(match_id, team_id, stake, payout, count)
+
+    return len(bets)
+
+
+def add_exposure(match_id, team_id, stake, payout, count):
+    # Adds to the running totals of one side of a match, the row is created by its first bet
+    changes = {
+        'total_stake': F('total_stake') + stake,
+        'total_payout': F('total_payout') + payout,
+        'bet_count': F('bet_count') + count,
+    }
+    exposure = Exposure.objects.filter(match_id=match_id, team_id=team_id)
+    if not exposure.update(**changes):
+        # ignore_conflicts: a concurrent first bet on the same side may have created it
+        Exposure.objects.bulk_create([Exposure(match_id=match_id, team_id=team_id)], ignore_conflicts=True)
+        exposure.update(**changes)
+
+
+def match_exposure(match_id):
+    # {team id: (total stake, total potential payout, bet count)} of the match's open bets,
+    # read from the exposure table with a single indexed query
+    return {team_id: (stake, payout, count) for team_id, stake, payout, count in
+            Exposure.objects.filter(match_id=match_id)
+            .values_list('team_id', 'total_stake', 'total_payout', 'bet_count')}
+
+
+def exposure_from_bets():
+    # The exposure table recomputed from the open bets, {(match id, team id): (stake, payout, count)}
+    totals = (Bet.objects.filter(payout__isnull=True).values('match_id', 'team_id')
+              .annotate(total_stake=Sum('stake'), total_payout=Sum(F('stake') * F('odds')), bet_count=Count('id'))
+              .values_list('match_id', 'team_id', 'total_stake', 'total_payout', 'bet_count'))
+    return {(match_id, team_id): (stake, payout, count) for match_id, team_id, stake, payout, count in totals}
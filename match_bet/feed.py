@@ -0,0 +1,304 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+from .models import DataVersion, Match, MatchTeamRelation, Team
+from .odds import odds_matrix
+
+# In-process fan-out of live changes to the server-sent-events feed. Writers (ingest,
+# admin, recompute) publish the ids they changed once their transaction commits; the
+# payload is read and serialized once per change and the same frame is handed to every
+# connected client, so a change costs one DB read however many clients are listening.
+# Writes of other processes (the scrape_matches command, --watch) are picked up by the
+# ChangePoller, which watches the data version while clients are connected and diffs
+# the matches and team PRs when it moves. Clients should re-read the API on a 'resync'
+# event.
+
+# Frames buffered per client before it is considered too slow to keep up
+QUEUE_SIZE = 256
+
+# Seconds between keepalive comments on an idle stream
+HEARTBEAT_SECONDS = 15
+
+# Streams are closed after this many seconds and EventSource reconnects, so
+# streams of clients that went away without the server noticing don't pile up
+MAX_STREAM_SECONDS = 300
+
+# Reconnect delay sent to EventSource clients, in milliseconds
+RETRY_MS = 3000
+
+
+def sse_frame(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, cls=DjangoJSONEncoder)}')
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+RESYNC_FRAME = sse_frame('resync', {})
+
+
+class Subscriber:
+    def __init__(self, loop, queue_size=QUEUE_SIZE):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflows = 0
+
+    def push(self, frame):
+        # Runs on the subscriber's event loop. A client that fell a full queue behind
+        # loses its backlog and gets a single 'resync' instead, so a slow consumer
+        # never holds frames (or memory) for the others
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.overflows += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC_FRAME)
+
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # event loop -> set of subscribers
+        self._ids = itertools.count(1)
+
+    @property
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def subscribe(self, queue_size=QUEUE_SIZE):
+        subscriber = Subscriber(asyncio.get_running_loop(), queue_size)
+        with self._lock:
+            self._subscribers.setdefault(subscriber.loop, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.loop)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[subscriber.loop]
+
+    def publish(self, event, data):
+        # Thread safe, one callback per event loop fans the frame out to its subscribers
+        frame = sse_frame(event, data, next(self._ids))
+        with self._lock:
+            loops = [(loop, tuple(subscribers)) for loop, subscribers in self._subscribers.items()]
+        for loop, subscribers in loops:
+            try:
+                loop.call_soon_threadsafe(self._fan_out, subscribers, frame)
+            except RuntimeError:
+                # Event loop closed, its streams are gone
+                pass
+
+    @staticmethod
+    def _fan_out(subscribers, frame):
+        for subscriber in subscribers:
+            subscriber.push(frame)
+
+
+broker = Broker()
+
+
+async def stream_events(subscriber, max_seconds=MAX_STREAM_SECONDS, heartbeat=HEARTBEAT_SECONDS):
+    # SSE body of one client: queued frames, keepalive comments while idle, closed after
+    # max_seconds (EventSource reconnects after RETRY_MS)
+    deadline = time.monotonic() + max_seconds
+    try:
+        yield f'retry: {RETRY_MS}\n\n'.encode()
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                yield await asyncio.wait_for(subscriber.queue.get(), min(heartbeat, remaining))
+            except asyncio.TimeoutError:
+                yield b': keepalive\n\n'
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+class ChangeBatch:
+    def __init__(self):
+        self.matches = set()
+        self.teams = set()
+        self.flushed = False
+
+    def flush(self):
+        self.flushed = True
+        if self.matches:
+            broker.publish('matches', match_rows(self.matches))
+        if self.teams:
+            broker.publish('odds', odds_rows(self.teams))
+        # Already published, the poller mustn't send them again
+        change_poller.note(self.matches, self.teams)
+
+
+_pending = threading.local()
+
+
+def _current_batch():
+    # Changes made in the same transaction (e.g. an admin form and its inlines) are
+    # coalesced into one read and one event per kind. The batch is reused while its
+    # flush is still queued on the connection, a rolled back batch is never published
+    connection = transaction.get_connection()
+    batch = getattr(_pending, 'batch', None)
+    if batch is not None and not batch.flushed and connection.in_atomic_block and \
+            any(entry[1] == batch.flush for entry in connection.run_on_commit):
+        return batch, False
+    _pending.batch = ChangeBatch()
+    return _pending.batch, True
+
+
+def publish_matches(match_ids):
+    # New or changed matches (results included), published once the transaction commits
+    if broker.has_subscribers:
+        batch, created = _current_batch()
+        batch.matches.update(match_ids)
+        if created:
+            transaction.on_commit(batch.flush)
+
+
+def publish_teams(team_ids):
+    # Teams whose PR changed, published with the new odds of their upcoming matches
+    if broker.has_subscribers:
+        batch, created = _current_batch()
+        batch.teams.update(team_ids)
+        if created:
+            transaction.on_commit(batch.flush)
+
+
+def match_rows(match_ids):
+    # Same shape as the matches API
+    from .api import MATCH_FIELDS, attach_teams
+
+    return attach_teams(list(Match.objects.filter(id__in=match_ids).order_by('datetime', 'id')
+                             .values(*MATCH_FIELDS)))
+
+
+def odds_rows(team_ids):
+    # The teams' new PR and every upcoming match they play in, with its stored odds (the
+    # ones the matches API lists and bets lock in) and the odds of the teams' PR alone
+    teams = list(Team.objects.filter(id__in=team_ids).order_by('id').values('id', 'current_pr'))
+
+    pairings = {}
+    relations = (MatchTeamRelation.objects
+                 .filter(match__is_concluded=False,
+                         match__in=MatchTeamRelation.objects.filter(team_id__in=team_ids).values('match_id'))
+                 .order_by('match__datetime', 'match_id', '-is_team1')
+                 .values_list('match_id', 'team_id', 'match__current_odds'))
+    for match_id, team_id, current_odds in relations:
+        pairings.setdefault(match_id, (current_odds, []))[1].append(team_id)
+
+    matches = [{'id': match_id, 'teams': pairing, 'odds': current_odds, 'pr_odds': odds_matrix.odds(*pairing)}
+               for match_id, (current_odds, pairing) in pairings.items() if len(pairing) == 2]
+    return {'teams': teams, 'matches': matches}
+
+
+def match_signatures(match_ids=None):
+    # {match id: the values of its matches API row}, compared to find changed matches
+    from .api import MATCH_FIELDS
+
+    matches = Match.objects.all()
+    relations = MatchTeamRelation.objects.all()
+    if match_ids is not None:
+        matches = matches.filter(id__in=match_ids)
+        relations = relations.filter(match_id__in=match_ids)
+    signatures = {row[0]: list(row[1:]) for row in matches.values_list('id', *MATCH_FIELDS)}
+    for match_id, *values in (relations.order_by('match_id', '-is_team1', 'id')
+                              .values_list('match_id', 'team_id', 'is_winner', 'match_score', 'pr_delta')):
+        if match_id in signatures:
+            signatures[match_id].extend(values)
+    return signatures
+
+
+def team_prs(team_ids=None):
+    teams = Team.objects.all() if team_ids is None else Team.objects.filter(id__in=team_ids)
+    return dict(teams.values_list('id', 'current_pr'))
+
+
+class ChangePoller:
+    # Publishes the writes of other processes. While clients are connected a thread reads
+    # the data version every settings.FEED_POLL_INTERVAL seconds, and when it moved diffs
+    # the matches and team PRs against the previous read: changed and new matches go out
+    # as a 'matches' event, changed PRs as an 'odds' event and deletions as a 'resync'.
+    # The first read after clients connect is the baseline. Writes of this process are
+    # noted when they're published, so they aren't sent twice
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.version = None
+        self.matches = None  # id -> signature
+        self.teams = None  # id -> current PR
+
+    def start(self):
+        interval = getattr(settings, 'FEED_POLL_INTERVAL', None)
+        if not interval:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(interval,), name='feed-poller', daemon=True)
+                self._thread.start()
+
+    def _run(self, interval):
+        try:
+            while True:
+                with self._lock:
+                    if not broker.has_subscribers:
+                        # Stale once nobody listens, the next client starts from a new baseline
+                        self._thread = None
+                        self.version = self.matches = self.teams = None
+                        return
+                try:
+                    self.poll()
+                except Exception:
+                    traceback.print_exc()
+                time.sleep(interval)
+        finally:
+            connection.close()
+
+    def poll(self):
+        version = DataVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+        if version == self.version:
+            return
+        matches, teams = match_signatures(), team_prs()
+
+        with self._lock:
+            baseline = self.matches is None
+            if not baseline:
+                changed_matches = [match_id for match_id, signature in matches.items()
+                                   if self.matches.get(match_id) != signature]
+                changed_teams = [team_id for team_id, pr in teams.items() if self.teams.get(team_id) != pr]
+                deleted = bool(self.matches.keys() - matches.keys() or self.teams.keys() - teams.keys())
+            self.version, self.matches, self.teams = version, matches, teams
+        if baseline:
+            return
+
+        if deleted:
+            broker.publish('resync', {})
+        if changed_matches:
+            broker.publish('matches', match_rows(changed_matches))
+        if changed_teams:
+            broker.publish('odds', odds_rows(changed_teams))
+
+    def note(self, match_ids, team_ids):
+        # Records the current state of rows this process just published
+        if self.matches is None:
+            return
+        matches = match_signatures(match_ids) if match_ids else {}
+        teams = team_prs(team_ids) if team_ids else {}
+        with self._lock:
+            if self.matches is not None:
+                self.matches.update(matches)
+                self.teams.update(teams)
+
+
+change_poller = ChangePoller()
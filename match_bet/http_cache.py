@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared, pooled session so repeated scrapes reuse connections to the schedule site
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+REQUEST_TIMEOUT = 30
+
+
+class CachedResponse:
+    def __init__(self, url, status_code, text=None, etag=None, last_modified=None,
+                 content_hash=None, unchanged=False):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+        # True when the server answered 304, or the body is identical to the last ingested one
+        self.unchanged = unchanged
+
+
+class FetchCache:
+    # On-disk conditional-GET cache: keeps the ETag/Last-Modified validators and a
+    # content hash of the last successfully ingested body of each URL
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as cache_file:
+                return json.load(cache_file)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _store(self, url, entry):
+        with self._lock:
+            entries = self._load()
+            entries[url] = entry
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(entries, cache_file, indent=4)
+            os.replace(tmp_path, self.path)
+
+    def get(self, url, force=False):
+        # force skips the validators and always returns the fetched body
+        entry = {} if force else self._load().get(url, {})
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+
+        if response.status_code == 304:
+            return CachedResponse(url, 304, etag=entry.get('etag'), last_modified=entry.get('last_modified'),
+                                  content_hash=entry.get('content_hash'), unchanged=True)
+
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        cached = CachedResponse(url, response.status_code, response.text,
+                                etag=response.headers.get('ETag'),
+                                last_modified=response.headers.get('Last-Modified'),
+                                content_hash=content_hash)
+
+        if response.status_code == 200 and content_hash == entry.get('content_hash'):
+            # Same body as last time, only refresh the validators
+            cached.unchanged = True
+            self.commit(cached)
+
+        return cached
+
+    def commit(self, response):
+        # Record a response once its body has been ingested successfully
+        if response.status_code != 200:
+            return
+        self._store(response.url, {
+            'etag': response.etag,
+            'last_modified': response.last_modified,
+            'content_hash': response.content_hash,
+        })
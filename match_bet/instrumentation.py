@@ -0,0 +1,223 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.utils import timezone
+
+# Per-phase wall time, DB query count and DB time of a run (a scrape, an admin request).
+# Code marks its phases with `with phase('name'):`, which does nothing unless a
+# recording is active in the thread, so instrumented code costs one thread-local
+# lookup per phase when instrumentation is off. Phases can nest, a phase's totals
+# include the phases inside it, and a phase entered several times (ratings, once
+# per concluded set) adds up. Queries are counted through a connection execute
+# wrapper that is only installed while recording.
+#
+# Finished recordings are written to settings.INSTRUMENTATION_PATH (nothing is
+# written if it's not set) in settings.INSTRUMENTATION_FORMAT:
+#   'jsonl'       one {"run", "started_at", "phases": {name: totals}} object per line
+#   'prometheus'  a text exposition file of per (run, phase) counters, rewritten after
+#                 every run. The counters are per process, point a node_exporter
+#                 textfile collector at it when running a single process
+
+FORMATS = ('jsonl', 'prometheus')
+METRIC_PREFIX = 'octobet_phase'
+# Phase wrapping a whole run
+TOTAL = 'total'
+
+_local = threading.local()
+_prometheus_lock = threading.Lock()
+# (run, phase) -> [seconds, queries, db seconds, calls] since the process started
+_prometheus_totals = {}
+
+
+class Phase:
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.queries = self.recorder.queries
+        self.db_seconds = self.recorder.db_seconds
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        totals = self.recorder.phases.setdefault(self.name, [0.0, 0, 0.0, 0])
+        totals[0] += elapsed
+        totals[1] += self.recorder.queries - self.queries
+        totals[2] += self.recorder.db_seconds - self.db_seconds
+        totals[3] += 1
+
+
+class NoPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NO_PHASE = NoPhase()
+
+
+class Recorder:
+    def __init__(self, run):
+        self.run = run
+        self.started_at = timezone.now()
+        self.phases = {}  # name -> [seconds, queries, db seconds, calls]
+        self.queries = 0
+        self.db_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Connection execute wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += time.perf_counter() - started
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def as_dict(self):
+        return {
+            'run': self.run,
+            'started_at': self.started_at,
+            'phases': {name: {'seconds': round(seconds, 6), 'queries': queries,
+                              'db_seconds': round(db_seconds, 6), 'calls': calls}
+                       for name, (seconds, queries, db_seconds, calls) in self.phases.items()},
+        }
+
+    def summary(self):
+        # Lines of a plain text table of the phases, longest first
+        lines = [f"{'phase':<16}{'seconds':>10}{'queries':>9}{'db seconds':>12}{'calls':>8}"]
+        for name, (seconds, queries, db_seconds, calls) in sorted(
+                self.phases.items(), key=lambda item: -item[1][0]):
+            lines.append(f'{name:<16}{seconds:>10.4f}{queries:>9}{db_seconds:>12.4f}{calls:>8}')
+        return lines
+
+
+def phase(name):
+    recorder = getattr(_local, 'recorder', None)
+    if recorder is None:
+        return NO_PHASE
+    return recorder.phase(name)
+
+
+def is_enabled():
+    return bool(getattr(settings, 'INSTRUMENTATION_PATH', None))
+
+
+class recording:
+    # Records the phases of the run in this thread, the whole run is the TOTAL phase,
+    # and writes them out on exit. Does nothing (and yields None) when
+    # settings.INSTRUMENTATION_PATH isn't set, unless always is true (--profile).
+    # A recording inside another one (a scrape triggered by an admin request) only
+    # adds its phases to the outer one
+    def __init__(self, run, always=False):
+        self.run = run
+        self.always = always
+        self.recorder = None
+
+    def __enter__(self):
+        outer = getattr(_local, 'recorder', None)
+        if outer is not None:
+            return outer
+        if not (self.always or is_enabled()):
+            return None
+        self.recorder = Recorder(self.run)
+        self.wrapper = connection.execute_wrapper(self.recorder)
+        self.wrapper.__enter__()
+        self.total = self.recorder.phase(TOTAL)
+        self.total.__enter__()
+        _local.recorder = self.recorder
+        return self.recorder
+
+    def __exit__(self, *exc_info):
+        if self.recorder is None:
+            return
+        _local.recorder = None
+        self.total.__exit__(*exc_info)
+        self.wrapper.__exit__(*exc_info)
+        if is_enabled():
+            write(self.recorder)
+
+
+def write(recorder):
+    path = settings.INSTRUMENTATION_PATH
+    output_format = getattr(settings, 'INSTRUMENTATION_FORMAT', 'jsonl')
+    if output_format == 'jsonl':
+        write_jsonl(recorder, path)
+    elif output_format == 'prometheus':
+        write_prometheus(recorder, path)
+    else:
+        raise ValueError(f'INSTRUMENTATION_FORMAT must be one of {FORMATS}, got {output_format!r}')
+
+
+def write_jsonl(recorder, path):
+    line = json.dumps(recorder.as_dict(), cls=DjangoJSONEncoder, separators=(',', ':')) + '\n'
+    # One write call per line, so concurrent runs don't interleave their lines
+    with open(path, 'a') as file:
+        file.write(line)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(totals):
+    metrics = [('seconds_total', 'Wall time spent in the phase', 0),
+               ('queries_total', 'DB queries run in the phase', 1),
+               ('db_seconds_total', 'Time spent in DB queries in the phase', 2),
+               ('calls_total', 'Times the phase was entered', 3)]
+    lines = []
+    for suffix, help_text, index in metrics:
+        name = f'{METRIC_PREFIX}_{suffix}'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for (run, phase_name), values in sorted(totals.items()):
+            lines.append(f'{name}{{run="{escape_label(run)}",phase="{escape_label(phase_name)}"}} {values[index]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(recorder, path):
+    with _prometheus_lock:
+        for name, values in recorder.phases.items():
+            totals = _prometheus_totals.setdefault((recorder.run, name), [0.0, 0, 0.0, 0])
+            for index, value in enumerate(values):
+                totals[index] += value
+        text = prometheus_text(_prometheus_totals)
+
+        # Replaced atomically, a scrape never reads a half written file
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as file:
+            file.write(text)
+        os.replace(file.name, path)
+
+
+class InstrumentationMiddleware:
+    # Records every admin request as a run named after its view, the view's own phases
+    # (update_best_of's ratings...) included. Removed from the middleware chain at
+    # startup when settings.INSTRUMENTATION_PATH isn't set
+    def __init__(self, get_response):
+        if not is_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith('/admin/'):
+            return self.get_response(request)
+
+        with recording('admin') as recorder:
+            response = self.get_response(request)
+            if request.resolver_match is not None:
+                # e.g. admin:match_bet_match_changelist
+                recorder.run = request.resolver_match.view_name
+        return response
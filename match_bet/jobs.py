@@ -0,0 +1,108 @@
+import threading
+import time
+import traceback
+
+from django.db import connection
+from django.utils import timezone
+
+from .instrumentation import recording
+from .management.commands.scrape_matches import run_scrape
+
+# In-process, single-flight job runner for the scraper. A trigger while a scrape
+# is queued or running joins that run instead of starting a second ingest, so two
+# admins clicking at once can never apply the same results (and PR adjustments) twice.
+# Note that this coalesces within one server process only.
+
+_lock = threading.Lock()
+_current_job = None
+_last_job = None
+
+
+class ScrapeJob:
+    def __init__(self):
+        self.phase = 'queued'
+        self.queued_at = timezone.now()
+        self.started_at = None
+        self.finished_at = None
+        self.timings = {}  # seconds spent per phase
+        self.counts = None
+        self.error = None
+        self._phase_started = None
+
+    @property
+    def is_running(self):
+        return self.finished_at is None
+
+    def set_phase(self, phase):
+        now = time.monotonic()
+        if self._phase_started is not None:
+            self.timings[self.phase] = round(now - self._phase_started, 4)
+        self.phase = phase
+        self._phase_started = now
+
+    def run(self):
+        global _current_job, _last_job
+
+        self.started_at = timezone.now()
+        try:
+            with recording('scrape_job'):
+                counts = run_scrape(progress=self.set_phase)
+            if counts is None:
+                # Page unchanged since the last scrape, parsing and ingest were skipped
+                self.set_phase('unchanged')
+            else:
+                new_count, update_count, unchanged_count, skipped_count, unknown_count = counts
+                self.counts = {
+                    'new': new_count,
+                    'updated': update_count,
+                    'unchanged': unchanged_count,
+                    'skipped': skipped_count,
+                    'unknown': unknown_count,
+                }
+                self.set_phase('done')
+        except Exception as e:
+            # Only the message is shown in the status, the traceback goes to the server's stderr
+            traceback.print_exc()
+            self.error = str(e) or type(e).__name__
+            self.set_phase('failed')
+        finally:
+            # The worker thread owns its own DB connection
+            connection.close()
+            self.finished_at = timezone.now()
+            with _lock:
+                _current_job = None
+                _last_job = self
+
+    def as_dict(self):
+        return {
+            'phase': self.phase,
+            'queued_at': self.queued_at.isoformat(),
+            'started_at': self.started_at and self.started_at.isoformat(),
+            'finished_at': self.finished_at and self.finished_at.isoformat(),
+            'timings': self.timings,
+            'counts': self.counts,
+            'error': self.error,
+        }
+
+
+def enqueue_scrape():
+    # Returns (job, created); created is False when the trigger was coalesced
+    # into a scrape that is already in flight
+    global _current_job
+
+    with _lock:
+        if _current_job is not None:
+            return _current_job, False
+        job = _current_job = ScrapeJob()
+
+    threading.Thread(target=job.run, name='scrape-job', daemon=True).start()
+    return job, True
+
+
+def scrape_status():
+    # Status of the in-flight scrape, or else of the last finished one
+    with _lock:
+        job = _current_job or _last_job
+    if job is None:
+        return {'phase': 'idle'}
+    return job.as_dict()
@@ -0,0 +1,113 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+
+from ...betting import BetRejected, place_bet
+from ...models import Bet, Match, MatchTeamRelation, OddsHistory, Team, Tournament, User
+from ...odds import odds_repricer
+from ...synthetic import throwaway_database
+
+
+def create_bet_fixtures(users, balance, matches=10):
+    # Users with the given balance and upcoming matches with odds to bet on.
+    # Returns (user ids, [(match id, team ids)])
+    user_ids = [User.objects.create(name=f'User {i}', balance=balance).id for i in range(users)]
+
+    tournament = Tournament.objects.default()
+    teams = [Team.objects.create(tournament=tournament, name=f'Team {i}', acronym=f'T{i}', base_pr=2 + i % 10,
+                                 current_pr=2 + i % 10, seed=1, origin='lck')
+             for i in range(matches * 2)]
+    pairings = []
+    for i in range(matches):
+        team1, team2 = teams[2 * i], teams[2 * i + 1]
+        match = Match.objects.create(tournament=tournament, datetime=f'2023-10-10T{i % 24:02}:00:00+00:00',
+                                     current_odds=(1.9, 2.1))
+        MatchTeamRelation.objects.create(match=match, team=team1, is_team1=True)
+        MatchTeamRelation.objects.create(match=match, team=team2, is_team1=False)
+        pairings.append((match.id, (team1.id, team2.id)))
+    return user_ids, pairings
+
+
+def run_bet_stress(user_ids, pairings, threads, bets_per_thread, stake, seed=0):
+    # Places bets from several threads at once, each thread on its own connection.
+    # Returns (placed, rejected, seconds)
+    placed = [0] * threads
+    rejected = [0] * threads
+    errors = []
+    start = threading.Barrier(threads + 1)
+
+    def worker(n):
+        rnd = random.Random(seed + n)
+        try:
+            start.wait()
+            for _ in range(bets_per_thread):
+                match_id, team_ids = rnd.choice(pairings)
+                try:
+                    place_bet(rnd.choice(user_ids), match_id, rnd.choice(team_ids), stake)
+                    placed[n] += 1
+                except BetRejected:
+                    rejected[n] += 1
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    if errors:
+        raise errors[0]
+    return sum(placed), sum(rejected), elapsed
+
+
+def check_balances(balance):
+    # Every user's balance is the starting balance less their stakes, and never negative.
+    # Returns the users that don't add up
+    stakes = dict(Bet.objects.values('user_id').annotate(total=Sum('stake')).values_list('user_id', 'total'))
+    return [user for user in User.objects.all()
+            if user.balance < 0 or abs(balance - stakes.get(user.id, 0) - user.balance) > 1e-6]
+
+
+class Command(BaseCommand):
+    help = 'Measure concurrent bet placement on a throwaway SQLite database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--bets', type=int, default=500, help='Bets placed by each thread')
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--balance', type=float, default=1000)
+        parser.add_argument('--stake', type=float, default=10)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('benchmark_bets runs on SQLite only')
+
+        with throwaway_database() as journal_mode:
+            try:
+                user_ids, pairings = create_bet_fixtures(options['users'], options['balance'])
+                placed, rejected, elapsed = run_bet_stress(
+                    user_ids, pairings, options['threads'], options['bets'], options['stake'])
+                odds_repricer.flush()
+                odds_changes = OddsHistory.objects.count()
+                mismatched = check_balances(options['balance'])
+            finally:
+                odds_repricer.cancel()
+
+        self.stdout.write(
+            f"{placed} bets placed, {rejected} rejected by {options['threads']} threads in {elapsed:.2f}s "
+            f"({(placed + rejected) / elapsed:.0f} attempts/s, {placed / elapsed:.0f} bets/s, "
+            f"journal mode {journal_mode})")
+        self.stdout.write(f'{len(pairings)} matches repriced {odds_changes} times')
+        if mismatched:
+            raise CommandError(f'{len(mismatched)} users have a balance that does not match their bets')
+        self.stdout.write(self.style.SUCCESS('Balances match the placed bets, none negative'))
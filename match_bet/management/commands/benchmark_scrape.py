@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from itertools import islice
+
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand
+
+from ...adapters import get_adapter
+from ...synthetic import schedule_page, synthetic_fixtures
+from .scrape_matches import iter_page_data, stream_batch_size, stream_parser
+
+
+def current_pipeline(html, json_path, selector):
+    # Full parse, materialized element list, scrape_data.json round trip, decoding
+    adapter = get_adapter()
+    soup = BeautifulSoup(html, 'html.parser')
+    extracted_data = [data.text for data in soup.select(selector)]
+    with open(json_path, 'w') as json_file:
+        json.dump({"data": extracted_data}, json_file, indent=4)
+    with open(json_path, 'r') as json_file:
+        extracted_list = json.load(json_file).get("data") or []
+    return len(list(adapter.fixtures(adapter.group(extracted_list))))
+
+
+def streaming_pipeline(html, json_path, selector):
+    # Table-only parse, decoded sets consumed in ingest-sized batches
+    adapter = get_adapter()
+    fixtures = adapter.fixtures(adapter.group(iter_page_data(html, selector)))
+    count = 0
+    while batch := list(islice(fixtures, stream_batch_size)):
+        count += len(batch)
+    return count
+
+
+class Command(BaseCommand):
+    help = 'Compare wall time and peak memory of the scrape pipelines on a synthetic schedule page'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--matches', type=int, default=10000)
+        parser.add_argument('--filler', type=int, default=5000,
+                            help='Blocks of non-schedule content on the page')
+        parser.add_argument('--repeat', type=int, default=1)
+        # ':nth-of-type' selectors (like the default one) are quadratic in the number of
+        # rows in soupsieve and would dominate both pipelines on a large page
+        parser.add_argument('--selector', default='tr.ml-row td')
+
+    def handle(self, *args, **options):
+        acronyms = [f'T{i}' for i in range(64)]
+        html = schedule_page(synthetic_fixtures(acronyms, options['matches']),
+                             filler_paragraphs=options['filler'])
+        self.stdout.write(
+            f"Page: {len(html) / 1e6:.1f} MB, {options['matches']} matches, stream parser: {stream_parser}")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_path = os.path.join(tmp_dir, 'scrape_data.json')
+            for name, pipeline in [('current', current_pipeline), ('streaming', streaming_pipeline)]:
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    count = pipeline(html, json_path, options['selector'])
+                    timings.append(time.perf_counter() - started)
+
+                # Memory is measured on a separate run, tracemalloc slows allocation down
+                tracemalloc.start()
+                pipeline(html, json_path, options['selector'])
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                self.stdout.write(
+                    f'{name:>10}: {count} sets, best {min(timings):.3f}s, peak memory {peak / 1e6:.1f} MB')
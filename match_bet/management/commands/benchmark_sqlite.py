@@ -0,0 +1,141 @@
+import io
+import random
+import threading
+import time
+from contextlib import redirect_stdout
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+
+from ...models import Match, MatchTeamRelation, Team, Tournament
+from ...synthetic import synthetic_fixtures, throwaway_database
+from .scrape_matches import ingest_fixtures
+
+# SQLite's own defaults (and the sqlite3 module's 5 second timeout)
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+    'busy_timeout': 5000,
+    'mmap_size': 0,
+    'cache_size': -2000,
+}
+
+# Indexes added for the hot lookups, dropped for the baseline run
+HOT_INDEXES = [
+    ('match_bet_team', ['tournament_id', 'acronym']),
+    ('match_bet_match', ['tournament_id', 'stage']),
+    ('match_bet_matchteamrelation', ['match_id', 'is_team1']),
+]
+HOT_PARTIAL_INDEXES = ['match_upcoming_idx', 'match_concluded_idx']
+
+
+def drop_hot_indexes():
+    with connection.cursor() as cursor:
+        for table, columns in HOT_INDEXES:
+            constraints = connection.introspection.get_constraints(cursor, table)
+            for name, constraint in constraints.items():
+                if constraint['index'] and not constraint['unique'] and constraint['columns'] == columns:
+                    cursor.execute(f'DROP INDEX "{name}"')
+        for name in HOT_PARTIAL_INDEXES:
+            cursor.execute(f'DROP INDEX "{name}"')
+
+
+def read_operations(tournament_id, acronyms, match_ids):
+    # The admin/API/ingest lookups the indexes are for
+    return [
+        lambda rnd: Team.objects.filter(tournament_id=tournament_id, acronym=rnd.choice(acronyms)).first(),
+        lambda rnd: list(Match.objects.filter(tournament_id=tournament_id, is_concluded=False, stage='swiss')
+                         .order_by('datetime').values_list('id', flat=True)[:50]),
+        lambda rnd: Match.objects.filter(tournament_id=tournament_id, is_concluded=True).count(),
+        lambda rnd: list(MatchTeamRelation.objects.filter(match_id=rnd.choice(match_ids))
+                         .order_by('-is_team1').values_list('team_id', flat=True)),
+    ]
+
+
+def write_operations(team_ids, match_ids):
+    # Odds and rating changes, the writes that run while the site is being read
+    def reprice(rnd):
+        match = Match.objects.only('id', 'current_odds').get(id=rnd.choice(match_ids))
+        match.update_current_odds((round(rnd.uniform(1.1, 3), 2), round(rnd.uniform(1.1, 3), 2)))
+
+    def adjust_pr(rnd):
+        Team.objects.filter(id=rnd.choice(team_ids)).update(current_pr=round(rnd.uniform(1, 10), 4))
+
+    return [reprice, adjust_pr]
+
+
+def run_mixed_load(operations, readers, writers, seconds):
+    # Runs read and write operations from their own threads for the given time.
+    # Returns (reads, writes, locked errors)
+    counts = {'read': 0, 'write': 0, 'locked': 0}
+    lock = threading.Lock()
+    start = threading.Barrier(readers + writers)
+
+    def worker(n, kind):
+        rnd = random.Random(n)
+        done = locked = 0
+        try:
+            start.wait()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                try:
+                    rnd.choice(operations[kind])(rnd)
+                    done += 1
+                except OperationalError:
+                    locked += 1
+        finally:
+            connection.close()
+            with lock:
+                counts[kind] += done
+                counts['locked'] += locked
+
+    threads = [threading.Thread(target=worker, args=(n, 'read')) for n in range(readers)]
+    threads += [threading.Thread(target=worker, args=(readers + n, 'write')) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts['read'], counts['write'], counts['locked']
+
+
+class Command(BaseCommand):
+    help = 'Compare mixed read/write throughput with SQLite defaults and with SQLITE_PRAGMAS and the hot indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--teams', type=int, default=64)
+        parser.add_argument('--matches', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('benchmark_sqlite runs on SQLite only')
+
+        runs = [('before', DEFAULT_PRAGMAS, True), ('after', settings.SQLITE_PRAGMAS, False)]
+        for name, pragmas, without_indexes in runs:
+            with override_settings(SQLITE_PRAGMAS=pragmas), throwaway_database() as journal_mode:
+                tournament = Tournament.objects.default()
+                acronyms = [f'T{i}' for i in range(options['teams'])]
+                Team.objects.bulk_create([Team(tournament=tournament, name=acronym, acronym=acronym,
+                                               base_pr=2 + i % 10, current_pr=2 + i % 10, seed=1, origin='lck')
+                                          for i, acronym in enumerate(acronyms)])
+                with redirect_stdout(io.StringIO()):
+                    ingest_fixtures(synthetic_fixtures(acronyms, options['matches']), tournament=tournament)
+                if without_indexes:
+                    drop_hot_indexes()
+
+                team_ids = list(Team.objects.values_list('id', flat=True))
+                match_ids = list(Match.objects.values_list('id', flat=True))
+                operations = {'read': read_operations(tournament.id, acronyms, match_ids),
+                              'write': write_operations(team_ids, match_ids)}
+                reads, writes, locked = run_mixed_load(
+                    operations, options['readers'], options['writers'], options['seconds'])
+
+            seconds = options['seconds']
+            self.stdout.write(
+                f'{name:>6} (journal {journal_mode}, synchronous {pragmas.get("synchronous")}, '
+                f'{"without" if without_indexes else "with"} indexes): '
+                f'{reads / seconds:.0f} reads/s, {writes / seconds:.0f} writes/s, {locked} locked errors')
@@ -0,0 +1,249 @@
+import io
+import json
+import os
+import random
+import time
+from contextlib import redirect_stdout
+from itertools import combinations, islice
+
+from django.conf import settings
+from django.contrib.auth.models import User as AdminUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from ...adapters import get_adapter
+from ...models import Tournament
+from ...ratings import elo_update, pr_to_odds
+from ...synthetic import create_synthetic_league, synthetic_fixtures, synthetic_teams, team_csv, throwaway_database
+from .create_teams import import_teams, read_teams
+from .scrape_matches import ingest_fixtures
+
+# Offline benchmarks of the hot paths on a synthetic league in a throwaway database.
+# Each case reports its best time per operation over the repeats, divided by the best
+# time of a reference workload timed in the same run so that the baselines recorded
+# for the scale in BASELINES_FILE_PATH ('--record' rewrites it) hold on any machine
+
+BASELINES_FILE_PATH = 'benchmark_baselines.json'
+# A case is a regression when its relative time per operation is this many times its baseline
+TOLERANCE = 1.5
+# The reference workload: Elo updates (Python) and single row queries (SQLite)
+REFERENCE_ELO_UPDATES = 20000
+REFERENCE_QUERIES = 500
+
+SCALES = {
+    'small': {'teams': 16, 'matches': 200, 'users': 20, 'bets': 500},
+    'realistic': {'teams': 64, 'matches': 2000, 'users': 200, 'bets': 10000},
+    'stress': {'teams': 2000, 'matches': 40000, 'users': 2000, 'bets': 50000},
+}
+
+
+def bench_ingest(league, scale, run):
+    # Scraped sets into an empty tournament with the league's teams (new matches,
+    # results and PR adjustments)
+    tournament = Tournament.objects.create(slug=f'bench-ingest-{run}', name='Ingest benchmark')
+    import_teams(synthetic_teams(league['acronyms']), tournament)
+    fixtures = synthetic_fixtures(league['acronyms'], scale['matches'], seed=run + 1)
+    with redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        ingest_fixtures(fixtures, tournament=tournament)
+        return time.perf_counter() - started, len(fixtures)
+
+
+def bench_decode(league, scale, run):
+    # Grouping, decoding and date parsing of a page's cells by the default adapter,
+    # the scraper's per-row loop before ingest (date cache cleared)
+    adapter = get_adapter()
+    cells = [cell for row in synthetic_fixtures(league['acronyms'], scale['matches'], seed=run) for cell in row]
+    adapter.parse_date.cache_clear()
+    started = time.perf_counter()
+    fixtures = list(adapter.fixtures(adapter.group(cells)))
+    return time.perf_counter() - started, len(fixtures)
+
+
+def bench_create_teams(league, scale, run):
+    # CSV parsing and upsert of the league's teams into a new tournament
+    csv_text = team_csv(synthetic_teams(league['acronyms'], seed=run))
+    tournament = Tournament.objects.create(slug=f'bench-teams-{run}', name='Teams benchmark')
+    started = time.perf_counter()
+    teams, _ = read_teams(io.StringIO(csv_text))
+    import_teams(teams, tournament)
+    return time.perf_counter() - started, len(teams)
+
+
+def bench_elo(league, scale, run):
+    # Rating updates of random results between the league's teams
+    rnd = random.Random(run)
+    prs = dict(league['prs'])
+    results = [(*rnd.sample(league['acronyms'], 2), rnd.random() < 0.5) for _ in range(scale['matches'])]
+    started = time.perf_counter()
+    for team1, team2, team1_is_win in results:
+        prs[team1], prs[team2] = elo_update(prs[team1], prs[team2], team1_is_win)
+    return time.perf_counter() - started, len(results)
+
+
+def bench_pr_to_odds(league, scale, run):
+    # Odds of every pairing of teams (capped at 10 per match of the scale)
+    pairs = list(islice(combinations(league['teams'], 2), scale['matches'] * 10))
+    started = time.perf_counter()
+    for team1, team2 in pairs:
+        pr_to_odds(team1, team2)
+    return time.perf_counter() - started, len(pairs)
+
+
+def bench_admin_changelist(league, scale, run):
+    # One render of the match changelist (first page) of the league's tournament
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = league['client'].get(league['changelist_url'])
+        elapsed = time.perf_counter() - started
+    if response.status_code != 200:
+        raise CommandError(f'Match changelist returned {response.status_code}')
+    league['changelist_queries'] = len(queries)
+    return elapsed, 1
+
+
+CASES = {
+    'ingest': bench_ingest,
+    'decode': bench_decode,
+    'create_teams': bench_create_teams,
+    'elo': bench_elo,
+    'pr_to_odds': bench_pr_to_odds,
+    'admin_changelist': bench_admin_changelist,
+}
+
+
+def setup_league(scale, seed=0):
+    # The synthetic league the cases run against, and a logged in admin client
+    tournament = Tournament.objects.create(slug='bench-league', name='Benchmark league')
+    acronyms = create_synthetic_league(tournament, seed=seed, **scale)
+    teams = list(tournament.teams.order_by('id'))
+
+    client = Client()
+    client.force_login(AdminUser.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark'))
+    return {
+        'tournament': tournament,
+        'acronyms': acronyms,
+        'teams': teams,
+        'prs': {team.acronym: team.current_pr for team in teams},
+        'client': client,
+        'changelist_url': f"{reverse('admin:match_bet_match_changelist')}?tournament__id__exact={tournament.id}",
+    }
+
+
+def time_reference(repeat=3):
+    # Best seconds per operation of the reference workload, the unit of the baselines
+    runs = []
+    for _ in range(repeat):
+        pr1, pr2 = 1500, 1500
+        started = time.perf_counter()
+        for i in range(REFERENCE_ELO_UPDATES):
+            pr1, pr2 = elo_update(pr1, pr2, i % 3 == 0)
+        with connection.cursor() as cursor:
+            for i in range(REFERENCE_QUERIES):
+                cursor.execute('SELECT id FROM match_bet_team WHERE id = %s', [i])
+                cursor.fetchone()
+        runs.append(time.perf_counter() - started)
+    return min(runs) / (REFERENCE_ELO_UPDATES + REFERENCE_QUERIES)
+
+
+def run_suite(scale, cases=CASES, repeat=3, seed=0):
+    # ({case: (best seconds, operations)}, best seconds per reference operation,
+    # queries of a changelist render) of the cases on a league of the scale, built
+    # in the current database
+    league = setup_league(scale, seed=seed)
+    results = {}
+    # The test client's requests must pass the host check
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        league['client'].get(league['changelist_url'])  # Warm up per-process caches
+        reference = time_reference(repeat)
+        for name in cases:
+            runs = [CASES[name](league, scale, run) for run in range(repeat)]
+            results[name] = min(runs)
+    return results, reference, league.get('changelist_queries')
+
+
+def compare(results, reference, baselines):
+    # [(case, seconds per operation, relative time per operation, baseline, ratio)],
+    # ratio and baseline are None for the cases without a baseline
+    rows = []
+    for name, (seconds, operations) in results.items():
+        per_op = seconds / operations
+        relative = per_op / reference
+        baseline = baselines.get(name)
+        rows.append((name, per_op, relative, baseline, relative / baseline if baseline else None))
+    return rows
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baselines_file:
+        return json.load(baselines_file)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark scrape ingest, row decoding, create_teams, Elo updates, pr_to_odds and the admin match changelist ' \
+           'on a synthetic league, against recorded baselines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='realistic')
+        parser.add_argument('--case', action='append', choices=CASES, dest='cases',
+                            help='Case to run, can be repeated (default: all)')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--baselines', default=BASELINES_FILE_PATH)
+        parser.add_argument('--record', action='store_true',
+                            help="Save the results as the scale's baselines instead of comparing")
+        parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                            help='Slowdown factor over the baseline reported as a regression')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('benchmark_suite runs on SQLite only')
+
+        scale_name = options['scale']
+        scale = SCALES[scale_name]
+        cases = options['cases'] or list(CASES)
+        self.stdout.write(f"Scale {scale_name}: {', '.join(f'{value} {key}' for key, value in scale.items())}")
+
+        with throwaway_database():
+            started = time.perf_counter()
+            results, reference, changelist_queries = run_suite(scale, cases, repeat=options['repeat'])
+        self.stdout.write(f'Done in {time.perf_counter() - started:.1f}s (league setup included), '
+                          f'reference {reference * 1e6:.2f}us per operation')
+
+        all_baselines = load_baselines(options['baselines'])
+        baselines = all_baselines.get(scale_name, {})
+        rows = compare(results, reference, baselines)
+
+        self.stdout.write(f"{'case':<18}{'per op':>12}{'relative':>10}{'baseline':>10}{'ratio':>8}")
+        regressions = []
+        for name, per_op, relative, baseline, ratio in rows:
+            self.stdout.write(f"{name:<18}{per_op * 1e6:>10.1f}us{relative:>10.1f}"
+                              f"{'' if baseline is None else f'{baseline:.1f}':>10}"
+                              f"{'' if ratio is None else f'{ratio:.2f}':>8}")
+            if ratio is not None and ratio > options['tolerance']:
+                regressions.append(name)
+        if changelist_queries is not None:
+            self.stdout.write(f'admin_changelist ran {changelist_queries} queries')
+
+        if options['record']:
+            all_baselines[scale_name] = {**baselines, **{name: relative for name, _, relative, _, _ in rows}}
+            with open(options['baselines'], 'w') as baselines_file:
+                json.dump(all_baselines, baselines_file, indent=4, sort_keys=True)
+                baselines_file.write('\n')
+            self.stdout.write(self.style.SUCCESS(f"Baselines of the {scale_name} scale saved to {options['baselines']}"))
+            return
+
+        missing = [name for name, _, _, baseline, _ in rows if baseline is None]
+        if len(missing) == len(rows):
+            self.stdout.write(self.style.WARNING(f"No baselines for the {scale_name} scale in {options['baselines']}, "
+                                                 f"comparison skipped (run with --record to save them)"))
+            return
+        if missing:
+            self.stdout.write(self.style.WARNING(f"No baselines for {', '.join(missing)}, not compared"))
+        if regressions:
+            raise CommandError(f"Slower than {options['tolerance']}x the baseline: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS('No regressions'))
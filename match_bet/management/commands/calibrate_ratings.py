@@ -0,0 +1,184 @@
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...ratings import ELO, K, PR_SCALE
+from .recompute_ratings import load_history
+
+CALIBRATION_BUCKETS = 10
+EPSILON = 1e-6
+
+_history = None
+
+
+def parse_grid(value):
+    # '8,16,24' or an inclusive 'start:stop:step' range such as '8:40:2'
+    values = []
+    for part in value.split(','):
+        if ':' in part:
+            start, stop, step = (float(x) for x in part.split(':'))
+            count = int(round((stop - start) / step)) + 1
+            values.extend(round(start + i * step, 6) for i in range(count))
+        else:
+            values.append(float(part))
+    return values
+
+
+def _init_worker(base_prs, fixtures):
+    global _history
+    _history = (base_prs, fixtures)
+
+
+def evaluate(params, predictor='odds'):
+    # Replays the history with the given (k, scale, base) and scores the win
+    # probability predicted for team 1 before each match
+    k, scale, base = params
+    base_prs, fixtures = _history
+    prs = list(base_prs)
+
+    log_loss = 0
+    brier = 0
+    correct = 0
+    buckets = [[0, 0, 0] for _ in range(CALIBRATION_BUCKETS)]  # count, predicted, observed
+    log = math.log
+
+    # Same math as pr_to_odds / pr_to_elo / elo_update, inlined since this
+    # loop runs once per match for every parameter set
+    for team1, team2, team1_is_win in fixtures:
+        pr1, pr2 = prs[team1], prs[team2]
+        if predictor == 'odds' and (pr1 >= scale or pr2 >= scale):
+            # PRs past the scale have no (or a negative) win weight, the parameter set is unusable
+            return {'k': k, 'scale': scale, 'base': base, 'log_loss': math.inf,
+                    'brier': math.inf, 'accuracy': 0, 'buckets': buckets, 'invalid': True}
+
+        processed_pr1 = 1 - round(pr1 / scale, 4)
+        processed_pr2 = 1 - round(pr2 / scale, 4)
+        elo1 = processed_pr1 * base
+        elo2 = processed_pr2 * base
+        expected_score1 = 1 / (1 + (10 ** ((elo2 - elo1) / 400)))
+        expected_score2 = 1 / (1 + (10 ** ((elo1 - elo2) / 400)))
+
+        if predictor == 'elo':
+            probability = expected_score1
+        else:
+            probability = processed_pr1 / (processed_pr1 + processed_pr2)
+        probability = min(max(probability, EPSILON), 1 - EPSILON)
+
+        outcome = 1 if team1_is_win else 0
+        log_loss -= log(probability) if outcome else log(1 - probability)
+        brier += (probability - outcome) ** 2
+        correct += (probability > 0.5) == outcome
+
+        bucket = buckets[min(int(probability * CALIBRATION_BUCKETS), CALIBRATION_BUCKETS - 1)]
+        bucket[0] += 1
+        bucket[1] += probability
+        bucket[2] += outcome
+
+        elo1 += k * (outcome - expected_score1)
+        elo2 += k * ((1 - outcome) - expected_score2)
+        prs[team1] = round((1 - (elo1 / base)) * scale, 4)
+        prs[team2] = round((1 - (elo2 / base)) * scale, 4)
+
+    count = len(fixtures) or 1
+    return {
+        'k': k,
+        'scale': scale,
+        'base': base,
+        'log_loss': log_loss / count,
+        'brier': brier / count,
+        'accuracy': correct / count,
+        'buckets': buckets,
+        'invalid': False,
+    }
+
+
+def load_history_file(path):
+    with open(path, 'r') as history_file:
+        history = json.load(history_file)
+    return history['base_prs'], [tuple(fixture) for fixture in history['fixtures']]
+
+
+class Command(BaseCommand):
+    help = 'Backtest the rating model over a grid of K / PR scale / ELO base parameters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', default='4:48:2', help="K values, e.g. '8,16,24' or '4:48:2' (inclusive)")
+        parser.add_argument('--scale', default='12:30:1', help='PR scale values (18 in pr_to_odds/pr_to_elo)')
+        parser.add_argument('--base', default=str(ELO), help='ELO base values')
+        parser.add_argument('--predictor', choices=['odds', 'elo'], default='odds',
+                            help="Score the pr_to_odds win probability ('odds') or the ELO expected score")
+        parser.add_argument('--input', help='Replay a history file written by --export instead of the DB')
+        parser.add_argument('--export', help='Write the DB history to this file and exit')
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--top', type=int, default=10)
+
+    def handle(self, *args, **options):
+        if options['input']:
+            base_prs, fixtures = load_history_file(options['input'])
+        else:
+            _, base_prs, fixtures, _, _ = load_history()
+
+        if options['export']:
+            with open(options['export'], 'w') as history_file:
+                json.dump({'base_prs': base_prs, 'fixtures': fixtures}, history_file)
+            self.stdout.write(self.style.SUCCESS(
+                f"Exported {len(fixtures)} matches to {options['export']}"))
+            return
+
+        if not fixtures:
+            raise CommandError('No concluded matches to backtest')
+
+        grid = list(itertools.product(
+            parse_grid(options['k']), parse_grid(options['scale']), parse_grid(options['base'])))
+        workers = max(1, min(options['workers'] or 1, len(grid)))
+
+        started = time.perf_counter()
+        if workers == 1:
+            _init_worker(base_prs, fixtures)
+            results = [evaluate(params, options['predictor']) for params in grid]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(base_prs, fixtures)) as executor:
+                results = list(executor.map(
+                    evaluate, grid, itertools.repeat(options['predictor']),
+                    chunksize=max(1, len(grid) // (workers * 4))))
+        elapsed = time.perf_counter() - started
+
+        results.sort(key=lambda result: (result['log_loss'], result['brier']))
+        invalid_count = sum(result['invalid'] for result in results)
+
+        self.stdout.write(
+            f'Backtested {len(grid)} parameter sets over {len(fixtures)} matches '
+            f'in {elapsed:.2f}s ({workers} workers)')
+        if invalid_count:
+            self.stdout.write(self.style.WARNING(
+                f'{invalid_count} parameter sets pushed a PR past the scale and are ranked last'))
+        self.stdout.write(f"{'rank':>4} {'K':>7} {'scale':>7} {'base':>7} {'log-loss':>9} {'brier':>7} {'acc':>6}")
+        for rank, result in enumerate(results[:options['top']], 1):
+            self.write_result(rank, result)
+
+        current = next((result for result in results
+                        if (result['k'], result['scale'], result['base']) == (K, PR_SCALE, ELO)), None)
+        if current is not None:
+            self.stdout.write('Current constants:')
+            self.write_result(results.index(current) + 1, current)
+
+        for label, result in [('best', results[0]), ('current', current)]:
+            if result is None:
+                continue
+            self.stdout.write(f'Calibration ({label}): predicted vs observed team 1 win rate')
+            for i, (count, predicted, observed) in enumerate(result['buckets']):
+                if count:
+                    self.stdout.write(
+                        f'  {i / CALIBRATION_BUCKETS:.1f}-{(i + 1) / CALIBRATION_BUCKETS:.1f}: '
+                        f'{count:>6} matches, predicted {predicted / count:.3f}, observed {observed / count:.3f}')
+
+    def write_result(self, rank, result):
+        self.stdout.write(
+            f"{rank:>4} {result['k']:>7g} {result['scale']:>7g} {result['base']:>7g} "
+            f"{result['log_loss']:>9.4f} {result['brier']:>7.4f} {result['accuracy']:>6.3f}")
@@ -1,32 +1,158 @@
-from django.core.management.base import BaseCommand
 import csv
-from ...models import Team
+import math
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ...feed import publish_matches, publish_teams
+from ...models import DataVersion, Match, Team, Tournament
+
+CSV_FILE_PATH = 'team_info.csv'
+CSV_FIELDS = ('name', 'acronym', 'base_pr', 'seed', 'origin')
+# Fields an import overwrites, current_pr is only set for new teams (it's replayed from the matches)
+IMPORTED_FIELDS = ('name', 'base_pr', 'seed', 'origin')
+BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 20
+
+ORIGINS = {value for value, _ in Team.ORIGIN_CHOICES}
+SEEDS = {value for value, _ in Team.SEEDING_CHOICES}
+NAME_LENGTH = Team._meta.get_field('name').max_length
+ACRONYM_LENGTH = Team._meta.get_field('acronym').max_length
+
+
+def parse_team_row(row):
+    # {field: value} of one CSV row, raises ValueError naming the first invalid field.
+    # The CSV pads its cells with spaces and writes the seed as '2.00'
+    values = {field: (row.get(field) or '').strip() for field in CSV_FIELDS}
+
+    if not values['name'] or len(values['name']) > NAME_LENGTH:
+        raise ValueError(f"name must be 1 to {NAME_LENGTH} characters, got {values['name']!r}")
+    if not values['acronym'] or len(values['acronym']) > ACRONYM_LENGTH:
+        raise ValueError(f"acronym must be 1 to {ACRONYM_LENGTH} characters, got {values['acronym']!r}")
+
+    try:
+        base_pr = float(values['base_pr'])
+    except ValueError:
+        base_pr = math.nan
+    if not math.isfinite(base_pr):
+        raise ValueError(f"base_pr must be a number, got {values['base_pr']!r}")
+
+    try:
+        seed = float(values['seed'])
+    except ValueError:
+        seed = math.nan
+    if seed not in SEEDS:
+        raise ValueError(f"seed must be one of {sorted(SEEDS)}, got {values['seed']!r}")
+
+    origin = values['origin'].lower()
+    if origin not in ORIGINS:
+        raise ValueError(f"origin must be one of {sorted(ORIGINS)}, got {values['origin']!r}")
+
+    return {'name': values['name'], 'acronym': values['acronym'], 'base_pr': base_pr,
+            'seed': int(seed), 'origin': origin}
+
+
+def read_teams(file):
+    # Streams the CSV rows of file into {acronym: fields}. Invalid rows and repeated
+    # acronyms are collected as [(line, error)] instead. Returns (teams, errors)
+    reader = csv.DictReader(file)
+    if reader.fieldnames is None:
+        raise ValueError('The file is empty')
+    reader.fieldnames = [field.strip() for field in reader.fieldnames]
+    missing = [field for field in CSV_FIELDS if field not in reader.fieldnames]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+    teams = {}
+    lines = {}
+    errors = []
+    for row in reader:
+        try:
+            team = parse_team_row(row)
+        except ValueError as e:
+            errors.append((reader.line_num, str(e)))
+            continue
+        acronym = team['acronym']
+        if acronym in teams:
+            errors.append((reader.line_num, f'acronym {acronym} is already on line {lines[acronym]}'))
+            continue
+        teams[acronym] = team
+        lines[acronym] = reader.line_num
+    return teams, errors
+
+
+def import_teams(teams, tournament):
+    # Upserts {acronym: fields} into the tournament by acronym in one transaction: creates
+    # the new teams and updates only the ones whose fields changed.
+    # Returns (created, updated, unchanged)
+    with transaction.atomic():
+        existing = {team.acronym: team for team in
+                    Team.objects.filter(tournament=tournament).only('id', 'acronym', *IMPORTED_FIELDS)
+                    .iterator(chunk_size=2000)}
+
+        created = []
+        updated = []
+        renamed_ids = []
+        for acronym, fields in teams.items():
+            team = existing.get(acronym)
+            if team is None:
+                created.append(Team(tournament=tournament, current_pr=fields['base_pr'], **fields))
+            elif any(getattr(team, field) != fields[field] for field in IMPORTED_FIELDS):
+                if team.name != fields['name']:
+                    renamed_ids.append(team.id)
+                for field in IMPORTED_FIELDS:
+                    setattr(team, field, fields[field])
+                updated.append(team)
+
+        Team.objects.bulk_create(created, batch_size=BATCH_SIZE)
+        Team.objects.bulk_update(updated, IMPORTED_FIELDS, batch_size=BATCH_SIZE)
+
+        # The bulk writes send no post_save, so the API version and the feed are
+        # updated here, and the matchup labels of the renamed teams' matches rebuilt
+        if renamed_ids:
+            renamed_matches = Match.objects.filter(matchteamrelation__team_id__in=renamed_ids).distinct()
+            Match.refresh_matchups(renamed_matches)
+            publish_matches(renamed_matches.values_list('id', flat=True))
+        if created or updated:
+            DataVersion.bump()
+            publish_teams([team.id for team in created + updated])
+
+    return len(created), len(updated), len(teams) - len(created) - len(updated)
 
-csv_file_path = 'team_info.csv'
 
 class Command(BaseCommand):
-    help = 'My custom Django command'
+    help = 'Create or update teams by acronym from a CSV of name, acronym, base_pr, seed, origin'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', nargs='?', default=CSV_FILE_PATH, help="CSV file, '-' reads stdin")
+        parser.add_argument('--tournament', default=settings.DEFAULT_TOURNAMENT,
+                            help='Slug of the tournament the teams play in, created if new')
+        parser.add_argument('--tournament-name', help='Name of a new tournament (defaults to the slug)')
 
     def handle(self, *args, **options):
-        # Create Team objects from team_info.csv file [name, acronym, base_pr, seed, origin]
+        path = options['file']
         try:
-            with open(csv_file_path, 'r') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    print(row['origin'])
-                    Team.objects.create(
-                        name=row['name'],
-                        acronym=row['acronym'].strip(' '),
-                        base_pr=float(row['base_pr']),
-                        current_pr=float(row['base_pr']),
-                        seed=int(row['seed'].strip(' ').strip('0').strip('.')),
-                        origin=row['origin'].strip(' ').lower()
-                    )
-
-            self.stdout.write(self.style.SUCCESS('Teams imported successfully!'))
-
+            if path == '-':
+                teams, errors = read_teams(sys.stdin)
+            else:
+                with open(path, newline='') as file:
+                    teams, errors = read_teams(file)
         except FileNotFoundError:
-            self.stdout.write(self.style.ERROR(f'File not found at path: {csv_file_path}'))
+            raise CommandError(f'File not found at path: {path}')
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if errors:
+            for line, error in errors[:MAX_REPORTED_ERRORS]:
+                self.stderr.write(f'Line {line}: {error}')
+            raise CommandError(f'{len(errors)} invalid rows, no teams were imported')
 
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f'An error occurred: {str(e)}'))
+        tournament, _ = Tournament.objects.get_or_create(
+            slug=options['tournament'], defaults={'name': options['tournament_name'] or options['tournament']})
+        created, updated, unchanged = import_teams(teams, tournament)
+        self.stdout.write(self.style.SUCCESS(
+            f'Teams imported into {tournament}: {created} created, {updated} updated, {unchanged} unchanged'))
+        if updated:
+            self.stdout.write("Run 'manage.py recompute_ratings' if base PRs changed")
@@ -0,0 +1,31 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Tournament
+from ...snapshots import export_tournament
+
+
+class Command(BaseCommand):
+    help = "Export a tournament's teams, matches and PR/odds history as a gzipped NDJSON snapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument('tournament', nargs='?', default=settings.DEFAULT_TOURNAMENT,
+                            help='Slug of the tournament to export')
+        parser.add_argument('--output', help="Snapshot file, '-' writes to stdout (default <slug>.ndjson.gz)")
+
+    def handle(self, *args, **options):
+        tournament = Tournament.objects.filter(slug=options['tournament']).first()
+        if tournament is None:
+            raise CommandError(f"No tournament with the slug {options['tournament']}")
+
+        path = options['output'] or f'{tournament.slug}.ndjson.gz'
+        if path == '-':
+            export_tournament(tournament, sys.stdout.buffer)
+            return
+        with open(path, 'wb') as file:
+            counts = export_tournament(tournament, file)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {tournament} to {path}: ' + ', '.join(f'{count} {kind}' for kind, count in counts.items())))
@@ -0,0 +1,31 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...snapshots import SnapshotError, import_tournament
+
+
+class Command(BaseCommand):
+    help = 'Import a tournament snapshot written by export_tournament as a new tournament'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="Snapshot file, '-' reads stdin")
+        parser.add_argument('--slug', help="Slug of the new tournament (default the snapshot's)")
+        parser.add_argument('--name', help="Name of the new tournament (default the snapshot's)")
+
+    def handle(self, *args, **options):
+        path = options['file']
+        try:
+            if path == '-':
+                tournament, counts = import_tournament(sys.stdin.buffer, options['slug'], options['name'])
+            else:
+                with open(path, 'rb') as file:
+                    tournament, counts = import_tournament(file, options['slug'], options['name'])
+        except FileNotFoundError:
+            raise CommandError(f'File not found at path: {path}')
+        except (OSError, SnapshotError) as e:
+            raise CommandError(f'Could not import {path}: {e}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {tournament} ({tournament.slug}): ' +
+            ', '.join(f'{count} {kind}' for kind, count in counts.items())))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import User
+
+
+class Command(BaseCommand):
+    help = "Issue a new bet API token for a user, replacing the previous one"
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_id', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(id=options['user_id'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user with id {options['user_id']}")
+
+        token = user.issue_api_token()
+        self.stdout.write(f'Token of {user.name} (shown once, only its hash is stored):')
+        self.stdout.write(token)
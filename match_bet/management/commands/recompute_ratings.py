@@ -0,0 +1,139 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from ...feed import publish_teams
+from ...models import DataVersion, MatchTeamRelation, PRHistory, Team, Tournament
+from ...odds import odds_matrix
+from ...ratings import replay_ratings
+
+
+def load_history(tournament=None):
+    # Teams and concluded matches in chronological order, as plain arrays for replay_ratings,
+    # of one tournament or of all of them (teams only ever play in their own tournament)
+    # Returns (teams, base_prs, fixtures, fixture_relations, fixture_matches) where
+    # fixture_matches holds the (match id, datetime) of each fixture
+    teams = Team.objects.order_by('id')
+    relations = MatchTeamRelation.objects.filter(match__is_concluded=True)
+    if tournament is not None:
+        teams = teams.filter(tournament=tournament)
+        relations = relations.filter(match__tournament=tournament)
+    teams = list(teams)
+    team_index = {team.id: i for i, team in enumerate(teams)}
+    base_prs = [team.base_pr for team in teams]
+
+    relations_by_match = {}
+    rows = (relations
+            .order_by('match__datetime', 'match_id', '-is_team1')
+            .values_list('id', 'match_id', 'team_id', 'match__winner_id', 'match__datetime'))
+    for relation_id, match_id, team_id, winner_id, match_datetime in rows:
+        relations_by_match.setdefault(match_id, []).append((relation_id, team_id, winner_id, match_datetime))
+
+    fixtures = []
+    fixture_relations = []
+    fixture_matches = []
+    for match_id, relations in relations_by_match.items():
+        if len(relations) != 2:
+            continue
+        (relation1, team1_id, winner_id, match_datetime), (relation2, team2_id, _, _) = relations
+        fixtures.append((team_index[team1_id], team_index[team2_id], winner_id == team1_id))
+        fixture_relations.append((relation1, relation2))
+        fixture_matches.append((match_id, match_datetime))
+
+    return teams, base_prs, fixtures, fixture_relations, fixture_matches
+
+
+def recompute_ratings(dry_run=False, tournament=None):
+    # Replays the concluded matches of the tournament (of every tournament if None) from
+    # base PR and writes back every changed team PR, PR history and match PR delta. A team
+    # whose history differs from the replay gets its PRHistory rows rewritten. Returns
+    # (matches, teams, changed_teams, changed_relations, timings) where timings holds the
+    # load/replay/write seconds
+    started = time.perf_counter()
+
+    with transaction.atomic():
+        teams, base_prs, fixtures, fixture_relations, fixture_matches = load_history(tournament)
+        stored = PRHistory.objects.order_by('datetime', 'id')
+        relations = MatchTeamRelation.objects.filter(Q(pr_delta__isnull=False) | Q(match__is_concluded=True))
+        if tournament is not None:
+            stored = stored.filter(team__tournament=tournament)
+            relations = relations.filter(match__tournament=tournament)
+
+        stored_histories = {}
+        for team_id, match_id, changed_at, pr in stored.values_list('team_id', 'match_id', 'datetime', 'pr'):
+            stored_histories.setdefault(team_id, []).append((match_id, changed_at, pr))
+        loaded = time.perf_counter()
+
+        prs, pr_histories, pr_deltas = replay_ratings(base_prs, fixtures)
+        replayed = time.perf_counter()
+
+        # Fixtures of each team in order, the i-th one replaced the i-th PR of its history
+        team_fixtures = [[] for _ in teams]
+        for (team1, team2, _), fixture_match in zip(fixtures, fixture_matches):
+            team_fixtures[team1].append(fixture_match)
+            team_fixtures[team2].append(fixture_match)
+
+        changed_teams = []
+        new_history = []
+        for team, pr, pr_history, matches in zip(teams, prs, pr_histories, team_fixtures):
+            history = [(match_id, changed_at, old_pr) for (match_id, changed_at), old_pr in zip(matches, pr_history)]
+            if team.current_pr != pr or stored_histories.get(team.id, []) != history:
+                team.current_pr = pr
+                changed_teams.append(team)
+                new_history.extend(PRHistory(team=team, match_id=match_id, datetime=changed_at, pr=old_pr)
+                                   for match_id, changed_at, old_pr in history)
+
+        new_deltas = {}
+        for (relation1, relation2), (delta1, delta2) in zip(fixture_relations, pr_deltas):
+            new_deltas[relation1] = delta1
+            new_deltas[relation2] = delta2
+
+        # Relations of matches that are no longer concluded lose their delta
+        changed_relations = []
+        for relation in relations.only('id', 'pr_delta'):
+            pr_delta = new_deltas.get(relation.id)
+            if relation.pr_delta != pr_delta:
+                relation.pr_delta = pr_delta
+                changed_relations.append(relation)
+
+        if not dry_run:
+            Team.objects.bulk_update(changed_teams, ['current_pr'], batch_size=500)
+            PRHistory.objects.filter(team__in=changed_teams).delete()
+            PRHistory.objects.bulk_create(new_history, batch_size=500)
+            MatchTeamRelation.objects.bulk_update(changed_relations, ['pr_delta'], batch_size=500)
+            transaction.on_commit(odds_matrix.invalidate)
+            if changed_teams or changed_relations:
+                DataVersion.bump()
+            publish_teams(team.id for team in changed_teams)
+
+    finished = time.perf_counter()
+    timings = (loaded - started, replayed - loaded, finished - replayed)
+    return len(fixtures), len(teams), changed_teams, changed_relations, timings
+
+
+class Command(BaseCommand):
+    help = 'Recompute every team PR, PR history and match PR delta from base PR'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would change without writing')
+        parser.add_argument('--tournament', help='Slug of the only tournament to recompute')
+
+    def handle(self, *args, **options):
+        tournament = None
+        if options['tournament']:
+            tournament = Tournament.objects.filter(slug=options['tournament']).first()
+            if tournament is None:
+                raise CommandError(f"No tournament with the slug {options['tournament']}")
+
+        match_count, team_count, changed_teams, changed_relations, timings = recompute_ratings(
+            dry_run=options['dry_run'], tournament=tournament)
+
+        self.stdout.write(
+            f'Replayed {match_count} matches for {team_count} teams '
+            f'(load {timings[0]:.3f}s, replay {timings[1]:.3f}s, write {timings[2]:.3f}s)')
+        verb = 'Would update' if options['dry_run'] else 'Updated'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {len(changed_teams)} teams and {len(changed_relations)} match-team relations'))
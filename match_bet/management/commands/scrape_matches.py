@@ -1,295 +1,585 @@
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+import cProfile
+import hashlib
+import io
 import json
-from datetime import datetime, timedelta, timezone
-from ...models import Match, Team, MatchTeamRelation
-from django.shortcuts import get_object_or_404
-from django.core.management.base import BaseCommand
-
-# constants
-ELO = 1500
-K = 16
+import pstats
+import signal
+import os
+from itertools import chain, islice
+from concurrent.futures import ThreadPoolExecutor
+from ...adapters import DEFAULT_ADAPTER, compile_selector, get_adapter
+from ...betting import settle_matches, unsettle_matches
+from ...feed import publish_matches, publish_teams
+from ...http_cache import FetchCache
+from ...instrumentation import phase, recording
+from ...models import DataVersion, Match, MatchTeamRelation, PRHistory, Team, Tournament
+from ...ratings import adjust_team_pr, check_winner, pr_to_odds
+from .recompute_ratings import recompute_ratings
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Prefetch
 
 # Specify the file path
 json_file_path = 'scrape_data.json'
+cache_file_path = 'scrape_cache.json'
+sources_file_path = 'scrape_sources.json'
 
-selector = 'tr.ml-row:nth-of-type(n+8) td'
-# selector = '.ml-w8.ml-row td'  # alternate selector just for Grand Finals
-
+fetch_cache = FetchCache(cache_file_path)
 
+# Scraped with the default adapter's selector when there is no sources file
 url = 'https://lol.fandom.com/wiki/2023_Season_World_Championship/Main_Event'
 
+# Upper bound on pages fetched at the same time
+max_workers = 4
+
+# Where --profile saves the cProfile stats (for snakeviz, pstats...) and how many of
+# the functions with the most cumulative time it prints
+profile_file_path = 'scrape_matches.prof'
+profile_report_lines = 30
+
+# Number of grouped fixtures ingested per batch by the streaming pipeline
+stream_batch_size = 200
+
+# The streaming pipeline uses lxml when it is installed, it is not a requirement
+try:
+    import lxml  # noqa: F401
+    stream_parser = 'lxml'
+except ImportError:
+    stream_parser = 'html.parser'
+
+
+def load_sources(path=sources_file_path):
+    # List of (url, selector, adapter) sources to scrape, read from a JSON file of the form
+    # [{"url": "...", "selector": "...", "adapter": "..."}, ...]. The adapter (see
+    # match_bet/adapters.py) defaults to DEFAULT_ADAPTER and the selector to the
+    # adapter's. Falls back to the url above. Raises ValueError for an unknown adapter
+    if not os.path.exists(path):
+        adapter = get_adapter()
+        return [(url, adapter.selector, adapter)]
 
-def extract_data_from_url(url):
-    # Function to extract data from a given URL
+    with open(path, 'r') as sources_file:
+        sources = []
+        for source in json.load(sources_file):
+            adapter = get_adapter(source.get('adapter'))
+            sources.append((source['url'], source.get('selector') or adapter.selector, adapter))
+        return sources
 
-    # Send a GET request to the URL
-    response = requests.get(url)
+
+def fetch_pages(sources, force=False):
+    # Fetches every distinct URL of the sources once, concurrently and sharing the
+    # session's connection pool. Returns [(response, [(selector, adapter)])] in source order
+    selectors_by_url = {}
+    for source_url, source_selector, adapter in sources:
+        selectors_by_url.setdefault(source_url, []).append((source_selector, adapter))
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(selectors_by_url) or 1)) as executor:
+        responses = list(executor.map(
+            lambda page_url: fetch_cache.get(page_url, force=force), selectors_by_url))
+
+    return list(zip(responses, selectors_by_url.values()))
+
+
+def extract_data(response, selectors):
+    # Returns (adapter, extracted elements) for each of the (selector, adapter) pairs,
+    # or None if the request was not successful
 
     # Check if the request was successful (status code 200)
     if response.status_code == 200:
         # Parse the HTML content with BeautifulSoup
         soup = BeautifulSoup(response.text, 'html.parser')
 
-        # Extract data using the provided selector
-        selected_data = soup.select(selector)
-
-        # Return the extracted data
-        return [data.text for data in selected_data]
+        # Extract data using the provided selectors
+        return [(adapter, [data.text for data in soup.select(compile_selector(page_selector))])
+                for page_selector, adapter in selectors]
     else:
         # Print an error message if the request was not successful
         print(
-            f"Failed to fetch content from {url}. Status code: {response.status_code}")
+            f"Failed to fetch content from {response.url}. Status code: {response.status_code}")
         return None
 
 
-def convert_to_datetime(input_str):
-    # Extract relevant portion of the string
-    greater_str = input_str.split(',')[0]
-    date_list = greater_str.split(' ')
-
-    # Convert month name to month number
-    months = {'January': 1, 'February': 2, 'March': 3, 'April': 4, 'May': 5, 'June': 6,
-              'July': 7, 'August': 8, 'September': 9, 'October': 10, 'November': 11, 'December': 12}
-    month = months[date_list[1]]
+def iter_page_data(html, page_selector):
+    # Streaming counterpart of extract_data: only the page's tables are parsed into a
+    # tree (so selectors must only rely on elements inside the match list table),
+    # and the text of the selected elements is yielded one at a time
+    soup = BeautifulSoup(html, stream_parser, parse_only=SoupStrainer('table'))
+    for data in soup.css.iselect(compile_selector(page_selector)):
+        yield data.text
 
-    # Convert the year to an integer
-    year = int(date_list[2])
 
-    # Create a datetime object
-    date_time_obj = datetime(year, month, int(date_list[0]), int(date_list[3][:2]), int(
-        date_list[3][3:5]), int(date_list[3][6:8]), tzinfo=timezone.utc)
+def scrape_and_write(force=False, sources=None):
+    # Fetches the source pages and writes the extracted data of the changed pages,
+    # merged in source order. Returns the responses of the changed pages, so an
+    # empty list means there is nothing new to ingest
+    if sources is None:
+        sources = load_sources()
 
-    # Adjust for the UTC offset
-    utc_offset = int(date_list[4][:3])
-    date_time_obj = date_time_obj - timedelta(hours=utc_offset)
+    with phase('fetch'):
+        pages = [(response, selectors) for response, selectors in fetch_pages(sources, force=force)
+                 if not response.unchanged]
+    if not pages:
+        return []
 
-    # Convert the datetime object to Philippine Time (UTC+8)
-    date_time_obj = date_time_obj + timedelta(hours=8)
+    # The elements of each selector with the name of the adapter that decodes them
+    extracted_data = []
+    with phase('parse'):
+        for response, selectors in pages:
+            for adapter, selector_data in extract_data(response, selectors) or []:
+                extracted_data.append({"adapter": adapter.name, "data": selector_data})
 
-    return date_time_obj
-
-
-def scrape_and_write():
-    extracted_data = extract_data_from_url(url)
-    data_to_write = {"data": extracted_data}
+    data_to_write = {"sources": extracted_data}
 
     # Open the file in write mode ('w')
-    with open(json_file_path, 'w') as json_file:
+    with phase('json_write'), open(json_file_path, 'w') as json_file:
         # Write the data to the JSON file
         json.dump(data_to_write, json_file, indent=4)
 
+    return [response for response, _ in pages]
+
+
+def stream_fixtures(pages):
+    # Decoded fixtures of the fetched pages, in source order, without materializing
+    # the extracted elements or going through the JSON file
+    for response, selectors in pages:
+        if response.status_code != 200:
+            print(
+                f"Failed to fetch content from {response.url}. Status code: {response.status_code}")
+            continue
+        for page_selector, adapter in selectors:
+            yield from adapter.fixtures(adapter.group(iter_page_data(response.text, page_selector)))
+
+
+def read_scraped_fixtures(json_data):
+    # Decoded fixtures of the contents of scrape_data.json, files written before
+    # adapters hold the elements of the default adapter only
+    scraped = json_data.get("sources")
+    if scraped is None:
+        scraped = [{"adapter": DEFAULT_ADAPTER, "data": json_data.get("data") or []}]
+
+    fixtures = []
+    for source in scraped:
+        adapter = get_adapter(source["adapter"])
+        fixtures.extend(adapter.fixtures(adapter.group(source["data"])))
+    return fixtures
+
+
+def is_concluded_score(score1, score2, best_of):
+    # A match is concluded once a team has won the majority of best_of, or all games were played
+    return (score1 * 2 >= best_of) or (score2 * 2 >= best_of) or (score1 + score2 == best_of)
+
+
+def fixture_fingerprint(team1_str, team2_str, formatted_date, score1, score2, best_of):
+    # best_of is part of the fingerprint since the conclusion rule depends on it
+    raw = f"{team1_str}|{team2_str}|{formatted_date.isoformat()}|{score1}|{score2}|{best_of}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def ingest_fixtures(grouped_list, teams=None, tournament=None, adapter=None):
+    # Ingest of scraped sets (lists of cell texts) decoded by the named adapter
+    # (DEFAULT_ADAPTER if not given), see ingest_decoded_fixtures
+    adapter = get_adapter(adapter)
+    return ingest_decoded_fixtures(list(adapter.fixtures(grouped_list)), teams=teams, tournament=tournament)
+
+
+def ingest_decoded_fixtures(fixtures, teams=None, tournament=None):
+    # Set-based ingest of the scraped sets into the tournament (the default one if not
+    # given) inside a single transaction:
+    # teams are loaded once, existing matches and relations are resolved with one
+    # query each, and all writes are batched with bulk_create/bulk_update.
+    # Sets are still resolved in page order so PR adjustments (and the odds of
+    # newly created matches) see the same ratings as a row-by-row ingest would.
+    # Sets whose fingerprint matches the one stored on their Match are skipped, and so
+    # are sets naming a team the tournament doesn't have (counted as unknown).
+    # A set is the match of its tournament with the same datetime and team pair.
+    # fixtures are the (team1, team2, datetime, score1, score2) of the sets as decoded
+    # by their adapter.
+    # teams, an acronym -> Team map of the tournament, can be passed in when ingesting in batches.
+    # Returns (new, updated, unchanged, skipped, unknown) counts
+    new_count = 0
+    update_count = 0
+    unchanged_count = 0
+    skipped_count = 0
+    unknown_count = 0
+
+    with transaction.atomic():
+        if tournament is None:
+            tournament = Tournament.objects.default()
+        if teams is None:
+            teams = {team.acronym: team for team in Team.objects.filter(tournament=tournament)}
+        existing_matches = Match.objects.filter(
+            tournament=tournament, datetime__in={fixture[2] for fixture in fixtures})
+        relations = {(mtr.match_id, mtr.team_id): mtr
+                     for mtr in MatchTeamRelation.objects.filter(match__in=existing_matches).select_related('match')}
+
+        # (datetime, team 1 id, team 2 id) -> Match
+        pairs = {}
+        for mtr in sorted(relations.values(), key=lambda mtr: not mtr.is_team1):
+            pairs.setdefault(mtr.match_id, [mtr.match]).append(mtr.team_id)
+        matches = {(match.datetime, *team_ids): match for match, *team_ids in pairs.values()}
+
+        new_matches = []
+        new_relations = {}
+        changed_matches = set()
+        changed_relations = set()
+        changed_teams = set()
+        concluded_matches = []
+        pr_history = []
+
+        for team1_str, team2_str, formatted_date, score1, score2 in fixtures:
+            team1 = teams.get(team1_str)
+            team2 = teams.get(team2_str)
+            if team1 is None or team2 is None:
+                # e.g. a bracket slot that isn't decided yet, the rest of the page is still ingested
+                print(f'Skipped {team1_str} vs {team2_str} {formatted_date}: '
+                      f'no team of the tournament has the acronym {team2_str if team1 else team1_str}')
+                unknown_count += 1
+                continue
+
+            key = (formatted_date, team1.pk, team2.pk)
+            match = matches.get(key)
+            created = match is None
+            if created:
+                match = Match(tournament=tournament, datetime=formatted_date)
+                matches[key] = match
+                new_matches.append(match)
+
+            # Check if match and its effects have been previously resolved:
+            if match.is_concluded:
+                unchanged_count += 1
+                continue
+
+            fingerprint = fixture_fingerprint(
+                team1_str, team2_str, formatted_date, score1, score2, match.best_of)
+            if fingerprint == match.fingerprint:
+                skipped_count += 1
+                continue
+            match.fingerprint = fingerprint
+
+            print(team1, team2, formatted_date)
+
+            match.matchup = Match.matchup_label(team1, team2)
 
-def create_sublists(input_list):
-    result = []
-    current_sublist = []
-
-    for element in input_list:
-        starts_with_separator = element.startswith('\u2060\u2060')
-
-        if not starts_with_separator:
-            current_sublist.append(element)
-        else:
-            current_sublist.append(element)
-            result.append(current_sublist)
-            current_sublist = []
-
-    return result
-
-
-def pr_to_odds(team1, team2):
-    processed_pr1 = 1-(round((float(team1.current_pr)/18), 4))
-    processed_pr2 = 1-(round((float(team2.current_pr)/18), 4))
-    win_prob_1 = processed_pr1 / (processed_pr1 + processed_pr2)
-    odds_1 = round((1 / win_prob_1), 2)
-    win_prob_2 = processed_pr2 / (processed_pr1 + processed_pr2)
-    odds_2 = round((1 / win_prob_2), 2)
-    return odds_1, odds_2
-
-
-def check_winner(score1, score2):
-    if score1 > score2:
-        return True, False
-    elif score1 < score2:
-        return False, True
-
-
-def pr_to_elo(pr):
-    return (1-(round((float(pr)/18), 4))) * ELO
-
-
-def elo_to_pr(elo):
-    return round((1 - (elo / ELO)) * 18, 4)
-
+            score1_str = None
+            score2_str = None
+            team1_is_win = None
+            team2_is_win = None
+            if score1 is not None:
+                score1_str = f"{score1} - {score2}"
+                score2_str = f"{score2} - {score1}"
+
+            # Update Match fields based on winner and score
+            if score1 is not None and score1 > score2:
+                match.result = score1_str
+            elif score1 is not None and score1 < score2:
+                match.result = score2_str
+
+            # On Match object creation, generate match odds based on teams' power rank at the time
+            if created:
+                match.current_odds = pr_to_odds(team1, team2)
+                new_count += 1
+            else:
+                update_count += 1
+
+            # Create or update MatchTeamRelation instances
+            mtrs = []
+            for team, is_team1, match_score in ((team1, True, score1_str), (team2, False, score2_str)):
+                key = (match.pk, team.pk) if match.pk else (id(match), team.pk)
+                mtr = relations.get(key) or new_relations.get(key)
+                if mtr is None:
+                    mtr = MatchTeamRelation(team=team, match=match, is_team1=is_team1,
+                                            is_winner=None, match_score=match_score)
+                    new_relations[key] = mtr
+                mtrs.append(mtr)
+            mtr1, mtr2 = mtrs
+
+            if score1 is not None:
+                # For concluded matches, adjust team power rankings and match-team relations
+
+                # Only update pr if total of score equals match count and update only once
+                if is_concluded_score(score1, score2, match.best_of):
+                    match.is_concluded = True
+                    if match.pk:
+                        # Matches created by this ingest have no bets yet
+                        concluded_matches.append(match.pk)
+
+                    team1_is_win, team2_is_win = check_winner(score1, score2)
+
+                    old_pr1, old_pr2, new_pr1, new_pr2 = adjust_team_pr(
+                        team1, team2, team1_is_win, match, commit=False, history=pr_history)
+                    changed_teams.update((team1, team2))
+
+                    mtr1.pr_delta = round((new_pr1 - old_pr1), 4)
+                    mtr2.pr_delta = round((new_pr2 - old_pr2), 4)
+                    mtr1.is_winner = team1_is_win
+                    mtr2.is_winner = team2_is_win
+
+                mtr1.is_team1 = True
+                mtr1.match_score = score1_str
+                mtr2.is_team1 = False
+                mtr2.match_score = score2_str
+                changed_relations.update(mtr for mtr in mtrs if mtr.pk)
+
+            # Update Match fields based on winner and score
+            if team1_is_win:
+                match.winner = team1
+            elif team2_is_win:
+                match.winner = team2
+
+            if match.pk:
+                changed_matches.add(match)
+
+        Match.objects.bulk_create(new_matches)
+        MatchTeamRelation.objects.bulk_create(new_relations.values())
+
+        if changed_matches:
+            Match.objects.bulk_update(
+                changed_matches, ['result', 'winner', 'is_concluded', 'fingerprint', 'matchup'])
+        if changed_relations:
+            MatchTeamRelation.objects.bulk_update(
+                changed_relations, ['is_team1', 'is_winner', 'match_score', 'pr_delta'])
+        if changed_teams:
+            Team.objects.bulk_update(changed_teams, ['current_pr'])
+            PRHistory.objects.bulk_create(pr_history)
+
+        if concluded_matches:
+            settle_matches(concluded_matches)
+
+        if new_matches or changed_matches:
+            DataVersion.bump()
+            publish_matches(match.id for match in chain(new_matches, changed_matches))
+        if changed_teams:
+            publish_teams(team.id for team in changed_teams)
+
+    return new_count, update_count, unchanged_count, skipped_count, unknown_count
+
+
+def update_best_of(match_ids, best_of):
+    # Set-based 'Update Match Count': updates best_of of the matches and re-applies the
+    # conclusion rule with the new value, in a single transaction. Newly concluded
+    # matches get their winner and PR adjustments (in chronological order). Matches that
+    # are no longer concluded are reopened, and matches concluded before the tournament's
+    # latest concluded match change every later rating: both require replaying every
+    # team's PR. Returns (updated, concluded, reopened) lists of matches
+    with transaction.atomic():
+        Match.objects.filter(id__in=match_ids).update(best_of=best_of)
+
+        relations = MatchTeamRelation.objects.select_related('team').order_by('-is_team1', 'id')
+        matches = list(Match.objects.filter(id__in=match_ids).order_by('datetime', 'id').prefetch_related(
+            Prefetch('matchteamrelation_set', queryset=relations)))
+
+        # (datetime, id) of the latest concluded match of each tournament, the replay order
+        latest_concluded = {}
+        for tournament_id in {match.tournament_id for match in matches}:
+            latest = (Match.objects.filter(tournament_id=tournament_id, is_concluded=True)
+                      .order_by('-datetime', '-id').values_list('datetime', 'id').first())
+            if latest is not None:
+                latest_concluded[tournament_id] = latest
+
+        concluded = []
+        reopened = []
+        replayed_tournaments = set()
+        changed_relations = []
+        changed_teams = {}
+        pr_history = []
+
+        for match in matches:
+            match_relations = list(match.matchteamrelation_set.all())
+            if len(match_relations) != 2 or not match_relations[0].match_score:
+                continue
+            mtr1, mtr2 = match_relations
+            score1, score2 = (int(score) for score in mtr1.match_score.split(' - '))
+
+            if is_concluded_score(score1, score2, best_of) and not match.is_concluded:
+                # Relations share Team instances so consecutive adjustments build on each other
+                team1 = changed_teams.setdefault(mtr1.team_id, mtr1.team)
+                team2 = changed_teams.setdefault(mtr2.team_id, mtr2.team)
+
+                team1_is_win, team2_is_win = check_winner(score1, score2)
+                old_pr1, old_pr2, new_pr1, new_pr2 = adjust_team_pr(
+                    team1, team2, team1_is_win, match, commit=False, history=pr_history)
+
+                mtr1.pr_delta = round((new_pr1 - old_pr1), 4)
+                mtr2.pr_delta = round((new_pr2 - old_pr2), 4)
+                mtr1.is_winner = team1_is_win
+                mtr2.is_winner = team2_is_win
+                match.is_concluded = True
+                match.winner = team1 if team1_is_win else team2 if team2_is_win else None
+                concluded.append(match)
+                latest = latest_concluded.get(match.tournament_id)
+                if latest is not None and (match.datetime, match.id) < latest:
+                    # Adjusted on top of ratings that already include later results
+                    replayed_tournaments.add(match.tournament_id)
+                changed_relations.extend((mtr1, mtr2))
+
+            elif match.is_concluded and not is_concluded_score(score1, score2, best_of):
+                mtr1.pr_delta = mtr2.pr_delta = None
+                mtr1.is_winner = mtr2.is_winner = None
+                match.is_concluded = False
+                match.winner = None
+                reopened.append(match)
+                replayed_tournaments.add(match.tournament_id)
+                changed_relations.extend((mtr1, mtr2))
+
+        Match.objects.bulk_update(concluded + reopened, ['is_concluded', 'winner'], batch_size=500)
+        MatchTeamRelation.objects.bulk_update(changed_relations, ['pr_delta', 'is_winner'], batch_size=500)
+        Team.objects.bulk_update(changed_teams.values(), ['current_pr'], batch_size=500)
+        PRHistory.objects.bulk_create(pr_history, batch_size=500)
+        if concluded:
+            settle_matches([match.id for match in concluded])
+        if reopened:
+            unsettle_matches([match.id for match in reopened])
+        DataVersion.bump()
+        publish_matches(match.id for match in matches)
+        publish_teams(changed_teams)
+
+        # The reopened and out of order matches' adjustments are baked into every later
+        # rating of their tournament
+        for tournament_id in replayed_tournaments:
+            recompute_ratings(tournament=tournament_id)
+
+    return matches, concluded, reopened
+
+
+def run_scrape(progress=None, force=False, sources=None, stream=False, tournament=None):
+    # Full scrape into the tournament (the default one if not given): fetch, parse and
+    # ingest. progress, if given, is called with the
+    # name of each phase as it starts ('fetching', 'parsing', 'ingesting').
+    # The finer phases (fetch, parse, json_write, json_read, decode, ingest, ratings) are
+    # recorded by match_bet.instrumentation when a recording is active
+    # Returns None without parsing or ingesting if no page changed since the last run
+    if progress is None:
+        def progress(phase):
+            pass
+
+    if stream:
+        return run_streaming_scrape(progress, force=force, sources=sources, tournament=tournament)
+
+    progress('fetching')
+    # Writes scraped data, can be disabled for debugging
+    responses = scrape_and_write(force=force, sources=sources)
+    if not responses:
+        return None
 
-def adjust_team_pr(team1, team2, team1_is_win):
+    progress('parsing')
+    with phase('json_read'):
+        # Open the file in read mode ('r')
+        with open(json_file_path, 'r') as json_file:
+            # Load the JSON content
+            json_data = json.load(json_file)
 
-    elo1 = pr_to_elo(team1.current_pr)
-    elo2 = pr_to_elo(team2.current_pr)
+    with phase('decode'):
+        fixtures = read_scraped_fixtures(json_data)
 
-    expected_score1 = 1 / (1 + (10 ** ((elo2 - elo1) / 400)))
-    expected_score2 = 1 / (1 + (10 ** ((elo1 - elo2) / 400)))
+    progress('ingesting')
+    with phase('ingest'):
+        counts = ingest_decoded_fixtures(fixtures, tournament=tournament)
 
-    if team1_is_win:
-        actual_score1 = 1
-        actual_score2 = 0
-    elif not team1_is_win:
-        actual_score1 = 0
-        actual_score2 = 1
+    # Only remember the pages once they have been ingested
+    for response in responses:
+        fetch_cache.commit(response)
 
-    elo1 += K * (actual_score1 - expected_score1)
-    elo2 += K * (actual_score2 - expected_score2)
+    return counts
 
-    new_pr1 = elo_to_pr(elo1)
-    new_pr2 = elo_to_pr(elo2)
 
-    team1.pr_history.append(team1.current_pr)
-    old_pr1 = team1.current_pr
-    team1.current_pr = new_pr1
-    team1.save()
+def run_streaming_scrape(progress, force=False, sources=None, tournament=None):
+    # Generator-based pipeline: parses only the match list tables and feeds the sets
+    # to ingest in batches of stream_batch_size, parsing and ingesting are interleaved
+    if sources is None:
+        sources = load_sources()
 
-    team2.pr_history.append(team2.current_pr)
-    old_pr2 = team2.current_pr
-    team2.current_pr = new_pr2
-    team2.save()
+    progress('fetching')
+    with phase('fetch'):
+        pages = [(response, selectors) for response, selectors in fetch_pages(sources, force=force)
+                 if not response.unchanged]
+    if not pages:
+        return None
 
-    return old_pr1, old_pr2, new_pr1, new_pr2
+    progress('ingesting')
+    fixtures = stream_fixtures(pages)
+    counts = [0, 0, 0, 0, 0]
+    with transaction.atomic():
+        if tournament is None:
+            tournament = Tournament.objects.default()
+        teams = {team.acronym: team for team in Team.objects.filter(tournament=tournament)}
+        while True:
+            # Pages are parsed and decoded lazily, as the batches are taken
+            with phase('parse'):
+                batch = list(islice(fixtures, stream_batch_size))
+            if not batch:
+                break
+            with phase('ingest'):
+                counts = [total + count for total, count in
+                          zip(counts, ingest_decoded_fixtures(batch, teams=teams, tournament=tournament))]
+
+    for response, _ in pages:
+        fetch_cache.commit(response)
+
+    return tuple(counts)
 
 
 class Command(BaseCommand):
     help = 'My custom Django command'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Ignore the fetch cache and re-ingest the pages even if unchanged')
+        parser.add_argument('--sources', default=sources_file_path,
+                            help='JSON file listing the {"url", "selector", "adapter"} sources to scrape')
+        parser.add_argument('--stream', action='store_true',
+                            help='Use the streaming pipeline (no scrape_data.json round trip, batched ingest)')
+        parser.add_argument('--tournament', default=settings.DEFAULT_TOURNAMENT,
+                            help='Slug of the tournament the matches belong to')
+        parser.add_argument('--watch', action='store_true',
+                            help='Keep polling the sources, faster while matches are live, until interrupted')
+        parser.add_argument('--fast-interval', type=float,
+                            help='Seconds between polls of --watch while a match is live (default 30)')
+        parser.add_argument('--slow-interval', type=float,
+                            help='Seconds between polls of --watch while no match is live (default 900)')
+        parser.add_argument('--profile', action='store_true',
+                            help=f'Print the time and queries of each phase and a cProfile report, '
+                                 f'the stats are saved to {profile_file_path}')
+
     def handle(self, *args, **options):
         # Scrape from selected URL using css selector to return Match objects
         # Also used to update the scores and match results
         # Includes functionality to update power ranking based on ELO constants
 
-        scrape_and_write()  # Writes scraped data, can be disabled for debugging
-
-        # Open the file in read mode ('r')
-        with open(json_file_path, 'r') as json_file:
-            # Load the JSON content
-            json_data = json.load(json_file)
-
-        # Extract the list from the JSON data
-        extracted_list = json_data.get("data", [])
-
-        # create_sublists() should be adjusted based on the data structure of scraped site
-        grouped_list = create_sublists(extracted_list)
-
-        new_count = 0
-        update_count = 0
-        unchanged_count = 0
-
-        for sublist in grouped_list:
-            # Iterate through scraped sets
-
-            # Remove '\u2060\u2060' from elements 0 and 2, should be adjusted based on data structure
-            team1_str = sublist[0].replace('\u2060\u2060', '')
-            team2_str = sublist[-1].replace('\u2060\u2060', '')
-            team1_is_win = None
-            team2_is_win = None
-            score1_str = None
-            score2_str = None
-            matches_played = 0
-
-            if 'TBD' not in team1_str or 'TBD' not in team2_str:  # Eliminate matches with TBD contenders
-
-                if len(sublist) == 3:  # Upcoming match
-                    date_str = sublist[1]
-                    score1 = None
-                    score2 = None
-
-                elif len(sublist) == 5:  # Concluded match with score
-                    date_str = sublist[3]
-                    score1 = int(sublist[1])
-                    score2 = int(sublist[2])
-                    matches_played = score1 + score2
-
-                    score1_str = f"{sublist[1]} - {sublist[2]}"
-                    score2_str = f"{sublist[2]} - {sublist[1]}"
-
-                # -- To ensure reusability, don't use sublist elements beyond this line --#
-
-                # Search for existing Team model objects
-                team1 = get_object_or_404(Team, acronym=team1_str)
-                team2 = get_object_or_404(Team, acronym=team2_str)
-
-                formatted_date = convert_to_datetime(date_str)
-
-                # Save the match
-                new_match, created = Match.objects.get_or_create(
-                    datetime=formatted_date)
-
-                # Check if match and its effects have been previously resolved:
-                if not new_match.is_concluded:
-                    print(team1, team2, formatted_date)
-
-                    # Update Match fields based on winner and score
-                    if score1 is not None and score2 is not None and score1 > score2:
-                        # new_match.winner = team1
-                        new_match.result = score1_str
-                    elif score1 is not None and score2 is not None and score1 < score2:
-                        # new_match.winner = team2
-                        new_match.result = score2_str
-
-                    new_match.save()
-
-                    # On Match object creation, generate match odds based on teams' power rank at the time
-                    if created:
-                        odds1, odds2 = pr_to_odds(team1, team2)
-                        new_match.current_odds = (odds1, odds2)
-                        new_count += 1
-                    else:
-                        update_count += 1
-
-                    # Create or update MatchTeamRelation instances
-                    mtr1, created1 = MatchTeamRelation.objects.get_or_create(
-                        team=team1, match=new_match, defaults={
-                            'is_team1': True, 'is_winner': team1_is_win, 'match_score': score1_str}
-                    )
-                    mtr2, created2 = MatchTeamRelation.objects.get_or_create(
-                        team=team2, match=new_match, defaults={
-                            'is_team1': False, 'is_winner': team2_is_win, 'match_score': score2_str}
-                    )
-
-                    if len(sublist) == 5:
-                        # For concluded matches, adjust team power rankings and match-team relations
-
-                        # Only update pr if total of score equals match count and update only once
-                        if (score1 * 2 >= new_match.best_of) or (score2 * 2 >= new_match.best_of) or (matches_played == new_match.best_of):
-                            new_match.is_concluded = True
-
-                            team1_is_win, team2_is_win = check_winner(
-                                score1, score2)
-
-                            old_pr1, old_pr2, new_pr1, new_pr2 = adjust_team_pr(
-                                team1, team2, team1_is_win)
-
-                            mtr1.pr_delta = round((new_pr1 - old_pr1), 4)
-                            mtr2.pr_delta = round((new_pr2 - old_pr2), 4)
-                            mtr1.is_winner = team1_is_win
-                            mtr2.is_winner = team2_is_win
-
-                        mtr1.is_team1 = True
-                        mtr1.match_score = score1_str
-                        mtr1.save()
-
-                        mtr2.is_team1 = False
-                        mtr2.match_score = score2_str
-                        mtr2.save()
-
-                    # Update Match fields based on winner and score
-                    if team1_is_win:
-                        new_match.winner = team1
-                        # new_match.result = score1
-                    elif team2_is_win:
-                        new_match.winner = team2
-                        # new_match.result = score2
-
-                    new_match.save()
-                else:
-                    unchanged_count += 1
+        tournament = Tournament.objects.filter(slug=options['tournament']).first()
+        if tournament is None:
+            raise CommandError(f"No tournament with the slug {options['tournament']}, import its teams first")
+
+        try:
+            sources = load_sources(options.get('sources', sources_file_path))
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options.get('watch'):
+            self.watch(sources, tournament, options)
+            return
+
+        profile = options.get('profile', False)
+        profiler = cProfile.Profile() if profile else None
+        with recording('scrape_matches', always=profile) as recorder:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                counts = run_scrape(force=options.get('force', False), sources=sources,
+                                    stream=options.get('stream', False), tournament=tournament)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+
+        if profile:
+            self.write_profile(recorder, profiler)
+
+        if counts is None:
+            self.stdout.write(self.style.SUCCESS(
+                'Pages unchanged since the last scrape, nothing to ingest.'))
+            return
+
+        new_count, update_count, unchanged_count, skipped_count, unknown_count = counts
 
         self.stdout.write(self.style.SUCCESS(
             f'New match objects created: {new_count}'))
@@ -297,3 +587,39 @@ class Command(BaseCommand):
             f'Match objects updated: {update_count}'))
         self.stdout.write(self.style.SUCCESS(
             f'Match objects unchanged: {unchanged_count}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Match objects skipped by fingerprint: {skipped_count}'))
+        if unknown_count:
+            self.stdout.write(self.style.WARNING(
+                f'Sets skipped for an unknown team: {unknown_count}'))
+
+    def watch(self, sources, tournament, options):
+        from ...watch import FAST_INTERVAL, SLOW_INTERVAL, Watcher
+
+        fast = options.get('fast_interval') or FAST_INTERVAL
+        slow = options.get('slow_interval') or SLOW_INTERVAL
+        if not 0 < fast <= slow:
+            raise CommandError('--fast-interval must be positive and at most --slow-interval')
+
+        watcher = Watcher(sources, tournament, stream=options.get('stream', False), fast=fast, slow=slow,
+                          report=self.stdout.write)
+        # Ctrl+C / SIGTERM finish the poll in progress, then exit
+        previous_handlers = {signum: signal.signal(signum, watcher.stop) for signum in (signal.SIGINT, signal.SIGTERM)}
+        self.stdout.write(f'Watching {len(sources)} sources for {tournament}, every {fast:.0f}s while matches are live '
+                          f'and {slow:.0f}s otherwise')
+        try:
+            watcher.run()
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(f'Stopped after {watcher.iterations} polls'))
+
+    def write_profile(self, recorder, profiler):
+        for line in recorder.summary():
+            self.stdout.write(line)
+
+        profiler.dump_stats(profile_file_path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(profile_report_lines)
+        self.stdout.write(report.getvalue())
+        self.stdout.write(f'cProfile stats saved to {profile_file_path}')
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ...betting import exposure_from_bets
+from ...models import Exposure
+
+# Float sums accumulated bet by bet differ from a fresh SUM() in the last digits
+TOLERANCE = 1e-6
+
+
+def compare_exposure():
+    # [(match id, team id, stored totals, totals from bets)] of every side that doesn't match
+    expected = exposure_from_bets()
+    stored = {(match_id, team_id): (stake, payout, count) for match_id, team_id, stake, payout, count in
+              Exposure.objects.values_list('match_id', 'team_id', 'total_stake', 'total_payout', 'bet_count')}
+
+    mismatches = []
+    for key in sorted(expected.keys() | stored.keys()):
+        stored_totals, expected_totals = stored.get(key), expected.get(key)
+        if stored_totals is None or expected_totals is None or stored_totals[2] != expected_totals[2] or \
+                any(abs(a - b) > TOLERANCE for a, b in zip(stored_totals[:2], expected_totals[:2])):
+            mismatches.append((*key, stored_totals, expected_totals))
+    return mismatches
+
+
+class Command(BaseCommand):
+    help = 'Reconcile the exposure table against the open bets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Rebuild the exposure table from the bets')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            mismatches = compare_exposure()
+            for match_id, team_id, stored, expected in mismatches:
+                self.stdout.write(
+                    f'Match {match_id}, team {team_id}: stored {stored}, bets {expected}')
+
+            if mismatches and options['fix']:
+                Exposure.objects.all().delete()
+                Exposure.objects.bulk_create(
+                    [Exposure(match_id=match_id, team_id=team_id, total_stake=stake,
+                              total_payout=payout, bet_count=count)
+                     for (match_id, team_id), (stake, payout, count) in exposure_from_bets().items()],
+                    batch_size=500)
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('Exposure matches the open bets'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt the exposure table, {len(mismatches)} sides were off'))
+        else:
+            raise CommandError(f'{len(mismatches)} sides of the exposure table do not match the open bets')
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('match_bet', '0006_alter_match_best_of'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=40, null=True),
+        ),
+    ]
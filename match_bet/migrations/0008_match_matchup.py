@@ -0,0 +1,34 @@
+# Generated by Django 4.2.6 on 2026-10-18 16:38
+
+from django.db import migrations, models
+
+
+def backfill_matchups(apps, schema_editor):
+    Match = apps.get_model('match_bet', 'Match')
+    MatchTeamRelation = apps.get_model('match_bet', 'MatchTeamRelation')
+
+    names = {}
+    relations = MatchTeamRelation.objects.select_related('team').order_by('match_id', '-is_team1', 'id')
+    for relation in relations:
+        names.setdefault(relation.match_id, []).append(relation.team.name)
+
+    matches = list(Match.objects.filter(id__in=names))
+    for match in matches:
+        match.matchup = " vs ".join(names[match.id])
+    Match.objects.bulk_update(matches, ['matchup'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('match_bet', '0007_match_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='matchup',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_matchups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.6 on 2026-10-18 16:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, F, Sum
+
+
+def backfill_exposure(apps, schema_editor):
+    # Bets placed before this migration are all open
+    Bet = apps.get_model('match_bet', 'Bet')
+    Exposure = apps.get_model('match_bet', 'Exposure')
+
+    totals = (Bet.objects.values('match_id', 'team_id')
+              .annotate(total_stake=Sum('stake'), total_payout=Sum(F('stake') * F('odds')), bet_count=Count('id')))
+    Exposure.objects.bulk_create([Exposure(**row) for row in totals], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('match_bet', '0009_dataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bet',
+            name='payout',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='Exposure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_stake', models.FloatField(default=0)),
+                ('total_payout', models.FloatField(default=0)),
+                ('bet_count', models.IntegerField(default=0)),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='match_bet.match')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='match_bet.team')),
+            ],
+            options={
+                'unique_together': {('match', 'team')},
+            },
+        ),
+        migrations.RunPython(backfill_exposure, migrations.RunPython.noop),
+    ]
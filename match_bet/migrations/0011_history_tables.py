@@ -0,0 +1,111 @@
+# Generated by Django 4.2.6 on 2026-10-18 16:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+from datetime import datetime
+
+
+def team_matches(MatchTeamRelation):
+    # Each team's concluded matches in chronological order, the i-th one replaced the
+    # i-th PR of the team's history
+    matches = {}
+    relations = (MatchTeamRelation.objects.filter(match__is_concluded=True)
+                 .order_by('match__datetime', 'match_id').values_list('team_id', 'match_id', 'match__datetime'))
+    for team_id, match_id, match_datetime in relations:
+        matches.setdefault(team_id, []).append((match_id, match_datetime))
+    return matches
+
+
+def histories_to_tables(apps, schema_editor):
+    Team = apps.get_model('match_bet', 'Team')
+    Match = apps.get_model('match_bet', 'Match')
+    MatchTeamRelation = apps.get_model('match_bet', 'MatchTeamRelation')
+    PRHistory = apps.get_model('match_bet', 'PRHistory')
+    OddsHistory = apps.get_model('match_bet', 'OddsHistory')
+
+    matches = team_matches(MatchTeamRelation)
+    pr_rows = []
+    for team_id, pr_history in Team.objects.values_list('id', 'pr_history'):
+        # Entries without a concluded match to date them are dropped, recompute_ratings
+        # rebuilds the whole history from the matches
+        for pr, (match_id, match_datetime) in zip(pr_history or [], matches.get(team_id, [])):
+            pr_rows.append(PRHistory(team_id=team_id, match_id=match_id, datetime=match_datetime, pr=pr))
+    PRHistory.objects.bulk_create(pr_rows, batch_size=500)
+
+    odds_rows = []
+    for match_id, odds_history in Match.objects.values_list('id', 'odds_history'):
+        for entry in odds_history or []:
+            odds_rows.append(OddsHistory(match_id=match_id, datetime=datetime.fromisoformat(entry['timestamp']),
+                                         odds1=entry['odds'][0], odds2=entry['odds'][1]))
+    OddsHistory.objects.bulk_create(odds_rows, batch_size=500)
+
+
+def tables_to_histories(apps, schema_editor):
+    Team = apps.get_model('match_bet', 'Team')
+    Match = apps.get_model('match_bet', 'Match')
+    PRHistory = apps.get_model('match_bet', 'PRHistory')
+    OddsHistory = apps.get_model('match_bet', 'OddsHistory')
+
+    pr_histories = {}
+    for team_id, pr in PRHistory.objects.order_by('datetime', 'id').values_list('team_id', 'pr'):
+        pr_histories.setdefault(team_id, []).append(pr)
+    teams = list(Team.objects.filter(id__in=pr_histories))
+    for team in teams:
+        team.pr_history = pr_histories[team.id]
+    Team.objects.bulk_update(teams, ['pr_history'], batch_size=500)
+
+    odds_histories = {}
+    for match_id, changed_at, odds1, odds2 in (OddsHistory.objects.order_by('datetime', 'id')
+                                               .values_list('match_id', 'datetime', 'odds1', 'odds2')):
+        odds_histories.setdefault(match_id, []).append({'timestamp': changed_at.isoformat(), 'odds': [odds1, odds2]})
+    matches = list(Match.objects.filter(id__in=odds_histories))
+    for match in matches:
+        match.odds_history = odds_histories[match.id]
+    Match.objects.bulk_update(matches, ['odds_history'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('match_bet', '0010_exposure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PRHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime', models.DateTimeField()),
+                ('pr', models.FloatField()),
+                ('match', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='match_bet.match')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pr_changes', to='match_bet.team')),
+            ],
+            options={
+                'verbose_name_plural': 'PR history',
+                'indexes': [models.Index(fields=['team', 'datetime'], name='match_bet_p_team_id_4d0505_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='OddsHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime', models.DateTimeField()),
+                ('odds1', models.FloatField()),
+                ('odds2', models.FloatField()),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='odds_changes', to='match_bet.match')),
+            ],
+            options={
+                'verbose_name_plural': 'odds history',
+                'indexes': [models.Index(fields=['match', 'datetime'], name='match_bet_o_match_i_a14355_idx')],
+            },
+        ),
+        migrations.RunPython(histories_to_tables, tables_to_histories),
+        migrations.RemoveField(
+            model_name='match',
+            name='odds_history',
+        ),
+        migrations.RemoveField(
+            model_name='team',
+            name='pr_history',
+        ),
+    ]
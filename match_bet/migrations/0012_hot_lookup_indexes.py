@@ -0,0 +1,35 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('match_bet', '0011_history_tables'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='match',
+            name='stage',
+            field=models.CharField(choices=[('swiss', 'Swiss Stage'), ('knockout', 'Knockout Stage'), ('final', 'Final')], db_index=True, default='swiss', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='team',
+            name='acronym',
+            field=models.CharField(db_index=True, max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(condition=models.Q(('is_concluded', False)), fields=['datetime'], name='match_upcoming_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(condition=models.Q(('is_concluded', True)), fields=['datetime'], name='match_concluded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='matchteamrelation',
+            index=models.Index(fields=['match', 'is_team1'], name='match_bet_m_match_i_46c83b_idx'),
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Every team and match so far belongs to the one tournament the app handled,
+# same slug as the DEFAULT_TOURNAMENT setting
+EXISTING_TOURNAMENT = ('worlds-2023', '2023 World Championship')
+
+
+def assign_existing_tournament(apps, schema_editor):
+    Tournament = apps.get_model('match_bet', 'Tournament')
+    Team = apps.get_model('match_bet', 'Team')
+    Match = apps.get_model('match_bet', 'Match')
+
+    if not Team.objects.exists() and not Match.objects.exists():
+        return
+    slug, name = EXISTING_TOURNAMENT
+    tournament, _ = Tournament.objects.get_or_create(slug=slug, defaults={'name': name})
+    Team.objects.update(tournament=tournament)
+    Match.objects.update(tournament=tournament)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('match_bet', '0012_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tournament',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('slug', models.SlugField(unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='tournament',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='teams', to='match_bet.tournament'),
+        ),
+        migrations.AddField(
+            model_name='match',
+            name='tournament',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='match_bet.tournament'),
+        ),
+        migrations.RunPython(assign_existing_tournament, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='team',
+            name='tournament',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='teams', to='match_bet.tournament'),
+        ),
+        migrations.AlterField(
+            model_name='match',
+            name='tournament',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='match_bet.tournament'),
+        ),
+        migrations.RemoveIndex(
+            model_name='match',
+            name='match_upcoming_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='match',
+            name='match_concluded_idx',
+        ),
+        migrations.AlterField(
+            model_name='match',
+            name='datetime',
+            field=models.DateTimeField(),
+        ),
+        migrations.AlterField(
+            model_name='match',
+            name='stage',
+            field=models.CharField(choices=[('swiss', 'Swiss Stage'), ('knockout', 'Knockout Stage'), ('final', 'Final')], default='swiss', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='team',
+            name='acronym',
+            field=models.CharField(max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['tournament', 'datetime'], name='match_bet_m_tournam_d48556_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['tournament', 'stage'], name='match_bet_m_tournam_d5fa6f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(condition=models.Q(('is_concluded', False)), fields=['tournament', 'datetime'], name='match_upcoming_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(condition=models.Q(('is_concluded', True)), fields=['tournament', 'datetime'], name='match_concluded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='team',
+            index=models.Index(fields=['tournament', 'acronym'], name='match_bet_t_tournam_35ad6d_idx'),
+        ),
+    ]
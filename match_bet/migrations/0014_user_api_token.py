@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('match_bet', '0013_tournament'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='api_token_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
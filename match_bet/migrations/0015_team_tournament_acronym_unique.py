@@ -0,0 +1,41 @@
+# Generated by Django 4.2.6 on 2026-10-18 17:51
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicate_acronyms(apps, schema_editor):
+    # Duplicates can't be merged automatically (their matches, bets and PR history would
+    # have to be moved to one team), so they have to be fixed by hand before migrating
+    Team = apps.get_model('match_bet', 'Team')
+
+    duplicates = list(Team.objects.values('tournament_id', 'acronym').annotate(count=Count('id'))
+                      .filter(count__gt=1).order_by('tournament_id', 'acronym'))
+    if duplicates:
+        lines = []
+        for duplicate in duplicates:
+            ids = Team.objects.filter(tournament_id=duplicate['tournament_id'], acronym=duplicate['acronym'])\
+                .order_by('id').values_list('id', flat=True)
+            lines.append(f"tournament {duplicate['tournament_id']}, acronym {duplicate['acronym']}: "
+                         f"teams {', '.join(map(str, ids))}")
+        raise RuntimeError('Teams share an acronym within a tournament, rename or merge them before migrating:\n'
+                           + '\n'.join(lines))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('match_bet', '0014_user_api_token'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_acronyms, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='team',
+            name='match_bet_t_tournam_35ad6d_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='team',
+            constraint=models.UniqueConstraint(fields=('tournament', 'acronym'), name='team_tournament_acronym_unique'),
+        ),
+    ]
@@ -1,7 +1,43 @@
-from django.db import models
+import hashlib
+import secrets
+import time
+
+from django.conf import settings
+from django.db import models, transaction
 from django.utils import timezone
 
 
+class TournamentManager(models.Manager):
+    def get_by_natural_key(self, slug):
+        return self.get(slug=slug)
+
+    def default(self):
+        # settings.DEFAULT_TOURNAMENT, created on first use
+        tournament, _ = self.get_or_create(slug=settings.DEFAULT_TOURNAMENT,
+                                           defaults={'name': settings.DEFAULT_TOURNAMENT})
+        return tournament
+
+
+class Tournament(models.Model):
+    # An event: owns its teams (with their ratings for the event) and its matches, so
+    # events never collide on a match time or a team acronym
+    name = models.CharField(max_length=255)
+    slug = models.SlugField(unique=True)
+
+    objects = TournamentManager()
+
+    def __str__(self):
+        return self.name
+
+    def natural_key(self):
+        return (self.slug,)
+
+
+class TeamManager(models.Manager):
+    def get_by_natural_key(self, tournament_slug, acronym):
+        return self.get(tournament__slug=tournament_slug, acronym=acronym)
+
+
 class Team(models.Model):
     ORIGIN_CHOICES = [
         ('lck', 'LCK'),
@@ -17,17 +53,45 @@ class Team(models.Model):
         (4, '4'),
     ]
 
+    # A team's entry in one tournament, PR and seed are per event. An acronym names one
+    # team per tournament, the constraint's index serves the (tournament, acronym) lookups
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE, related_name='teams', db_index=False)
     name = models.CharField(max_length=255)
     acronym = models.CharField(max_length=10)
     base_pr = models.FloatField()
     current_pr = models.FloatField()
-    pr_history = models.JSONField(default=list, null=True, blank=True)
     seed = models.IntegerField(choices=SEEDING_CHOICES)
     origin = models.CharField(max_length=10, choices=ORIGIN_CHOICES)
 
+    objects = TeamManager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['tournament', 'acronym'], name='team_tournament_acronym_unique')]
+
     def __str__(self):
         return self.name
 
+    def natural_key(self):
+        return self.tournament.natural_key() + (self.acronym,)
+
+    natural_key.dependencies = ['match_bet.tournament']
+
+    def pr_as_of(self, when):
+        return value_as_of(self.pr_changes, when, ('pr',), (self.current_pr,))[0]
+
+    def pr_changes_between(self, start, end):
+        # [(datetime, PR before, PR after)] of the PR changes in [start, end]
+        return [(changed_at, before[0], after[0]) for changed_at, before, after in
+                changes_between(self.pr_changes, start, end, ('pr',), (self.current_pr,))]
+
+
+class MatchManager(models.Manager):
+    def get_by_natural_key(self, tournament_slug, datetime, team1_acronym, team2_acronym):
+        return self.get(tournament__slug=tournament_slug, datetime=datetime,
+                        matchteamrelation__team__acronym=team1_acronym, matchteamrelation__is_team1=True,
+                        id__in=MatchTeamRelation.objects.filter(team__acronym=team2_acronym, is_team1=False)
+                        .values('match_id'))
+
 
 class Match(models.Model):
     list_display = ('display_info', 'stage', 'teams' 'formatted_datetime')
@@ -49,7 +113,10 @@ class Match(models.Model):
                       ('3-2', '3-2'),
                       ]
 
-    datetime = models.DateTimeField(unique=True)
+    # Identified by (tournament, datetime, team pair), see natural_key(). Indexed by
+    # the indexes below, which all lead with the tournament
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE, related_name='matches', db_index=False)
+    datetime = models.DateTimeField()
     stage = models.CharField(
         max_length=255, choices=STAGE_CHOICES, default='swiss')
     teams = models.ManyToManyField(
@@ -60,45 +127,87 @@ class Match(models.Model):
                                related_name='match_winners', on_delete=models.SET_NULL)
     is_concluded = models.BooleanField(default=False)
 
+    # Hash of the scraped fixture last ingested for this match, unchanged fixtures are skipped
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, editable=False)
+
+    # Denormalized "Team 1 vs Team 2" label, kept up to date by ingest and the admin
+    matchup = models.CharField(max_length=255, blank=True, default='', editable=False)
+
     # Add a field for current odds
     current_odds = models.JSONField(default=tuple, null=True, blank=True)
 
-    # Add a field for odds history
-    odds_history = models.JSONField(default=list, null=True, blank=True)
+    objects = MatchManager()
 
     def __str__(self):
         formatted_date = self.datetime.strftime(
             '%m/%d - %I%p').replace(' 0', ' ')
-        teams = ", ".join([team.name for team in self.teams.all()])
-        return f"{formatted_date} | {teams}"
+        return f"{formatted_date} | {self.matchup}"
 
     class Meta:
         verbose_name_plural = 'matches'
+        # Upcoming / concluded matches in chronological order use partial indexes, a plain
+        # index on is_concluded can't be searched by the 'NOT is_concluded' Django filters with
+        indexes = [
+            models.Index(fields=['tournament', 'datetime']),
+            models.Index(fields=['tournament', 'stage']),
+            models.Index(fields=['tournament', 'datetime'], condition=models.Q(is_concluded=False),
+                         name='match_upcoming_idx'),
+            models.Index(fields=['tournament', 'datetime'], condition=models.Q(is_concluded=True),
+                         name='match_concluded_idx'),
+        ]
+
+    def natural_key(self):
+        # (tournament slug, datetime, team 1 acronym, team 2 acronym)
+        acronyms = (self.matchteamrelation_set.order_by('-is_team1', 'id')
+                    .values_list('team__acronym', flat=True))
+        return self.tournament.natural_key() + (self.datetime, *acronyms)
+
+    natural_key.dependencies = ['match_bet.tournament', 'match_bet.team']
+
+    @staticmethod
+    def matchup_label(*teams):
+        return " vs ".join(team.name for team in teams)
 
-    def update_current_odds(self, new_odds):  # Currently inactive
-        # Update current odds
-        self.current_odds = new_odds
-        self.save()
+    def refresh_matchup(self):
+        # Rebuild the matchup label from the match's teams, team 1 first
+        relations = sorted(self.matchteamrelation_set.all(),
+                           key=lambda relation: (not relation.is_team1, relation.id))
+        self.matchup = self.matchup_label(*(relation.team for relation in relations))
 
-    def archive_current_odds(self):  # Currently inactive
-        # Move current odds to bet history
-        if self.current_odds is not None:
-            self.bet_history.append({
-                'timestamp': timezone.now().isoformat(),
-                'odds': self.current_odds
-            })
-            self.current_odds = None
-            self.save()
+    @classmethod
+    def refresh_matchups(cls, matches):
+        # Bulk refresh_matchup() for a queryset of matches
+        matches = list(matches.prefetch_related(models.Prefetch(
+            'matchteamrelation_set', queryset=MatchTeamRelation.objects.select_related('team'))))
+        for match in matches:
+            match.refresh_matchup()
+        cls.objects.bulk_update(matches, ['matchup'], batch_size=500)
 
-    def calculate_new_odds(self):  # Currently inactive
-        # Your logic for calculating new odds based on certain conditions (time, number of bets)
+    def update_current_odds(self, new_odds):
+        # Archive the current odds and set the new ones
+        with transaction.atomic():
+            self.archive_current_odds()
+            self.current_odds = new_odds
+            self.save(update_fields=['current_odds'])
 
-        # For example, let's say new odds are calculated based on some conditions
-        new_odds = 2.5
+    def archive_current_odds(self):
+        # Append the current odds to the odds history
+        if self.current_odds:
+            OddsHistory.objects.create(match=self, datetime=timezone.now(),
+                                       odds1=self.current_odds[0], odds2=self.current_odds[1])
 
-        # Update current odds and archive previous odds
-        self.archive_current_odds()
-        self.update_current_odds(new_odds)
+    def odds_as_of(self, when):
+        return value_as_of(self.odds_changes, when, ('odds1', 'odds2'), tuple(self.current_odds or (None, None)))
+
+    def odds_changes_between(self, start, end):
+        # [(datetime, odds before, odds after)] of the odds changes in [start, end]
+        return changes_between(self.odds_changes, start, end, ('odds1', 'odds2'),
+                               tuple(self.current_odds or (None, None)))
+
+    def calculate_new_odds(self):
+        # Odds from the teams' current PR and the bets placed on each side so far
+        from .odds import match_odds
+        return match_odds(self.id)
 
 
 class MatchTeamRelation(models.Model):
@@ -112,15 +221,37 @@ class MatchTeamRelation(models.Model):
     class Meta:
         # Ensure uniqueness for each team in a match
         unique_together = ('team', 'match')
+        # A match's teams, team 1 first
+        indexes = [models.Index(fields=['match', 'is_team1'])]
 
 
 class User(models.Model):
     name = models.CharField(max_length=255)
     balance = models.FloatField()
+    # SHA-256 of the user's bet API token, the token itself is only shown when issued
+    api_token_hash = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
 
     def __str__(self):
         return self.name
 
+    def issue_api_token(self):
+        # Replaces the user's token, returns the new one
+        token = secrets.token_urlsafe(32)
+        self.api_token_hash = hash_api_token(token)
+        self.save(update_fields=['api_token_hash'])
+        return token
+
+    @classmethod
+    def from_api_token(cls, token):
+        # The user of a token, None if it's unknown
+        if not token:
+            return None
+        return cls.objects.filter(api_token_hash=hash_api_token(token)).first()
+
+
+def hash_api_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
 
 class Bet(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -129,5 +260,97 @@ class Bet(models.Model):
     odds = models.FloatField()
     stake = models.FloatField()
 
+    # Amount credited when the match was settled, None while the bet is open
+    payout = models.FloatField(null=True, blank=True)
+
     def __str__(self):
         return f"{self.user} bet {self.stake} on {self.team} in match {self.match}"
+
+
+class Exposure(models.Model):
+    # Running totals of the open bets on each side of a match, updated in the same
+    # transaction as every bet placement and settlement so reading a match's
+    # liability never scans its bets. 'manage.py verify_exposure' reconciles it
+    match = models.ForeignKey(Match, on_delete=models.CASCADE)
+    team = models.ForeignKey(Team, on_delete=models.CASCADE)
+    total_stake = models.FloatField(default=0)
+    total_payout = models.FloatField(default=0)  # stake x odds
+    bet_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('match', 'team')
+
+    def __str__(self):
+        return f"{self.team} in {self.match}: {self.bet_count} bets, {self.total_payout:.2f} payout"
+
+
+def value_as_of(changes, when, fields, current):
+    # History rows hold the value that was replaced at their datetime, so the value at a
+    # given time is the one replaced by the first change after it, or the current value.
+    # One query on the (owner, datetime) index
+    value = changes.filter(datetime__gt=when).order_by('datetime', 'id').values_list(*fields).first()
+    return current if value is None else value
+
+
+def changes_between(changes, start, end, fields, current):
+    # [(datetime, value before, value after)] of the changes in [start, end]
+    rows = list(changes.filter(datetime__gte=start, datetime__lte=end)
+                .order_by('datetime', 'id').values_list('datetime', *fields))
+    befores = [row[1:] for row in rows]
+    afters = befores[1:] + [value_as_of(changes, end, fields, current)] if rows else []
+    return [(row[0], before, after) for row, before, after in zip(rows, befores, afters)]
+
+
+class PRHistory(models.Model):
+    # Append-only PR history: the PR a team had until the match at 'datetime' changed it
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='pr_changes')
+    match = models.ForeignKey(Match, null=True, blank=True, on_delete=models.SET_NULL)
+    datetime = models.DateTimeField()
+    pr = models.FloatField()
+
+    class Meta:
+        verbose_name_plural = 'PR history'
+        indexes = [models.Index(fields=['team', 'datetime'])]
+
+
+class OddsHistory(models.Model):
+    # Append-only odds history: the odds a match had until they changed at 'datetime'
+    match = models.ForeignKey(Match, on_delete=models.CASCADE, related_name='odds_changes')
+    datetime = models.DateTimeField()
+    odds1 = models.FloatField()
+    odds2 = models.FloatField()
+
+    class Meta:
+        verbose_name_plural = 'odds history'
+        indexes = [models.Index(fields=['match', 'datetime'])]
+
+
+class DataVersion(models.Model):
+    # Single-row counter bumped by every write to teams, matches or results. The API
+    # derives its ETags from it, so an unchanged poll can be answered without queries
+    version = models.BigIntegerField(default=0)
+
+    # Seconds a process trusts its last read of the version before asking the DB again,
+    # bumps from the same process are seen immediately
+    CACHE_SECONDS = 1
+
+    _cached = None  # (version, read at)
+
+    @classmethod
+    def bump(cls):
+        if not cls.objects.filter(pk=1).update(version=models.F('version') + 1):
+            cls.objects.create(pk=1, version=1)
+        transaction.on_commit(cls.forget)
+
+    @classmethod
+    def forget(cls):
+        cls._cached = None
+
+    @classmethod
+    def current(cls):
+        cached = cls._cached
+        if cached is not None and time.monotonic() - cached[1] < cls.CACHE_SECONDS:
+            return cached[0]
+        version = cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+        cls._cached = (version, time.monotonic())
+        return version
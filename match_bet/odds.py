@@ -0,0 +1,261 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Exposure, Match, MatchTeamRelation, Team
+from .ratings import pr_win_weight
+
+# Total stake at which the bet imbalance weighs IMBALANCE_WEIGHT / 2 in the odds
+IMBALANCE_LIQUIDITY = 1000
+IMBALANCE_WEIGHT = 0.5
+
+# Implied win probabilities are kept within these bounds
+MIN_PROBABILITY = 0.02
+MAX_PROBABILITY = 0.98
+
+
+def odds_row(weight, weights):
+    # Odds of a team with the given win weight against each of the weights, same
+    # rounding as pr_to_odds so matrix[i][j], matrix[j][i] == pr_to_odds(team_i, team_j)
+    return [round((1 / (weight / (weight + other))), 2) for other in weights]
+
+
+class OddsMatrix:
+    # N x N odds of every pairing of teams, built in one pass from current_pr and kept
+    # in memory. When a team's PR changes only its row and column are rebuilt, so reading
+    # a pairing's odds never touches the DB. Changes made in other processes (e.g.
+    # management commands) are picked up by a full rebuild once max_age seconds have passed.
+    # Holds the teams of one tournament, or of all of them if tournament_id is None
+
+    def __init__(self, max_age=300, tournament_id=None):
+        self.max_age = max_age
+        self.tournament_id = tournament_id
+        self._lock = threading.Lock()
+        self._index = None  # team id -> position
+        self._prs = []
+        self._weights = []
+        self._matrix = []
+        self._built_at = 0
+
+    def rebuild(self):
+        teams = Team.objects.order_by('id')
+        if self.tournament_id is not None:
+            teams = teams.filter(tournament_id=self.tournament_id)
+        teams = list(teams.values_list('id', 'current_pr'))
+        weights = [pr_win_weight(pr) for _, pr in teams]
+        matrix = [odds_row(weight, weights) for weight in weights]
+
+        with self._lock:
+            self._index = {team_id: i for i, (team_id, _) in enumerate(teams)}
+            self._prs = [pr for _, pr in teams]
+            self._weights = weights
+            self._matrix = matrix
+            self._built_at = time.monotonic()
+
+    def invalidate(self):
+        # Full rebuild on the next read
+        with self._lock:
+            self._index = None
+
+    def has_team(self, team_id):
+        index = self._index
+        return index is not None and team_id in index
+
+    def _ensure_built(self, *team_ids):
+        index = self._index
+        if index is None or time.monotonic() - self._built_at > self.max_age or \
+                any(team_id not in index for team_id in team_ids):
+            self.rebuild()
+
+    def odds(self, team1_id, team2_id):
+        # (team1 odds, team2 odds) for the pairing, same values as pr_to_odds
+        self._ensure_built(team1_id, team2_id)
+        index = self._index
+        i, j = index[team1_id], index[team2_id]
+        return self._matrix[i][j], self._matrix[j][i]
+
+    def update_team(self, team_id, current_pr):
+        # Rebuild a single team's row and column after its PR changed
+        with self._lock:
+            if self._index is None or team_id not in self._index:
+                # Not built yet, or a new team: picked up by the next full rebuild
+                self._index = None
+                return
+
+            i = self._index[team_id]
+            if self._prs[i] == current_pr:
+                return
+
+            weight = pr_win_weight(current_pr)
+            self._prs[i] = current_pr
+            self._weights[i] = weight
+
+            row = odds_row(weight, self._weights)
+            for other, other_weight in enumerate(self._weights):
+                self._matrix[other][i] = round((1 / (other_weight / (other_weight + weight))), 2)
+            self._matrix[i] = row
+
+
+class TournamentOddsMatrices:
+    # One OddsMatrix per tournament, built the first time one of its pairings is read.
+    # Teams only meet teams of their own tournament, so a matrix stays the size of one
+    # event however many events the database holds. Same interface as OddsMatrix
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._matrices = {}  # tournament id -> OddsMatrix
+
+    def _matrix_of(self, team_id):
+        for matrix in list(self._matrices.values()):
+            if matrix.has_team(team_id):
+                return matrix
+
+        # A team none of the built matrices knows, one query for its tournament
+        tournament_id = Team.objects.filter(id=team_id).values_list('tournament_id', flat=True).first()
+        if tournament_id is None:
+            raise KeyError(team_id)
+        with self._lock:
+            return self._matrices.setdefault(tournament_id, OddsMatrix(self.max_age, tournament_id))
+
+    def odds(self, team1_id, team2_id):
+        matrix = self._matrix_of(team1_id)
+        if matrix is not self._matrix_of(team2_id):
+            raise KeyError(team2_id)  # Teams of different tournaments never meet
+        return matrix.odds(team1_id, team2_id)
+
+    def update_team(self, team_id, current_pr):
+        # Teams of matrices that aren't built yet are read with their matrix
+        for matrix in list(self._matrices.values()):
+            if matrix.has_team(team_id):
+                matrix.update_team(team_id, current_pr)
+                return
+
+    def invalidate(self):
+        with self._lock:
+            self._matrices = {}
+
+
+odds_matrix = TournamentOddsMatrices()
+
+
+def invalidate_teams(teams):
+    # Updates the teams' rows once the current transaction commits (immediately
+    # outside of one), so rolled back PR changes never reach the matrix
+    def update():
+        for team in teams:
+            odds_matrix.update_team(team.id, team.current_pr)
+
+    transaction.on_commit(update)
+
+
+def priced_odds(pr_odds, stakes):
+    # Shifts the win probabilities implied by the ratings' odds towards the split of the
+    # money staked on each side, weighted by how much has been staked: more money on a
+    # team shortens its odds. pr_odds and stakes are (team 1, team 2) pairs
+    total_stake = stakes[0] + stakes[1]
+    if total_stake <= 0:
+        return tuple(pr_odds)
+
+    probability1 = (1 / pr_odds[0]) / ((1 / pr_odds[0]) + (1 / pr_odds[1]))
+    weight = IMBALANCE_WEIGHT * total_stake / (total_stake + IMBALANCE_LIQUIDITY)
+    probability1 = (1 - weight) * probability1 + weight * stakes[0] / total_stake
+    probability1 = min(max(probability1, MIN_PROBABILITY), MAX_PROBABILITY)
+    return round(1 / probability1, 2), round(1 / (1 - probability1), 2)
+
+
+def match_odds(match_id):
+    # Current odds of a match from its teams' PR (via the odds matrix) and its open bets,
+    # None for a match without two teams
+    team_ids = list(MatchTeamRelation.objects.filter(match_id=match_id)
+                    .order_by('-is_team1', 'id').values_list('team_id', flat=True))
+    if len(team_ids) != 2:
+        return None
+
+    stakes = dict(Exposure.objects.filter(match_id=match_id).values_list('team_id', 'total_stake'))
+    return priced_odds(odds_matrix.odds(*team_ids), [stakes.get(team_id, 0) for team_id in team_ids])
+
+
+def reprice_match(match_id):
+    # Recalculates an upcoming match's odds, archiving the old ones in the same write.
+    # Returns the new odds, None if unchanged. The reads aren't wrapped in a transaction
+    # with the write: on SQLite a read transaction that then writes fails at once when
+    # another connection holds the write lock, instead of waiting for it. Matches are
+    # repriced through the OddsRepricer, at most once per interval each
+    match = Match.objects.filter(id=match_id, is_concluded=False).only('id', 'current_odds').first()
+    if match is None:
+        return None
+    new_odds = match.calculate_new_odds()
+    if new_odds is None or list(new_odds) == list(match.current_odds or []):
+        return None
+    match.update_current_odds(new_odds)
+    return new_odds
+
+
+class OddsRepricer:
+    # Coalesces repricing requests per match so a match is written at most once per
+    # interval however many bets it takes: the first request reprices right away,
+    # requests within the interval after it are folded into a single reprice (on a
+    # timer thread) at the end of the interval
+
+    def __init__(self, interval=None, timer=threading.Timer):
+        self._interval = interval
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._last_run = {}  # match id -> monotonic time of its last reprice
+        self._scheduled = {}  # match id -> pending timer
+
+    @property
+    def interval(self):
+        if self._interval is not None:
+            return self._interval
+        return getattr(settings, 'ODDS_REPRICE_INTERVAL', 5)
+
+    def request(self, match_id):
+        with self._lock:
+            if match_id in self._scheduled:
+                return
+            wait = self._last_run.get(match_id, -math.inf) + self.interval - time.monotonic()
+            if wait > 0:
+                timer = self._timer(wait, self._run_scheduled, (match_id,))
+                timer.daemon = True
+                self._scheduled[match_id] = timer
+                timer.start()
+                return
+            self._last_run[match_id] = time.monotonic()
+        reprice_match(match_id)
+
+    def _run_scheduled(self, match_id):
+        with self._lock:
+            if self._scheduled.pop(match_id, None) is None:
+                return  # Cancelled or flushed
+            self._last_run[match_id] = time.monotonic()
+        try:
+            reprice_match(match_id)
+        finally:
+            # Timer threads don't go through the request cycle that closes connections
+            connection.close()
+
+    def flush(self):
+        # Runs the pending reprices now, in the calling thread
+        with self._lock:
+            scheduled, self._scheduled = self._scheduled, {}
+            for match_id, timer in scheduled.items():
+                timer.cancel()
+                self._last_run[match_id] = time.monotonic()
+        for match_id in scheduled:
+            reprice_match(match_id)
+        return len(scheduled)
+
+    def cancel(self):
+        with self._lock:
+            scheduled, self._scheduled = self._scheduled, {}
+            self._last_run.clear()
+        for timer in scheduled.values():
+            timer.cancel()
+
+
+odds_repricer = OddsRepricer()
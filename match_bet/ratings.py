@@ -0,0 +1,112 @@
+# Power ranking (PR) / ELO rating math shared by the scraper and the rating commands
+
+from django.utils import timezone
+
+from .instrumentation import phase
+from .models import PRHistory
+
+# constants
+ELO = 1500
+K = 16
+PR_SCALE = 18  # PR value mapped to a rating (and win weight) of 0
+
+
+def pr_win_weight(pr, scale=PR_SCALE):
+    # A team's weight in the win probabilities priced by pr_to_odds
+    return 1-(round((float(pr)/scale), 4))
+
+
+def pr_to_odds(team1, team2):
+    processed_pr1 = pr_win_weight(team1.current_pr)
+    processed_pr2 = pr_win_weight(team2.current_pr)
+    win_prob_1 = processed_pr1 / (processed_pr1 + processed_pr2)
+    odds_1 = round((1 / win_prob_1), 2)
+    win_prob_2 = processed_pr2 / (processed_pr1 + processed_pr2)
+    odds_2 = round((1 / win_prob_2), 2)
+    return odds_1, odds_2
+
+
+def check_winner(score1, score2):
+    if score1 > score2:
+        return True, False
+    elif score1 < score2:
+        return False, True
+
+
+def pr_to_elo(pr, scale=PR_SCALE, base=ELO):
+    return (1-(round((float(pr)/scale), 4))) * base
+
+
+def elo_to_pr(elo, scale=PR_SCALE, base=ELO):
+    return round((1 - (elo / base)) * scale, 4)
+
+
+def elo_update(pr1, pr2, team1_is_win, k=K, scale=PR_SCALE, base=ELO):
+    # New PRs of both teams after a match
+
+    elo1 = pr_to_elo(pr1, scale, base)
+    elo2 = pr_to_elo(pr2, scale, base)
+
+    expected_score1 = 1 / (1 + (10 ** ((elo2 - elo1) / 400)))
+    expected_score2 = 1 / (1 + (10 ** ((elo1 - elo2) / 400)))
+
+    if team1_is_win:
+        actual_score1 = 1
+        actual_score2 = 0
+    elif not team1_is_win:
+        actual_score1 = 0
+        actual_score2 = 1
+
+    elo1 += k * (actual_score1 - expected_score1)
+    elo2 += k * (actual_score2 - expected_score2)
+
+    return elo_to_pr(elo1, scale, base), elo_to_pr(elo2, scale, base)
+
+
+def adjust_team_pr(team1, team2, team1_is_win, match=None, commit=True, history=None):
+    # The teams' PRs before the match are archived as PRHistory rows dated with the
+    # match (or now, without one). With commit=False the teams are only updated in
+    # memory and the rows are appended to the history list, the caller is responsible
+    # for saving both (used by the bulk ingest path)
+    with phase('ratings'):
+        new_pr1, new_pr2 = elo_update(team1.current_pr, team2.current_pr, team1_is_win)
+        old_pr1, old_pr2 = team1.current_pr, team2.current_pr
+        changed_at = match.datetime if match is not None else timezone.now()
+        rows = [PRHistory(team=team1, match=match, datetime=changed_at, pr=old_pr1),
+                PRHistory(team=team2, match=match, datetime=changed_at, pr=old_pr2)]
+
+        team1.current_pr = new_pr1
+        team2.current_pr = new_pr2
+        if commit:
+            team1.save(update_fields=['current_pr'])
+            team2.save(update_fields=['current_pr'])
+            PRHistory.objects.bulk_create(rows)
+        else:
+            history.extend(rows)
+
+        # Refresh both teams' row and column of the cached odds matrix once this is committed
+        from .odds import invalidate_teams
+        invalidate_teams((team1, team2))
+
+    return old_pr1, old_pr2, new_pr1, new_pr2
+
+
+def replay_ratings(base_prs, fixtures):
+    # Replays matches in memory from the teams' base PRs, same math as adjust_team_pr.
+    # base_prs is indexed by team position, fixtures is an ordered list of
+    # (team1_index, team2_index, team1_is_win). Returns (prs, pr_histories, pr_deltas)
+    # where pr_deltas holds the (team1, team2) delta of each fixture
+    prs = list(base_prs)
+    pr_histories = [[] for _ in prs]
+    pr_deltas = []
+
+    for team1, team2, team1_is_win in fixtures:
+        old_pr1, old_pr2 = prs[team1], prs[team2]
+        new_pr1, new_pr2 = elo_update(old_pr1, old_pr2, team1_is_win)
+
+        pr_histories[team1].append(old_pr1)
+        pr_histories[team2].append(old_pr2)
+        prs[team1], prs[team2] = new_pr1, new_pr2
+        pr_deltas.append((round((new_pr1 - old_pr1), 4), round((new_pr2 - old_pr2), 4)))
+
+    return prs, pr_histories, pr_deltas
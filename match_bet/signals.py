@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .feed import broker, publish_matches, publish_teams
+from .models import DataVersion, Match, MatchTeamRelation, Team
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    # journal_mode is stored in the database file, the others last for the connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+@receiver([post_save, post_delete], sender=Team)
+@receiver([post_save, post_delete], sender=Match)
+@receiver([post_save, post_delete], sender=MatchTeamRelation)
+def bump_data_version(sender, **kwargs):
+    # Single-object writes (admin, shell); bulk paths bump the version themselves
+    DataVersion.bump()
+
+
+@receiver(post_save, sender=Team)
+def publish_team(sender, instance, **kwargs):
+    publish_teams([instance.id])
+
+
+@receiver(post_save, sender=Match)
+@receiver(post_save, sender=MatchTeamRelation)
+def publish_match(sender, instance, **kwargs):
+    publish_matches([instance.match_id if sender is MatchTeamRelation else instance.id])
+
+
+@receiver(post_delete, sender=Team)
+@receiver(post_delete, sender=Match)
+def publish_delete(sender, **kwargs):
+    # Feed clients drop deleted rows by re-reading the lists
+    if broker.has_subscribers:
+        transaction.on_commit(lambda: broker.publish('resync', {}))
@@ -0,0 +1,171 @@
+import datetime
+import gzip
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils.dateparse import parse_datetime
+
+from .models import DataVersion, Match, MatchTeamRelation, OddsHistory, PRHistory, Team, Tournament
+
+# Tournament snapshots: a tournament's teams, matches, match-team relations and PR/odds
+# history as gzipped NDJSON, one {"type": ..., ...} record per line. The first line is
+# the tournament, the other records follow in dependency order and reference each other
+# by their ids in the exporting database. Both directions work row by row in chunks, so
+# memory doesn't grow with the tournament (the import keeps the old -> new ids of the
+# teams and matches only). Users and bets are not part of a snapshot
+
+FORMAT_VERSION = 1
+CHUNK_SIZE = 2000
+# gzip's default (9) spends most of the export compressing for a few percent smaller files
+COMPRESS_LEVEL = 6
+
+TEAM_FIELDS = ('name', 'acronym', 'base_pr', 'current_pr', 'seed', 'origin')
+MATCH_FIELDS = ('datetime', 'stage', 'best_of', 'result', 'is_concluded', 'fingerprint', 'matchup', 'current_odds')
+RELATION_FIELDS = ('is_team1', 'is_winner', 'match_score', 'pr_delta')
+PR_HISTORY_FIELDS = ('datetime', 'pr')
+ODDS_HISTORY_FIELDS = ('datetime', 'odds1', 'odds2')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class SnapshotEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder cuts datetimes to milliseconds (ECMA-262), a snapshot keeps the
+    # microseconds the database stores
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def snapshot_querysets(tournament):
+    # (record type, rows) of the tournament in the order they are written and imported
+    return [
+        ('team', Team.objects.filter(tournament=tournament).values('id', *TEAM_FIELDS)),
+        ('match', Match.objects.filter(tournament=tournament).values('id', 'winner_id', *MATCH_FIELDS)),
+        ('relation', MatchTeamRelation.objects.filter(match__tournament=tournament)
+         .values('match_id', 'team_id', *RELATION_FIELDS)),
+        ('pr_history', PRHistory.objects.filter(team__tournament=tournament)
+         .values('team_id', 'match_id', *PR_HISTORY_FIELDS)),
+        ('odds_history', OddsHistory.objects.filter(match__tournament=tournament)
+         .values('match_id', *ODDS_HISTORY_FIELDS)),
+    ]
+
+
+def export_tournament(tournament, file):
+    # Writes the tournament's snapshot to a binary file object. Returns {record type: count}
+    encoder = SnapshotEncoder(separators=(',', ':'))
+    counts = {}
+    with gzip.open(file, 'wt', compresslevel=COMPRESS_LEVEL, encoding='utf-8') as out, transaction.atomic():
+        out.write(encoder.encode({'type': 'tournament', 'format': FORMAT_VERSION,
+                                  'slug': tournament.slug, 'name': tournament.name}) + '\n')
+        for kind, rows in snapshot_querysets(tournament):
+            count = 0
+            for row in rows.order_by('pk').iterator(chunk_size=CHUNK_SIZE):
+                row['type'] = kind
+                out.write(encoder.encode(row) + '\n')
+                count += 1
+            counts[kind] = count
+    return counts
+
+
+def import_tournament(file, slug=None, name=None):
+    # Reads a snapshot from a binary file object into a new tournament (the snapshot's
+    # slug and name unless given), with chunked bulk inserts in one transaction.
+    # Raises SnapshotError (and imports nothing) for an invalid snapshot or a taken slug.
+    # Returns (tournament, {record type: count})
+    team_ids = {}
+    match_ids = {}
+
+    def team(old_id):
+        try:
+            return team_ids[old_id]
+        except KeyError:
+            raise SnapshotError(f'Unknown team {old_id}')
+
+    def match(old_id):
+        try:
+            return match_ids[old_id]
+        except KeyError:
+            raise SnapshotError(f'Unknown match {old_id}')
+
+    def build_teams(records):
+        return [Team(tournament=tournament, **{field: record[field] for field in TEAM_FIELDS})
+                for record in records]
+
+    def build_matches(records):
+        return [Match(tournament=tournament, datetime=parse_datetime(record['datetime']),
+                      winner_id=None if record['winner_id'] is None else team(record['winner_id']),
+                      **{field: record[field] for field in MATCH_FIELDS if field != 'datetime'})
+                for record in records]
+
+    def build_relations(records):
+        return [MatchTeamRelation(match_id=match(record['match_id']), team_id=team(record['team_id']),
+                                  **{field: record[field] for field in RELATION_FIELDS})
+                for record in records]
+
+    def build_pr_history(records):
+        return [PRHistory(team_id=team(record['team_id']),
+                          match_id=None if record['match_id'] is None else match(record['match_id']),
+                          datetime=parse_datetime(record['datetime']), pr=record['pr'])
+                for record in records]
+
+    def build_odds_history(records):
+        return [OddsHistory(match_id=match(record['match_id']), datetime=parse_datetime(record['datetime']),
+                            odds1=record['odds1'], odds2=record['odds2'])
+                for record in records]
+
+    # record type -> (model, build, old -> new id map of the records it's referenced by)
+    kinds = {
+        'team': (Team, build_teams, team_ids),
+        'match': (Match, build_matches, match_ids),
+        'relation': (MatchTeamRelation, build_relations, None),
+        'pr_history': (PRHistory, build_pr_history, None),
+        'odds_history': (OddsHistory, build_odds_history, None),
+    }
+    counts = dict.fromkeys(kinds, 0)
+
+    def flush(kind, records):
+        model, build, ids = kinds[kind]
+        objects = model.objects.bulk_create(build(records))
+        if ids is not None:
+            ids.update((record['id'], obj.pk) for record, obj in zip(records, objects))
+        counts[kind] += len(records)
+
+    with gzip.open(file, 'rt', encoding='utf-8') as lines, transaction.atomic():
+        try:
+            header = json.loads(next(lines, 'null'))
+            if not isinstance(header, dict) or header.get('type') != 'tournament':
+                raise SnapshotError('Not a tournament snapshot')
+            if header.get('format') != FORMAT_VERSION:
+                raise SnapshotError(f"Unsupported snapshot format {header.get('format')}")
+
+            try:
+                tournament = Tournament.objects.create(slug=slug or header['slug'], name=name or header['name'])
+            except IntegrityError:
+                raise SnapshotError(f"A tournament with the slug {slug or header['slug']} already exists")
+
+            pending_kind = None
+            pending = []
+            for line_number, line in enumerate(lines, 2):
+                record = json.loads(line)
+                kind = record.pop('type', None)
+                if kind not in kinds:
+                    raise SnapshotError(f'Line {line_number}: unknown record type {kind}')
+                if kind != pending_kind or len(pending) >= CHUNK_SIZE:
+                    if pending:
+                        flush(pending_kind, pending)
+                    pending_kind, pending = kind, []
+                pending.append(record)
+            if pending:
+                flush(pending_kind, pending)
+        except (EOFError, KeyError, TypeError, ValueError) as e:
+            # Truncated file, missing fields, wrong types or invalid JSON. Files that
+            # aren't gzipped raise OSError, reported by the caller
+            raise SnapshotError(f'Invalid snapshot: {e!r}')
+
+        DataVersion.bump()
+
+    return tournament, counts
@@ -0,0 +1,148 @@
+import io
+import random
+import tempfile
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.db import connection, transaction
+
+# Synthetic leagues, schedule pages in the scraped site's format and throwaway databases,
+# for tests and benchmarks. Everything is generated from a seed, nothing is fetched
+
+SEPARATOR = '\u2060\u2060'
+SCORES = [(3, 0), (3, 1), (3, 2), (0, 3), (1, 3), (2, 3), (2, 0), (2, 1), (0, 2), (1, 2), (1, 0), (0, 1)]
+
+
+BATCH_SIZE = 500
+
+
+def synthetic_acronyms(count):
+    return [f'T{i}' for i in range(count)]
+
+
+def synthetic_teams(acronyms, seed=0):
+    # {acronym: create_teams fields} with random base PRs, seeds and origins
+    from .models import Team
+
+    rnd = random.Random(seed)
+    origins = [value for value, _ in Team.ORIGIN_CHOICES]
+    seeds = [value for value, _ in Team.SEEDING_CHOICES]
+    return {acronym: {'name': f'Team {acronym}', 'acronym': acronym, 'base_pr': round(rnd.uniform(1, 17), 2),
+                      'seed': rnd.choice(seeds), 'origin': rnd.choice(origins)}
+            for acronym in acronyms}
+
+
+def team_csv(teams):
+    # The teams as a create_teams CSV, padded and formatted like team_info.csv
+    lines = ['name,acronym,base_pr,origin,seed']
+    for team in teams.values():
+        lines.append(f" {team['name']} , {team['acronym']} , {team['base_pr']:.2f} , "
+                     f"{team['origin'].upper()} , {team['seed']:.2f} ")
+    return '\n'.join(lines) + '\n'
+
+
+def create_synthetic_league(tournament, teams=64, matches=1000, users=100, bets=2000, seed=0):
+    # Fills the tournament with teams, matches ingested through the scraper's own
+    # ingest (so PRs, PR history and odds are consistent) and users with open bets on
+    # the upcoming matches, exposure totals included. Returns the teams' acronyms
+    from .management.commands.scrape_matches import ingest_fixtures
+    from .models import Bet, Exposure, MatchTeamRelation, Team, User
+
+    rnd = random.Random(seed)
+    acronyms = synthetic_acronyms(teams)
+    with transaction.atomic():
+        Team.objects.bulk_create(
+            [Team(tournament=tournament, current_pr=fields['base_pr'], **fields)
+             for fields in synthetic_teams(acronyms, seed=seed).values()],
+            batch_size=BATCH_SIZE)
+
+        # ingest prints every new match
+        with redirect_stdout(io.StringIO()):
+            ingest_fixtures(synthetic_fixtures(acronyms, matches, seed=seed), tournament=tournament)
+
+        user_objects = User.objects.bulk_create(
+            [User(name=f'User {i}', balance=1000.0) for i in range(users)], batch_size=BATCH_SIZE)
+
+        # (match id, team id, odds) of both sides of the upcoming matches
+        sides = [(relation.match_id, relation.team_id, relation.match.current_odds[0 if relation.is_team1 else 1])
+                 for relation in MatchTeamRelation.objects.filter(
+                     match__tournament=tournament, match__is_concluded=False).select_related('match')
+                 if relation.match.current_odds]
+        bet_objects = []
+        exposure = {}  # (match id, team id) -> [stake, payout, count]
+        if sides and user_objects:
+            for _ in range(bets):
+                user = rnd.choice(user_objects)
+                match_id, team_id, odds = rnd.choice(sides)
+                stake = float(rnd.randint(1, 20))
+                user.balance -= stake
+                bet_objects.append(Bet(user=user, match_id=match_id, team_id=team_id, odds=odds, stake=stake))
+                totals = exposure.setdefault((match_id, team_id), [0, 0, 0])
+                totals[0] += stake
+                totals[1] += stake * odds
+                totals[2] += 1
+        Bet.objects.bulk_create(bet_objects, batch_size=BATCH_SIZE)
+        User.objects.bulk_update(user_objects, ['balance'], batch_size=BATCH_SIZE)
+        Exposure.objects.bulk_create(
+            [Exposure(match_id=match_id, team_id=team_id, total_stake=stake, total_payout=payout, bet_count=count)
+             for (match_id, team_id), (stake, payout, count) in exposure.items()],
+            batch_size=BATCH_SIZE)
+    return acronyms
+
+
+def format_site_date(date_time):
+    # Same shape as the site's date cells, e.g. '19 November 2023 08:00:00 +0000'
+    return date_time.strftime('%d %B %Y %H:%M:%S +0000').lstrip('0')
+
+
+def synthetic_fixtures(acronyms, count, seed=0, concluded_ratio=0.6, start=datetime(2023, 10, 10, 8)):
+    # Scraped sets (as lists of cell texts) between random pairs of teams, one hour apart
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(count):
+        team1, team2 = rnd.sample(acronyms, 2)
+        date_str = format_site_date(start + timedelta(hours=i))
+        if rnd.random() < concluded_ratio:
+            score1, score2 = rnd.choice(SCORES)
+            rows.append([f'{team1}{SEPARATOR}', str(score1), str(score2), date_str, f'{SEPARATOR}{team2}'])
+        else:
+            rows.append([f'{team1}{SEPARATOR}', date_str, f'{SEPARATOR}{team2}'])
+    return rows
+
+
+def schedule_page(rows, header_rows=0, filler_paragraphs=0):
+    # HTML page with the sets as 'tr.ml-row' rows of one match list table. header_rows
+    # plain rows are put before them (the default selector skips the first 7 rows) and
+    # filler_paragraphs blocks of unrelated wiki content around the table
+    filler = ''.join(
+        f'<div class="navbox"><p>Filler paragraph {i} with <a href="/wiki/{i}">links</a> '
+        f'and <b>markup</b> around the match list.</p></div>'
+        for i in range(filler_paragraphs))
+    headers = ''.join(f'<tr><th colspan="5">Header {i}</th></tr>' for i in range(header_rows))
+    cells = ''.join(
+        '<tr class="ml-row">' + ''.join(f'<td>{cell}</td>' for cell in row) + '</tr>'
+        for row in rows)
+    return (f'<html><body>{filler}<table class="wikitable matchlist">{headers}{cells}</table>'
+            f'{filler}</body></html>')
+
+
+@contextmanager
+def throwaway_database():
+    # Points the default connection at a new SQLite file migrated like the real
+    # database, removed on exit. Yields the pragma-configured journal mode
+    # create_test_db returns the test database's name, so the real one is kept here
+    old_name, old_test_settings = connection.settings_dict['NAME'], connection.settings_dict['TEST']
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        connection.settings_dict['TEST'] = {**old_test_settings,
+                                            'NAME': str(Path(tmp_dir) / 'benchmark.sqlite3')}
+        try:
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    yield cursor.fetchone()[0]
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            connection.settings_dict['TEST'] = old_test_settings
@@ -1,3 +1,1587 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import http.server
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User as AdminUser
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Count
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import feed, jobs, watch
+from .adapters import ADAPTERS, ScheduleAdapter, get_adapter, register
+from .betting import BetRejected, match_exposure, place_bet, settle_matches
+from .http_cache import FetchCache
+from .instrumentation import NO_PHASE, phase, recording
+from .management.commands import scrape_matches
+from .management.commands.benchmark_bets import check_balances, create_bet_fixtures, run_bet_stress
+from .management.commands.benchmark_suite import CASES as BENCHMARK_CASES, compare, run_suite
+from .management.commands.verify_exposure import compare_exposure
+from .models import (Bet, DataVersion, Exposure, Match, MatchTeamRelation, OddsHistory, PRHistory, Team, Tournament,
+                     User)
+from .odds import OddsMatrix, OddsRepricer, odds_matrix, odds_repricer, priced_odds
+from .ratings import elo_update, pr_to_odds
+from .snapshots import (MATCH_FIELDS as MATCH_SNAPSHOT_FIELDS, TEAM_FIELDS as TEAM_SNAPSHOT_FIELDS, export_tournament,
+                        import_tournament)
+from .synthetic import (SEPARATOR as SEP, create_synthetic_league, format_site_date, schedule_page, synthetic_fixtures,
+                        synthetic_teams, team_csv)
+
+
+def create_test_teams(acronyms, prs=None, tournament=None, name_format='{}'):
+    # Teams of the tournament (the default one if not given) with the acronyms, or T0, T1...
+    # when given a count, named name_format.format(acronym). Base and current PR are prs,
+    # 2, 3, 4... if not given. Returns the acronyms
+    if isinstance(acronyms, int):
+        acronyms = [f'T{i}' for i in range(acronyms)]
+    if prs is None:
+        prs = [2 + i for i in range(len(acronyms))]
+    if tournament is None:
+        tournament = Tournament.objects.default()
+    for acronym, pr in zip(acronyms, prs):
+        Team.objects.create(tournament=tournament, name=name_format.format(acronym), acronym=acronym, base_pr=pr,
+                            current_pr=pr, seed=1, origin='lck')
+    return acronyms
+
+
+class FixturePageHandler(http.server.BaseHTTPRequestHandler):
+    pages = {}
+    delay = 0
+    # When true pages carry an ETag (hash of the body) and a Last-Modified, and a
+    # matching If-None-Match gets a 304
+    validators = False
+    last_modified = 'Tue, 10 Oct 2023 08:00:00 GMT'
+    # (path, request headers, response status) of every request
+    requests = []
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = self.pages.get(self.path)
+        if body is None:
+            self.respond(404)
+            return
+        if not self.validators:
+            self.respond(200, body)
+            return
+        etag = f'"{hashlib.sha1(body.encode()).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.respond(304)
+            return
+        self.respond(200, body, {'ETag': etag, 'Last-Modified': self.last_modified})
+
+    def respond(self, status, body=None, headers=None):
+        self.requests.append((self.path, dict(self.headers), status))
+        self.send_response(status)
+        if body is not None:
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class MultiSourceScrapeTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        FixturePageHandler.pages = {
+            '/groups': schedule_page([
+                [f'T1{SEP}', '10 October 2023 08:00:00 +0000', f'{SEP}GEN'],
+                [f'JDG{SEP}', '3', '1', '10 October 2023 09:00:00 +0000', f'{SEP}BLG'],
+            ]),
+            '/knockouts': schedule_page([
+                [f'T1{SEP}', '3', '0', '11 October 2023 08:00:00 +0000', f'{SEP}JDG'],
+            ]),
+            '/finals': schedule_page([
+                [f'GEN{SEP}', '12 October 2023 08:00:00 +0000', f'{SEP}BLG'],
+            ]),
+        }
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FixturePageHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        create_test_teams(['T1', 'GEN', 'JDG', 'BLG'], [5.1, 4.5, 3.2, 6.0])
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        for name, value in [('json_file_path', os.path.join(tmp_dir, 'scrape_data.json')),
+                            ('fetch_cache', FetchCache(os.path.join(tmp_dir, 'cache.json')))]:
+            patcher = mock.patch.object(scrape_matches, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.sources = [(f'{self.base_url}{path}', 'tr.ml-row td', get_adapter())
+                        for path in ['/groups', '/knockouts', '/finals']]
+
+    def run_scrape(self, **kwargs):
+        with redirect_stdout(io.StringIO()):
+            return scrape_matches.run_scrape(sources=self.sources, **kwargs)
+
+    def test_sources_are_merged_into_one_ingest(self):
+        new_count, update_count, unchanged_count, skipped_count, unknown_count = self.run_scrape()
+
+        self.assertEqual(new_count, 4)
+        self.assertEqual(Match.objects.count(), 4)
+        self.assertEqual(Match.objects.filter(is_concluded=True).count(), 2)
+        self.assertEqual(list(PRHistory.objects.filter(team__acronym='T1').values_list('pr', flat=True)), [5.1])
+
+    def test_streaming_pipeline_matches_default_pipeline(self):
+        with mock.patch.object(scrape_matches, 'stream_batch_size', 1):
+            self.assertEqual(self.run_scrape(stream=True), (4, 0, 0, 0, 0))
+
+        streamed = list(Match.objects.values_list('datetime', 'result', 'is_concluded', 'current_odds'))
+        streamed_teams = list(Team.objects.values_list('acronym', 'current_pr'))
+        Match.objects.all().delete()
+        PRHistory.objects.all().delete()
+        for team in Team.objects.all():
+            team.current_pr = team.base_pr
+            team.save()
+
+        self.run_scrape(force=True)
+        self.assertEqual(
+            list(Match.objects.values_list('datetime', 'result', 'is_concluded', 'current_odds')), streamed)
+        self.assertEqual(list(Team.objects.values_list('acronym', 'current_pr')), streamed_teams)
+
+    def test_sets_with_unknown_teams_are_skipped(self):
+        page = schedule_page([
+            [f'GEN{SEP}', '12 October 2023 08:00:00 +0000', f'{SEP}BLG'],
+            [f'T1{SEP}', '13 October 2023 08:00:00 +0000', f'{SEP}FNC'],
+            [f'JDG{SEP}', '14 October 2023 08:00:00 +0000', f'{SEP}T1'],
+        ])
+        stdout = io.StringIO()
+        with mock.patch.dict(FixturePageHandler.pages, {'/finals': page}), redirect_stdout(stdout):
+            counts = scrape_matches.run_scrape(sources=self.sources)
+
+        self.assertEqual(counts, (5, 0, 0, 0, 1))
+        self.assertEqual(Match.objects.count(), 5)
+        self.assertFalse(Match.objects.filter(matchup__contains='FNC').exists())
+        self.assertIn('no team of the tournament has the acronym FNC', stdout.getvalue())
+
+    def test_unchanged_sources_skip_ingest(self):
+        self.run_scrape()
+        self.assertIsNone(self.run_scrape())
+        self.assertEqual(self.run_scrape(force=True), (0, 0, 2, 2, 0))
+
+    def use_validators(self):
+        for name, value in [('validators', True), ('requests', [])]:
+            patcher = mock.patch.object(FixturePageHandler, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_unchanged_pages_get_304_without_ingest(self):
+        self.use_validators()
+        self.assertEqual(self.run_scrape(), (4, 0, 0, 0, 0))
+        self.assertTrue(all('If-None-Match' not in headers for _, headers, _ in FixturePageHandler.requests))
+
+        FixturePageHandler.requests.clear()
+        with mock.patch.object(scrape_matches, 'ingest_decoded_fixtures') as ingest:
+            self.assertIsNone(self.run_scrape())
+        ingest.assert_not_called()
+
+        self.assertEqual(len(FixturePageHandler.requests), 3)
+        for _, headers, status in FixturePageHandler.requests:
+            self.assertEqual(status, 304)
+            self.assertTrue(headers['If-None-Match'].startswith('"'))
+            self.assertEqual(headers['If-Modified-Since'], FixturePageHandler.last_modified)
+
+    def test_failed_ingest_keeps_the_cache_entry(self):
+        self.use_validators()
+        self.run_scrape()
+        url = f'{self.base_url}/finals'
+        entry = scrape_matches.fetch_cache._load()[url]
+        self.assertEqual(entry['last_modified'], FixturePageHandler.last_modified)
+
+        changed_page = schedule_page([[f'GEN{SEP}', '3', '0', '12 October 2023 08:00:00 +0000', f'{SEP}BLG']])
+        with mock.patch.dict(FixturePageHandler.pages, {'/finals': changed_page}):
+            with mock.patch.object(scrape_matches, 'ingest_decoded_fixtures', side_effect=RuntimeError), \
+                    self.assertRaises(RuntimeError):
+                self.run_scrape()
+            self.assertEqual(scrape_matches.fetch_cache._load()[url], entry)
+            self.assertFalse(Match.objects.filter(is_concluded=True, matchup='GEN vs BLG').exists())
+
+            # The next run sends the old validators, gets the new page and ingests it (the
+            # other pages are 304s)
+            FixturePageHandler.requests.clear()
+            self.assertEqual(self.run_scrape(), (0, 1, 0, 0, 0))
+            self.assertTrue(Match.objects.filter(is_concluded=True, matchup='GEN vs BLG').exists())
+            finals, = [(headers, status) for path, headers, status in FixturePageHandler.requests
+                       if path == '/finals']
+            self.assertEqual((finals[0]['If-None-Match'], finals[1]), (entry['etag'], 200))
+            self.assertNotEqual(scrape_matches.fetch_cache._load()[url], entry)
+
+    def test_pages_are_fetched_concurrently(self):
+        FixturePageHandler.delay = 0.3
+        self.addCleanup(setattr, FixturePageHandler, 'delay', 0)
+
+        started = time.monotonic()
+        self.run_scrape()
+
+        # Sequential fetching would take at least 3 * delay
+        self.assertLess(time.monotonic() - started, 0.8)
+
+    def test_sources_choose_their_adapter(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        sources_path = os.path.join(tmp_dir, 'sources.json')
+        with open(sources_path, 'w') as sources_file:
+            json.dump([{'url': self.sources[0][0]},
+                       {'url': self.sources[1][0], 'selector': 'tr.ml-row td',
+                        'adapter': 'match_bet.adapters.LeaguepediaAdapter'}], sources_file)
+
+        leaguepedia = get_adapter('leaguepedia')
+        self.assertEqual(scrape_matches.load_sources(sources_path), [
+            (self.sources[0][0], leaguepedia.selector, leaguepedia),
+            (self.sources[1][0], 'tr.ml-row td', get_adapter('match_bet.adapters.LeaguepediaAdapter')),
+        ])
+
+        with open(sources_path, 'w') as sources_file:
+            json.dump([{'url': self.sources[0][0], 'adapter': 'unknown-site'}], sources_file)
+        with self.assertRaisesMessage(CommandError, 'Unknown schedule adapter unknown-site'):
+            call_command('scrape_matches', '--sources', sources_path, stdout=io.StringIO())
+
+    def test_scrape_data_of_older_versions_is_read(self):
+        cells = [cell for row in synthetic_fixtures(['T1', 'GEN'], 4) for cell in row]
+        self.assertEqual(scrape_matches.read_scraped_fixtures({'data': cells}),
+                         scrape_matches.read_scraped_fixtures({'sources': [{'adapter': 'leaguepedia', 'data': cells}]}))
+
+    def test_watch_polls_until_stopped(self):
+        lines = []
+
+        def report(line):
+            lines.append(line)
+            if len(lines) == 2:
+                watcher.stop()
+
+        watcher = watch.Watcher(self.sources, Tournament.objects.default(), fast=0.01, slow=0.01, report=report)
+        with redirect_stdout(io.StringIO()):
+            watcher.run()
+
+        self.assertEqual(watcher.iterations, 2)
+        self.assertTrue(lines[0].startswith('Poll 1: new 4, updated 0, unchanged 0, skipped 0, unknown teams 0 in '))
+        self.assertTrue(lines[1].startswith('Poll 2: unchanged in '))
+        self.assertIn('0 live matches', lines[1])
+
+    def test_watch_retries_failed_polls(self):
+        lines = []
+        watcher = watch.Watcher(self.sources, Tournament.objects.default(), fast=0.01, slow=0.01, report=lines.append)
+        with mock.patch.object(watch, 'run_scrape', side_effect=[RuntimeError('site down'), None]):
+            watcher.run(max_iterations=2)
+
+        self.assertTrue(lines[0].startswith('Poll 1 failed, retrying in 0s'))
+        self.assertIn("RuntimeError('site down')", lines[0])
+        self.assertTrue(lines[1].startswith('Poll 2: unchanged'))
+        self.assertEqual(watcher.failures, 0)
+
+    def test_profile_records_each_phase(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        sources_path = os.path.join(tmp_dir, 'sources.json')
+        with open(sources_path, 'w') as sources_file:
+            json.dump([{'url': url, 'selector': selector, 'adapter': adapter.name}
+                       for url, selector, adapter in self.sources], sources_file)
+        metrics_path = os.path.join(tmp_dir, 'metrics.jsonl')
+        profile_path = os.path.join(tmp_dir, 'scrape_matches.prof')
+
+        stdout = io.StringIO()
+        with override_settings(INSTRUMENTATION_PATH=metrics_path), \
+                mock.patch.object(scrape_matches, 'profile_file_path', profile_path), \
+                redirect_stdout(io.StringIO()):
+            call_command('scrape_matches', '--sources', sources_path, '--profile', stdout=stdout)
+
+        with open(metrics_path) as metrics_file:
+            runs = [json.loads(line) for line in metrics_file]
+        self.assertEqual([run['run'] for run in runs], ['scrape_matches'])
+        phases = runs[0]['phases']
+        self.assertEqual(set(phases),
+                         {'total', 'fetch', 'parse', 'json_write', 'json_read', 'decode', 'ingest', 'ratings'})
+        # Two concluded sets, each adjusting PRs once without a query of its own
+        self.assertEqual((phases['ratings']['calls'], phases['ratings']['queries']), (2, 0))
+        self.assertGreater(phases['ingest']['queries'], 0)
+        self.assertGreaterEqual(phases['total']['queries'], phases['ingest']['queries'])
+        self.assertGreaterEqual(phases['total']['seconds'], phases['fetch']['seconds'])
+
+        self.assertTrue(os.path.exists(profile_path))
+        self.assertIn('cumulative', stdout.getvalue())
+        self.assertIn('json_read', stdout.getvalue())
+
+
+class IngestTests(TestCase):
+    PAGE = [
+        [f'T1{SEP}', '3', '1', '10 October 2023 08:00:00 +0000', f'{SEP}GEN'],  # Concluded
+        [f'JDG{SEP}', '1', '0', '10 October 2023 09:00:00 +0000', f'{SEP}BLG'],  # Partial
+        [f'BLG{SEP}', '0', '3', '10 October 2023 10:00:00 +0000', f'{SEP}T1'],  # Concluded
+        [f'GEN{SEP}', '10 October 2023 11:00:00 +0000', f'{SEP}JDG'],  # Upcoming
+    ]
+
+    def setUp(self):
+        create_test_teams(['T1', 'GEN', 'JDG', 'BLG'], [5.0, 4.0, 3.0, 6.0])
+
+    def ingest(self, page):
+        with redirect_stdout(io.StringIO()):
+            return scrape_matches.ingest_fixtures(page)
+
+    def deltas(self, matchup):
+        return list(MatchTeamRelation.objects.filter(match__matchup=matchup)
+                    .order_by('-is_team1').values_list('pr_delta', flat=True))
+
+    def test_ingest_and_reingest(self):
+        self.assertEqual(self.ingest(self.PAGE), (4, 0, 0, 0, 0))
+
+        matches = {match.matchup: match for match in Match.objects.order_by('datetime')}
+        self.assertEqual([matchup for matchup, match in matches.items() if match.is_concluded],
+                         ['T1 vs GEN', 'BLG vs T1'])
+        self.assertEqual((matches['JDG vs BLG'].result, matches['JDG vs BLG'].winner), ('1 - 0', None))
+        self.assertEqual(matches['T1 vs GEN'].winner.acronym, 'T1')
+        self.assertIsNone(matches['GEN vs JDG'].result)
+
+        # Ratings are adjusted in page order, T1's second match starts from its first result
+        t1_after_gen, gen_after_t1 = elo_update(5.0, 4.0, True)
+        blg_after_t1, t1_after_blg = elo_update(6.0, t1_after_gen, False)
+        self.assertEqual(list(PRHistory.objects.filter(team__acronym='T1').order_by('datetime', 'id')
+                              .values_list('match__matchup', 'pr')),
+                         [('T1 vs GEN', 5.0), ('BLG vs T1', t1_after_gen)])
+        self.assertEqual(Team.objects.get(acronym='T1').current_pr, t1_after_blg)
+        self.assertEqual(self.deltas('T1 vs GEN'), [round(t1_after_gen - 5.0, 4), round(gen_after_t1 - 4.0, 4)])
+        self.assertEqual(self.deltas('BLG vs T1'),
+                         [round(blg_after_t1 - 6.0, 4), round(t1_after_blg - t1_after_gen, 4)])
+        self.assertEqual(self.deltas('JDG vs BLG'), [None, None])
+
+        # One changed score: the partial match is updated, the upcoming one is skipped by
+        # its fingerprint and the concluded ones are left as they are
+        fingerprints = dict(Match.objects.values_list('matchup', 'fingerprint'))
+        page = [list(cells) for cells in self.PAGE]
+        page[1][1] = '2'
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.ingest(page), (0, 1, 2, 1, 0))
+
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "match_bet_match"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Match.objects.get(matchup='JDG vs BLG').result, '2 - 0')
+        self.assertFalse(Match.objects.get(matchup='JDG vs BLG').is_concluded)
+        changed = [matchup for matchup, fingerprint in Match.objects.values_list('matchup', 'fingerprint')
+                   if fingerprint != fingerprints[matchup]]
+        self.assertEqual(changed, ['JDG vs BLG'])
+        self.assertEqual(PRHistory.objects.count(), 4)
+
+
+class RatingHistoryMixin:
+    def setUp(self):
+        acronyms = create_test_teams(8)
+        with redirect_stdout(io.StringIO()):
+            scrape_matches.ingest_fixtures(synthetic_fixtures(acronyms, 60, concluded_ratio=0.9))
+
+
+class RecomputeRatingsTests(RatingHistoryMixin, TestCase):
+    def snapshot(self):
+        return (list(Team.objects.order_by('id').values_list('current_pr', flat=True)),
+                list(PRHistory.objects.order_by('team_id', 'datetime').values_list('team_id', 'match_id', 'datetime', 'pr')),
+                list(MatchTeamRelation.objects.order_by('id').values_list('pr_delta', flat=True)))
+
+    def test_replay_matches_incremental_ingest(self):
+        ingested = self.snapshot()
+        self.assertTrue(any(ingested[1]))
+
+        Team.objects.update(current_pr=9)
+        PRHistory.objects.all().delete()
+        MatchTeamRelation.objects.update(pr_delta=None)
+        call_command('recompute_ratings', stdout=io.StringIO())
+
+        self.assertEqual(self.snapshot(), ingested)
+
+    def test_dry_run_does_not_write(self):
+        Team.objects.update(current_pr=9)
+        out = io.StringIO()
+        call_command('recompute_ratings', '--dry-run', stdout=out)
+
+        self.assertIn('Would update 8 teams', out.getvalue())
+        self.assertEqual(set(Team.objects.values_list('current_pr', flat=True)), {9})
+
+
+class RatingHistoryTests(RatingHistoryMixin, TestCase):
+    def test_pr_as_of_and_between(self):
+        team = Team.objects.annotate(changes=Count('pr_changes')).filter(changes__gte=3).first()
+        changes = list(team.pr_changes.order_by('datetime').values_list('datetime', 'pr'))
+        (first_at, base_pr), (second_at, second_pr), (third_at, third_pr) = changes[:3]
+
+        self.assertEqual(base_pr, team.base_pr)
+        with self.assertNumQueries(1):
+            self.assertEqual(team.pr_as_of(first_at - timedelta(hours=1)), base_pr)
+        self.assertEqual(team.pr_as_of(first_at), second_pr)
+        self.assertEqual(team.pr_as_of(changes[-1][0] + timedelta(hours=1)), team.current_pr)
+
+        self.assertEqual(team.pr_changes_between(first_at, second_at),
+                         [(first_at, base_pr, second_pr), (second_at, second_pr, third_pr)])
+        self.assertEqual(team.pr_changes_between(changes[-1][0], changes[-1][0])[0][2], team.current_pr)
+
+    def test_history_is_appended_not_rewritten(self):
+        count = PRHistory.objects.count()
+        with CaptureQueriesContext(connection) as queries:
+            self.ingest_more()
+        self.assertEqual(PRHistory.objects.count(), count + 2)
+        self.assertFalse([query for query in queries if 'match_bet_prhistory' in query['sql']
+                          and not query['sql'].startswith('INSERT')])
+
+    def ingest_more(self):
+        last = Match.objects.order_by('-datetime').first()
+        team1, team2 = Team.objects.all()[:2]
+        site_date = format_site_date(last.datetime - timedelta(hours=8) + timedelta(days=1))
+        with redirect_stdout(io.StringIO()):
+            scrape_matches.ingest_fixtures([[f'{team1.acronym}{SEP}', '3', '1', site_date, f'{SEP}{team2.acronym}']])
+
+
+class CalibrateRatingsTests(RatingHistoryMixin, TestCase):
+    def test_current_constants_are_ranked(self):
+        out = io.StringIO()
+        call_command('calibrate_ratings', '--k', '8:16:8', '--scale', '18', '--workers', '1', stdout=out)
+
+        self.assertIn('Backtested 2 parameter sets', out.getvalue())
+        self.assertIn('Current constants:', out.getvalue())
+
+
+class OddsMatrixTests(TestCase):
+    def setUp(self):
+        self.acronyms = create_test_teams(10, [1.5 + i * 1.3 for i in range(10)])
+
+    def assertMatrixMatchesTeams(self, matrix):
+        teams = list(Team.objects.all())
+        with self.assertNumQueries(0):
+            for team1 in teams:
+                for team2 in teams:
+                    self.assertEqual(matrix.odds(team1.id, team2.id), pr_to_odds(team1, team2))
+
+    def test_matrix_matches_pr_to_odds(self):
+        matrix = OddsMatrix()
+        matrix.rebuild()
+        self.assertMatrixMatchesTeams(matrix)
+
+    def test_pr_changes_update_rows_on_commit(self):
+        matrix = OddsMatrix()
+        matrix.rebuild()
+
+        with mock.patch('match_bet.odds.odds_matrix', matrix), \
+                mock.patch.object(matrix, 'rebuild', wraps=matrix.rebuild) as rebuild, \
+                self.captureOnCommitCallbacks(execute=True), redirect_stdout(io.StringIO()):
+            scrape_matches.ingest_fixtures(synthetic_fixtures(self.acronyms, 20, concluded_ratio=1))
+
+        rebuild.assert_not_called()
+        self.assertMatrixMatchesTeams(matrix)
+
+
+class TournamentTests(TestCase):
+    def setUp(self):
+        self.tournaments = [Tournament.objects.create(name=slug, slug=slug) for slug in ('msi-2023', 'worlds-2023')]
+        for tournament in self.tournaments:
+            self.acronyms = create_test_teams(6, tournament=tournament)
+        # Rolled back tests reuse team ids
+        odds_matrix.invalidate()
+
+    def ingest(self, tournament, fixtures):
+        with redirect_stdout(io.StringIO()):
+            return scrape_matches.ingest_fixtures(fixtures, tournament=tournament)
+
+    def test_events_with_the_same_schedule_do_not_collide(self):
+        fixtures = synthetic_fixtures(self.acronyms, 20, concluded_ratio=1)
+        for tournament in self.tournaments:
+            self.assertEqual(self.ingest(tournament, fixtures)[0], 20)
+
+        for tournament in self.tournaments:
+            self.assertEqual(tournament.matches.count(), 20)
+            self.assertFalse(MatchTeamRelation.objects.filter(match__tournament=tournament)
+                             .exclude(team__tournament=tournament).exists())
+        # Same results from the same base PRs
+        msi, worlds = ([list(tournament.teams.order_by('acronym').values_list('current_pr', flat=True))
+                        for tournament in self.tournaments])
+        self.assertEqual(msi, worlds)
+
+    def test_matches_are_identified_by_datetime_and_team_pair(self):
+        date_str = format_site_date(datetime(2023, 10, 10, 8))
+        fixtures = [[f'T0{SEP}', date_str, f'{SEP}T1'], [f'T2{SEP}', date_str, f'{SEP}T3']]
+        self.assertEqual(self.ingest(self.tournaments[0], fixtures)[0], 2)
+
+        fixtures[1] = [f'T2{SEP}', '1', '0', date_str, f'{SEP}T3']
+        self.assertEqual(self.ingest(self.tournaments[0], fixtures)[:2], (0, 1))
+
+        match = Match.objects.get(matchup='T2 vs T3')
+        self.assertEqual(match.natural_key()[0], 'msi-2023')
+        self.assertEqual(Match.objects.get_by_natural_key(*match.natural_key()), match)
+
+    def test_api_and_odds_are_scoped_by_tournament(self):
+        self.ingest(self.tournaments[0], synthetic_fixtures(self.acronyms, 5))
+        url = reverse('match_bet:api_matches')
+
+        self.assertEqual(len(self.client.get(url, {'tournament': 'msi-2023'}).json()['results']), 5)
+        self.assertEqual(self.client.get(url).json()['results'], [])
+        self.assertEqual(self.client.get(url, {'tournament': 'lpl-2023'}).status_code, 404)
+
+        msi_team, worlds_team = (tournament.teams.get(acronym='T0') for tournament in self.tournaments)
+        other = self.tournaments[1].teams.get(acronym='T1')
+        odds_url = reverse('match_bet:api_odds')
+        self.assertEqual(self.client.get(odds_url, {'team1': worlds_team.id, 'team2': other.id}).status_code, 200)
+        self.assertEqual(self.client.get(odds_url, {'team1': msi_team.id, 'team2': other.id}).status_code, 400)
+
+    def test_acronyms_are_unique_per_tournament(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Team.objects.create(tournament=self.tournaments[0], name='Copy', acronym='T0', base_pr=2,
+                                current_pr=2, seed=1, origin='lck')
+
+
+class TeamAcronymMigrationTests(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('match_bet', target)])
+        return executor.loader.project_state(('match_bet', target)).apps
+
+    def test_duplicates_fail_the_migration(self):
+        old_apps = self.migrate('0014_user_api_token')
+        try:
+            Tournament = old_apps.get_model('match_bet', 'Tournament')
+            Team = old_apps.get_model('match_bet', 'Team')
+            tournament = Tournament.objects.create(name='MSI', slug='msi-2023')
+            teams = [Team.objects.create(tournament=tournament, name=name, acronym='T1', base_pr=2, current_pr=2,
+                                         seed=1, origin='lck') for name in ('T1', 'SKT')]
+
+            with self.assertRaisesMessage(RuntimeError, f'acronym T1: teams {teams[0].id}, {teams[1].id}'):
+                self.migrate('0015_team_tournament_acronym_unique')
+
+            teams[1].acronym = 'SKT'
+            teams[1].save()
+        finally:
+            self.migrate('0015_team_tournament_acronym_unique')
+
+
+class AdminQueryBudgetTests(TestCase):
+    # Number of queries each admin page may run, independent of the number of rows
+    MATCH_CHANGELIST_BUDGET = 6
+    MATCH_CHANGE_BUDGET = 9
+    TEAM_CHANGE_BUDGET = 8
+
+    def setUp(self):
+        self.acronyms = create_test_teams(12, name_format='Team {}')
+        self.client.force_login(AdminUser.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    def ingest(self, count, seed=0):
+        with redirect_stdout(io.StringIO()):
+            scrape_matches.ingest_fixtures(synthetic_fixtures(
+                self.acronyms, count, seed=seed, start=datetime(2023, 10, 10 + seed, 8)))
+
+    def count_queries(self, url):
+        self.client.get(url)  # Warm up per-process caches (content types, ...)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_matchup_label_is_denormalized(self):
+        self.ingest(1)
+        match = Match.objects.get()
+        team1 = match.matchteamrelation_set.get(is_team1=True).team
+        team2 = match.matchteamrelation_set.get(is_team1=False).team
+        self.assertEqual(match.matchup, f'{team1.name} vs {team2.name}')
+
+        with self.assertNumQueries(0):
+            self.assertTrue(str(match).endswith(f'| {team1.name} vs {team2.name}'))
+
+    def test_match_changelist_budget(self):
+        url = reverse('admin:match_bet_match_changelist')
+        self.ingest(20)
+        small = self.count_queries(url)
+        self.ingest(80, seed=1)
+        self.assertEqual(self.count_queries(url), small)
+        self.assertLessEqual(small, self.MATCH_CHANGELIST_BUDGET)
+
+    def test_match_change_page_budget(self):
+        self.ingest(50)
+        url = reverse('admin:match_bet_match_change', args=[Match.objects.first().id])
+        self.assertLessEqual(self.count_queries(url), self.MATCH_CHANGE_BUDGET)
+
+    def test_team_change_page_budget(self):
+        team = Team.objects.get(acronym='T0')
+        url = reverse('admin:match_bet_team_change', args=[team.id])
+        self.ingest(20)
+        small = self.count_queries(url)
+        self.ingest(80, seed=1)
+        self.assertEqual(self.count_queries(url), small)
+        self.assertLessEqual(small, self.TEAM_CHANGE_BUDGET)
+
+    def test_team_rename_refreshes_matchups(self):
+        self.ingest(10)
+        team = Team.objects.get(acronym='T0')
+        data = {'tournament': team.tournament_id, 'name': 'Renamed', 'acronym': 'T0', 'base_pr': team.base_pr, 'current_pr': team.current_pr,
+                'seed': 1, 'origin': 'lck',
+                'matchteamrelation_set-TOTAL_FORMS': 0, 'matchteamrelation_set-INITIAL_FORMS': 0}
+        response = self.client.post(reverse('admin:match_bet_team_change', args=[team.id]), data)
+        self.assertEqual(response.status_code, 302)
+
+        for match in team.matches.all():
+            self.assertIn('Renamed', match.matchup)
+
+
+class UpdateMatchCountTests(TestCase):
+    def setUp(self):
+        self.acronyms = create_test_teams(6)
+        self.client.force_login(AdminUser.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    def ingest_bo3_results(self, count):
+        # 2-0 / 2-1 results are not concluded under the default BO5
+        rows = [[f'{team1}{SEP}', '2', str(i % 2), f'{10 + i // 24} October 2023 {i % 24:02d}:00:00 +0000',
+                 f'{SEP}{team2}'] for i, (team1, team2) in enumerate(
+                    (self.acronyms[i % 6], self.acronyms[(i + 1 + i // 6) % 6]) for i in range(count))]
+        with redirect_stdout(io.StringIO()):
+            scrape_matches.ingest_fixtures(rows)
+        return list(Match.objects.values_list('id', flat=True))
+
+    def run_action(self, match_ids, best_of):
+        changelist = reverse('admin:match_bet_match_changelist')
+        response = self.client.post(changelist, {'action': 'update_attributes', '_selected_action': match_ids})
+        self.assertRedirects(response, reverse('admin:confirm_edit_attributes'))
+        self.assertContains(self.client.get(reverse('admin:confirm_edit_attributes')),
+                            f'Confirm Update for {len(match_ids)} Matches')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('admin:execute_edit_attributes'), {'new_match_count': best_of})
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_lowering_match_count_concludes_and_adjusts_ratings(self):
+        match_ids = self.ingest_bo3_results(12)
+        self.assertFalse(Match.objects.filter(is_concluded=True).exists())
+
+        self.run_action(match_ids, 3)
+
+        self.assertEqual(Match.objects.filter(best_of=3, is_concluded=True).count(), 12)
+        self.assertFalse(Match.objects.filter(winner__isnull=True).exists())
+        self.assertFalse(MatchTeamRelation.objects.filter(pr_delta__isnull=True).exists())
+        # Chronological incremental adjustments match a full replay
+        out = io.StringIO()
+        call_command('recompute_ratings', '--dry-run', stdout=out)
+        self.assertIn('Would update 0 teams and 0 match-team relations', out.getvalue())
+
+    def test_raising_match_count_reopens_and_recomputes(self):
+        match_ids = self.ingest_bo3_results(12)
+        self.run_action(match_ids, 3)
+        self.run_action(match_ids[:4], 5)
+
+        self.assertEqual(Match.objects.filter(is_concluded=True).count(), 8)
+        self.assertFalse(MatchTeamRelation.objects.filter(match_id__in=match_ids[:4], pr_delta__isnull=False).exists())
+        out = io.StringIO()
+        call_command('recompute_ratings', '--dry-run', stdout=out)
+        self.assertIn('Would update 0 teams and 0 match-team relations', out.getvalue())
+
+    def test_out_of_order_results_match_a_full_replay(self):
+        match_ids = self.ingest_bo3_results(12)
+        # The later half concludes first, the earlier results then change every later rating
+        self.run_action(match_ids[6:], 3)
+        self.run_action(match_ids[:6], 3)
+
+        self.assertEqual(Match.objects.filter(is_concluded=True).count(), 12)
+        prs = dict(Team.objects.values_list('acronym', 'current_pr'))
+        deltas = list(MatchTeamRelation.objects.order_by('id').values_list('pr_delta', flat=True))
+        out = io.StringIO()
+        call_command('recompute_ratings', '--dry-run', stdout=out)
+        self.assertIn('Would update 0 teams and 0 match-team relations', out.getvalue())
+
+        call_command('recompute_ratings', stdout=io.StringIO())
+        self.assertEqual(dict(Team.objects.values_list('acronym', 'current_pr')), prs)
+        self.assertEqual(list(MatchTeamRelation.objects.order_by('id').values_list('pr_delta', flat=True)), deltas)
+
+    def test_query_count_does_not_grow_with_selection(self):
+        match_ids = self.ingest_bo3_results(40)
+        small = self.run_action(match_ids[:10], 3)
+        self.assertEqual(self.run_action(match_ids[10:], 3), small)
+        self.assertLessEqual(small, 20)
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.acronyms = create_test_teams(8)
+        self.ingest(25)
+
+    def ingest(self, count, seed=0):
+        with redirect_stdout(io.StringIO()), self.captureOnCommitCallbacks(execute=True):
+            scrape_matches.ingest_fixtures(synthetic_fixtures(self.acronyms, count, seed=seed))
+
+    def test_keyset_pagination_walks_all_matches(self):
+        url = reverse('match_bet:api_matches')
+        ids = []
+        cursor = None
+        while True:
+            response = self.client.get(url, {'limit': 7, **({'after': cursor} if cursor else {})})
+            page = response.json()
+            ids.extend(match['id'] for match in page['results'])
+            self.assertTrue(all(len(match['teams']) == 2 for match in page['results']))
+            cursor = page['next']
+            if cursor is None:
+                break
+
+        self.assertEqual(ids, list(Match.objects.order_by('datetime', 'id').values_list('id', flat=True)))
+
+    def test_concluded_filter(self):
+        response = self.client.get(reverse('match_bet:api_matches'), {'concluded': 'true'})
+        self.assertEqual(len(response.json()['results']), Match.objects.filter(is_concluded=True).count())
+
+    def test_unchanged_poll_is_not_modified_without_queries(self):
+        url = reverse('match_bet:api_matches')
+        response = self.client.get(url)
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Other query strings have their own ETag
+        self.assertNotEqual(self.client.get(url, {'limit': 5})['ETag'], etag)
+
+        self.ingest(5, seed=1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_admin_save_bumps_version(self):
+        version = DataVersion.current()
+        with self.captureOnCommitCallbacks(execute=True):
+            team = Team.objects.first()
+            team.name = 'Renamed'
+            team.save()
+        self.assertGreater(DataVersion.current(), version)
+
+    def test_teams_and_odds(self):
+        teams = self.client.get(reverse('match_bet:api_teams'), {'limit': 5}).json()
+        self.assertEqual(len(teams['results']), 5)
+        rest = self.client.get(reverse('match_bet:api_teams'), {'after': teams['next']}).json()
+        self.assertEqual(len(rest['results']), 3)
+
+        team1, team2 = Team.objects.all()[:2]
+        response = self.client.get(reverse('match_bet:api_odds'), {'team1': team1.id, 'team2': team2.id})
+        self.assertEqual(response.json()['odds'], list(pr_to_odds(team1, team2)))
+        self.assertEqual(self.client.get(reverse('match_bet:api_odds'), {'team1': 0, 'team2': 1}).status_code, 400)
+
+
+def parse_frames(chunks):
+    # [(event, data)] of the SSE frames in the chunks, comments and retry lines skipped
+    events = []
+    for frame in b''.join(chunks).decode().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in frame.splitlines() if not line.startswith(('retry', ':')))
+        if 'event' in fields:
+            events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+# The tests drive the change poller themselves, its thread would read the test database
+# from another connection
+@override_settings(FEED_POLL_INTERVAL=None)
+class FeedTests(TestCase):
+    def setUp(self):
+        self.acronyms = create_test_teams(8)
+
+    def tearDown(self):
+        # The test client doesn't close abandoned streams
+        feed.broker._subscribers.clear()
+
+    def ingest(self, count, seed=0, concluded_ratio=0.5):
+        with redirect_stdout(io.StringIO()), self.captureOnCommitCallbacks(execute=True):
+            scrape_matches.ingest_fixtures(
+                synthetic_fixtures(self.acronyms, count, seed=seed, concluded_ratio=concluded_ratio))
+
+    async def read_events(self, stream, count):
+        chunks = []
+        while len(parse_frames(chunks)) < count:
+            chunks.append(await asyncio.wait_for(anext(stream), 5))
+        return parse_frames(chunks)
+
+    async def test_stream_pushes_ingested_matches_and_odds(self):
+        response = await self.async_client.get(reverse('match_bet:api_feed'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        await anext(stream)  # retry line, the client is subscribed
+
+        await sync_to_async(self.ingest)(10)
+        (matches_event, matches), (odds_event, odds) = await self.read_events(stream, 2)
+
+        self.assertEqual(matches_event, 'matches')
+        self.assertEqual(len(matches), 10)
+        self.assertTrue(all(len(match['teams']) == 2 for match in matches))
+        self.assertEqual(odds_event, 'odds')
+        upcoming = await Match.objects.filter(is_concluded=False).acount()
+        self.assertEqual(len(odds['matches']), upcoming)
+
+    def test_odds_event_sends_the_stored_odds(self):
+        odds_matrix.invalidate()
+        self.ingest(4, concluded_ratio=0)
+        match = Match.objects.first()
+        Match.objects.filter(id=match.id).update(current_odds=(1.8, 2.25))
+        team_ids = list(match.matchteamrelation_set.order_by('-is_team1').values_list('team_id', flat=True))
+
+        row, = [row for row in feed.odds_rows(team_ids)['matches'] if row['id'] == match.id]
+        self.assertEqual(row['teams'], team_ids)
+        self.assertEqual(row['odds'], [1.8, 2.25])
+        self.assertEqual(row['pr_odds'], odds_matrix.odds(*team_ids))
+        self.assertNotEqual(list(row['pr_odds']), row['odds'])
+
+    async def test_writes_of_other_processes_are_published(self):
+        await sync_to_async(self.ingest)(4, concluded_ratio=0)
+        poller = feed.ChangePoller()
+        subscriber = feed.broker.subscribe()
+
+        def events():
+            return parse_frames([subscriber.queue.get_nowait() for _ in range(subscriber.queue.qsize())])
+
+        def write_elsewhere():
+            # Like another process: no signals, only the data version tells something changed
+            match = Match.objects.order_by('id').first()
+            team = Team.objects.get(acronym='T0')
+            Match.objects.filter(id=match.id).update(stage='final')
+            Team.objects.filter(id=team.id).update(current_pr=9.5)
+            DataVersion.bump()
+            poller.poll()
+            poller.poll()  # Nothing new
+            return match.id, team.id
+
+        def write_here():
+            # Published by this process, the poller doesn't send it again
+            with mock.patch.object(feed, 'change_poller', poller):
+                self.ingest(2, seed=1, concluded_ratio=0)
+            poller.poll()
+
+        try:
+            await sync_to_async(poller.poll)()  # Baseline
+            await asyncio.sleep(0)
+            self.assertEqual(events(), [])
+
+            match_id, team_id = await sync_to_async(write_elsewhere)()
+            await asyncio.sleep(0)
+            (matches_event, matches), (odds_event, odds) = events()
+            self.assertEqual(matches_event, 'matches')
+            self.assertEqual([(row['id'], row['stage']) for row in matches], [(match_id, 'final')])
+            self.assertEqual(odds_event, 'odds')
+            self.assertEqual(odds['teams'], [{'id': team_id, 'current_pr': 9.5}])
+
+            await sync_to_async(write_here)()
+            await asyncio.sleep(0)
+            self.assertEqual([event for event, _ in events()], ['matches'])
+        finally:
+            feed.broker.unsubscribe(subscriber)
+
+    async def test_closed_stream_unsubscribes(self):
+        events = feed.stream_events(feed.broker.subscribe(), heartbeat=0.01)
+        self.assertEqual(await anext(events), b'retry: 3000\n\n')
+        self.assertEqual(await anext(events), b': keepalive\n\n')
+        await events.aclose()
+        self.assertFalse(feed.broker.has_subscribers)
+
+        # Streams end on their own after max_seconds
+        events = feed.stream_events(feed.broker.subscribe(), max_seconds=0)
+        self.assertEqual([chunk async for chunk in events], [b'retry: 3000\n\n'])
+        self.assertFalse(feed.broker.has_subscribers)
+
+    async def test_burst_reads_once_per_change_for_all_clients(self):
+        subscribers = [feed.broker.subscribe() for _ in range(500)]
+        try:
+            def burst():
+                with CaptureQueriesContext(connection) as queries:
+                    for seed in range(5):
+                        self.ingest(4, seed=seed, concluded_ratio=0)
+                return len(queries)
+
+            # 5 ingests: their own queries plus 2 feed reads (matches + teams) each
+            query_count = await sync_to_async(burst)()
+            self.assertLess(query_count, 5 * 20)
+            await asyncio.sleep(0)
+
+            frames = [[subscriber.queue.get_nowait() for _ in range(subscriber.queue.qsize())]
+                      for subscriber in subscribers]
+            self.assertEqual(len(frames[0]), 5)
+            self.assertTrue(all(frame is expected for subscriber_frames in frames
+                                for frame, expected in zip(subscriber_frames, frames[0])))
+        finally:
+            for subscriber in subscribers:
+                feed.broker.unsubscribe(subscriber)
+
+    async def test_slow_consumer_gets_resync(self):
+        slow = feed.broker.subscribe(queue_size=4)
+        fast = feed.broker.subscribe()
+        try:
+            for i in range(10):
+                feed.broker.publish('matches', [i])
+            await asyncio.sleep(0)
+
+            self.assertEqual(fast.queue.qsize(), 10)
+            frames = [slow.queue.get_nowait() for _ in range(slow.queue.qsize())]
+            self.assertEqual(parse_frames(frames[:1]), [('resync', {})])
+            self.assertEqual([data for _, data in parse_frames(frames[1:])], [[9]])
+            self.assertEqual(slow.overflows, 2)
+        finally:
+            feed.broker.unsubscribe(slow)
+            feed.broker.unsubscribe(fast)
+
+    def test_admin_inline_saves_are_coalesced(self):
+        self.ingest(3, concluded_ratio=0)
+        match = Match.objects.first()
+        published = []
+
+        with mock.patch.object(feed.Broker, 'has_subscribers', True), \
+                mock.patch.object(feed.broker, 'publish', lambda event, data: published.append((event, data))):
+            with self.captureOnCommitCallbacks(execute=True):
+                match.stage = 'final'
+                match.save()
+                for relation in match.matchteamrelation_set.all():
+                    relation.save()
+            # Rolled back changes are never published
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        match.save()
+                        raise ValueError
+                except ValueError:
+                    pass
+
+        self.assertEqual([event for event, _ in published], ['matches'])
+        self.assertEqual(published[0][1][0]['stage'], 'final')
+
+
+class BetPlacementTests(TestCase):
+    def setUp(self):
+        (self.user_id,), self.pairings = create_bet_fixtures(1, balance=100, matches=2)
+        self.match_id, (self.team1_id, self.team2_id) = self.pairings[0]
+        self.token = User.objects.get(id=self.user_id).issue_api_token()
+
+    def post_bet(self, body, token=None, client=None):
+        headers = {} if token is None else {'Authorization': f'Bearer {token}'}
+        return (client or self.client).post(reverse('match_bet:api_bets'), body,
+                                            content_type='application/json', headers=headers)
+
+    def test_bet_locks_in_odds_and_debits(self):
+        response = self.post_bet({'match': self.match_id, 'team': self.team2_id, 'stake': 40}, self.token)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['odds'], 2.1)
+
+        Match.objects.filter(id=self.match_id).update(current_odds=(1.5, 3.0))
+        self.assertEqual(Bet.objects.get().odds, 2.1)
+        self.assertEqual(User.objects.get().balance, 60)
+
+    def test_rejected_bets_debit_nothing(self):
+        other_match_id, (other_team_id, _) = self.pairings[1]
+        Match.objects.filter(id=other_match_id).update(is_concluded=True)
+
+        for args, error in [
+            ((self.user_id, self.match_id, self.team1_id, 101), 'Insufficient balance'),
+            ((self.user_id, self.match_id, self.team1_id, 0), 'Stake must be positive'),
+            ((self.user_id, self.match_id, other_team_id, 10), 'Team does not play in this match'),
+            ((self.user_id, other_match_id, other_team_id, 10), 'Match has concluded'),
+            ((0, self.match_id, self.team1_id, 10), 'Unknown user'),
+        ]:
+            with self.assertRaisesMessage(BetRejected, error):
+                place_bet(*args)
+
+        self.assertFalse(Bet.objects.exists())
+        self.assertEqual(User.objects.get().balance, 100)
+
+        response = self.post_bet({'match': self.match_id, 'team': self.team1_id, 'stake': 500}, self.token)
+        self.assertEqual(response.status_code, 409)
+
+    def test_bet_needs_a_valid_token(self):
+        # A session, even a staff one, doesn't authenticate a bettor
+        self.client.force_login(AdminUser.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        body = {'match': self.match_id, 'team': self.team1_id, 'stake': 10}
+        for token in (None, '', 'not-a-token'):
+            response = self.post_bet(body, token)
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+
+        self.assertFalse(Bet.objects.exists())
+        self.assertEqual(User.objects.get().balance, 100)
+
+    def test_bet_user_comes_from_the_token(self):
+        other = User.objects.create(name='Other', balance=100)
+        response = self.post_bet({'user': other.id, 'match': self.match_id, 'team': self.team1_id, 'stake': 10},
+                                 self.token)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['user'], self.user_id)
+        self.assertEqual(Bet.objects.get().user_id, self.user_id)
+        self.assertEqual(User.objects.get(id=other.id).balance, 100)
+
+        # A new token replaces the previous one
+        new_token = User.objects.get(id=self.user_id).issue_api_token()
+        body = {'match': self.match_id, 'team': self.team1_id, 'stake': 10}
+        self.assertEqual(self.post_bet(body, self.token).status_code, 401)
+        self.assertEqual(self.post_bet(body, new_token).status_code, 201)
+
+    def test_bet_with_csrf_checks_enforced(self):
+        client = Client(enforce_csrf_checks=True)
+        response = self.post_bet({'match': self.match_id, 'team': self.team1_id, 'stake': 10}, self.token, client)
+        self.assertEqual(response.status_code, 201)
+
+
+class ConcurrentBetTests(TransactionTestCase):
+    def tearDown(self):
+        # Reprices scheduled by the bets would run after the test database is gone
+        odds_repricer.cancel()
+
+    def test_no_lost_updates_or_overdrafts(self):
+        # WAL and busy_timeout come from SQLITE_PRAGMAS
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+        # 8 threads try 400 bets of 10 against 5 users with 500 each: exactly 250 fit
+        user_ids, pairings = create_bet_fixtures(5, balance=500)
+        placed, rejected, _ = run_bet_stress(user_ids, pairings, threads=8, bets_per_thread=50, stake=10)
+
+        self.assertEqual((placed, rejected), (250, 150))
+        self.assertEqual(Bet.objects.count(), 250)
+        self.assertEqual(list(User.objects.values_list('balance', flat=True).distinct()), [0])
+        self.assertEqual(check_balances(500), [])
+
+        # Concurrent first bets on a side share one exposure row
+        self.assertEqual(sum(Exposure.objects.values_list('bet_count', flat=True)), 250)
+        call_command('verify_exposure', stdout=io.StringIO())
+
+
+class ExposureTests(TestCase):
+    def setUp(self):
+        user_ids, self.pairings = create_bet_fixtures(3, balance=100, matches=2)
+        self.match_id, (self.team1_id, self.team2_id) = self.pairings[0]
+        for user_id in user_ids:
+            place_bet(user_id, self.match_id, self.team1_id, 10)
+        place_bet(user_ids[0], self.match_id, self.team2_id, 20)
+        self.user_ids = user_ids
+
+    def test_exposure_read_is_one_query(self):
+        with self.assertNumQueries(1):
+            exposure = match_exposure(self.match_id)
+        self.assertEqual(exposure[self.team1_id], (30, 30 * 1.9, 3))
+        self.assertEqual(exposure[self.team2_id], (20, 20 * 2.1, 1))
+
+    def test_settlement_pays_winners_and_clears_exposure(self):
+        Match.objects.filter(id=self.match_id).update(is_concluded=True, winner_id=self.team2_id)
+        self.assertEqual(settle_matches([self.match_id]), 4)
+        self.assertEqual(settle_matches([self.match_id]), 0)
+
+        self.assertEqual(match_exposure(self.match_id), {})
+        balances = dict(User.objects.values_list('id', 'balance'))
+        self.assertAlmostEqual(balances[self.user_ids[0]], 100 - 30 + 20 * 2.1)
+        self.assertEqual(balances[self.user_ids[1]], 90)
+        call_command('verify_exposure', stdout=io.StringIO())
+
+    def test_ingest_settles_concluded_matches(self):
+        match = Match.objects.get(id=self.match_id)
+        team1, team2 = Team.objects.get(id=self.team1_id), Team.objects.get(id=self.team2_id)
+        match.best_of = 3
+        match.save()
+        with redirect_stdout(io.StringIO()):
+            # Scraped dates are converted to UTC+8
+            site_date = format_site_date(match.datetime - timedelta(hours=8))
+            scrape_matches.ingest_fixtures([[f'{team1.acronym}{SEP}', '2', '0', site_date,
+                                             f'{SEP}{team2.acronym}']])
+
+        self.assertEqual(Bet.objects.filter(payout__isnull=True).count(), 0)
+        self.assertEqual(User.objects.get(id=self.user_ids[1]).balance, 90 + 10 * 1.9)
+
+    def test_reopening_a_match_reverses_its_settlement(self):
+        before = dict(User.objects.values_list('id', 'balance'))
+        exposure = match_exposure(self.match_id)
+        MatchTeamRelation.objects.filter(match_id=self.match_id, is_team1=True).update(match_score='2 - 0')
+        MatchTeamRelation.objects.filter(match_id=self.match_id, is_team1=False).update(match_score='0 - 2')
+
+        with redirect_stdout(io.StringIO()):
+            scrape_matches.update_best_of([self.match_id], 3)
+            self.assertEqual(Bet.objects.filter(payout__isnull=True).count(), 0)
+            self.assertEqual(User.objects.get(id=self.user_ids[1]).balance, 90 + 10 * 1.9)
+
+            # 2 - 0 of a best of 5 isn't over
+            _, _, reopened = scrape_matches.update_best_of([self.match_id], 5)
+
+        self.assertEqual([match.id for match in reopened], [self.match_id])
+        self.assertEqual(Bet.objects.filter(payout__isnull=False).count(), 0)
+        for user_id, balance in User.objects.values_list('id', 'balance'):
+            self.assertAlmostEqual(balance, before[user_id])
+        self.assertEqual(match_exposure(self.match_id), exposure)
+        call_command('verify_exposure', stdout=io.StringIO())
+
+    def test_verify_exposure_reports_and_fixes_drift(self):
+        Exposure.objects.filter(team_id=self.team1_id).update(bet_count=5)
+        with self.assertRaises(CommandError):
+            call_command('verify_exposure', stdout=io.StringIO())
+
+        call_command('verify_exposure', '--fix', stdout=io.StringIO())
+        call_command('verify_exposure', stdout=io.StringIO())
+        self.assertEqual(match_exposure(self.match_id)[self.team1_id][2], 3)
+
+
+class FakeTimer:
+    # threading.Timer stand-in that only runs when flushed
+    created = []
+
+    def __init__(self, interval, function, args):
+        self.interval = interval
+        self.daemon = False
+        FakeTimer.created.append(self)
+
+    def start(self):
+        pass
+
+    def cancel(self):
+        pass
+
+
+class DynamicOddsTests(TestCase):
+    def setUp(self):
+        (self.user_id,), pairings = create_bet_fixtures(1, balance=10000, matches=1)
+        self.match_id, (self.team1_id, self.team2_id) = pairings[0]
+        FakeTimer.created = []
+
+    def test_bets_shorten_the_backed_team(self):
+        self.assertEqual(priced_odds((1.9, 2.1), (0, 0)), (1.9, 2.1))
+        odds1, odds2 = priced_odds((1.25, 5.0), (5000, 0))
+        self.assertLess(odds1, 1.25)
+        self.assertGreater(odds2, 5.0)
+        # Balanced money keeps the ratings' odds
+        self.assertEqual(priced_odds((2.0, 2.0), (300, 300)), (2.0, 2.0))
+
+    def test_bet_flow_is_coalesced_into_one_write_per_interval(self):
+        repricer = OddsRepricer(interval=60, timer=FakeTimer)
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(50):
+                place_bet(self.user_id, self.match_id, self.team1_id, 100)
+                repricer.request(self.match_id)
+            self.assertEqual(len(FakeTimer.created), 1)
+            self.assertEqual(repricer.flush(), 1)
+
+        match_writes = [query for query in queries if query['sql'].startswith('UPDATE "match_bet_match"')]
+        self.assertEqual(len(match_writes), 2)
+
+        match = Match.objects.get(id=self.match_id)
+        history = list(match.odds_changes.order_by('datetime', 'id').values_list('odds1', 'odds2'))
+        self.assertEqual(history[0], (1.9, 2.1))
+        self.assertEqual(len(history), 2)
+        self.assertLess(match.current_odds[0], history[1][0])
+        first_change = match.odds_changes.order_by('datetime').first().datetime
+        self.assertEqual(match.odds_as_of(first_change - timedelta(seconds=1)), (1.9, 2.1))
+        self.assertEqual(match.odds_as_of(timezone.now()), tuple(match.current_odds))
+
+    def test_concluded_matches_are_not_repriced(self):
+        Match.objects.filter(id=self.match_id).update(is_concluded=True)
+        place_bet_odds = Match.objects.get(id=self.match_id).current_odds
+        Exposure.objects.create(match_id=self.match_id, team_id=self.team1_id, total_stake=5000)
+        OddsRepricer(interval=0).request(self.match_id)
+        self.assertEqual(Match.objects.get(id=self.match_id).current_odds, place_bet_odds)
+
+
+class SqliteProfileTests(TestCase):
+    def test_connections_get_the_pragmas(self):
+        with connection.cursor() as cursor:
+            for pragma, expected in [('journal_mode', 'wal'), ('synchronous', 1), ('busy_timeout', 20000)]:
+                cursor.execute(f'PRAGMA {pragma}')
+                self.assertEqual(cursor.fetchone()[0], expected)
+
+    def test_hot_lookups_use_indexes(self):
+        for queryset in [Team.objects.filter(tournament_id=1, acronym='T1'),
+                         Match.objects.filter(tournament_id=1).order_by('datetime'),
+                         Match.objects.filter(tournament_id=1, stage='swiss'),
+                         Match.objects.filter(tournament_id=1, is_concluded=False).order_by('datetime'),
+                         Match.objects.filter(tournament_id=1, is_concluded=True).order_by('datetime'),
+                         MatchTeamRelation.objects.filter(match_id=1).order_by('-is_team1')]:
+            plan = queryset.explain()
+            self.assertIn('USING INDEX', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+class CreateTeamsTests(TestCase):
+    CSV = ('name,acronym,base_pr,origin,seed\n'
+           ' T1 , T1 , 5.10 , LCK , 2.00 \n'
+           ' Team Liquid , TL , 13.10 , LCS , 3.00 \n'
+           ' Gen.G , GEN , 4.00 , LCK , 1.00 \n')
+
+    def import_csv(self, text):
+        out = io.StringIO()
+        with mock.patch('sys.stdin', io.StringIO(text)):
+            call_command('create_teams', '-', stdout=out, stderr=io.StringIO())
+        return out.getvalue()
+
+    def test_rerun_is_idempotent(self):
+        self.assertIn('3 created, 0 updated, 0 unchanged', self.import_csv(self.CSV))
+        self.assertIn('0 created, 0 updated, 3 unchanged', self.import_csv(self.CSV))
+
+        self.assertEqual(Team.objects.count(), 3)
+        team = Team.objects.get(acronym='TL')
+        self.assertEqual((team.name, team.base_pr, team.current_pr, team.seed, team.origin),
+                         ('Team Liquid', 13.1, 13.1, 3, 'lcs'))
+
+    def test_only_changed_teams_are_updated(self):
+        self.import_csv(self.CSV)
+        Team.objects.filter(acronym='T1').update(current_pr=7)
+
+        out = self.import_csv(self.CSV.replace('13.10', '12.00') + ' Fnatic , FNC , 9.00 , LEC , 1.00 \n')
+
+        self.assertIn('1 created, 1 updated, 2 unchanged', out)
+        self.assertEqual(Team.objects.get(acronym='TL').base_pr, 12)
+        # The replayed PR isn't touched by the import
+        self.assertEqual(Team.objects.get(acronym='T1').current_pr, 7)
+
+    def test_invalid_rows_import_nothing(self):
+        text = self.CSV + ' Bad , BAD , 4.00 , LCK , 7.00 \n Copy , T1 , 4.00 , LCK , 1.00 \n'
+        err = io.StringIO()
+        with mock.patch('sys.stdin', io.StringIO(text)), self.assertRaisesMessage(CommandError, '2 invalid rows'):
+            call_command('create_teams', '-', stdout=io.StringIO(), stderr=err)
+
+        self.assertIn('Line 5: seed must be one of', err.getvalue())
+        self.assertIn('Line 6: acronym T1 is already on line 2', err.getvalue())
+        self.assertFalse(Team.objects.exists())
+
+    def test_import_bumps_the_api_version_and_publishes(self):
+        url = reverse('match_bet:api_teams')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.import_csv(self.CSV)
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.import_csv(self.CSV)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        published = []
+        with mock.patch.object(feed.Broker, 'has_subscribers', True), \
+                mock.patch.object(feed.broker, 'publish', lambda event, data: published.append((event, data))), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.import_csv(self.CSV.replace('13.10', '12.00'))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(12.0, [team['base_pr'] for team in response.json()['results']])
+        self.assertEqual([event for event, _ in published], ['odds'])
+        self.assertEqual([team['id'] for team in published[0][1]['teams']], [Team.objects.get(acronym='TL').id])
+
+    def test_renames_refresh_matchups(self):
+        self.import_csv(self.CSV)
+        t1, tl, gen = (Team.objects.get(acronym=acronym) for acronym in ('T1', 'TL', 'GEN'))
+        match = Match.objects.create(tournament=t1.tournament, datetime='2023-10-10T10:00:00+00:00')
+        other = Match.objects.create(tournament=t1.tournament, datetime='2023-10-11T10:00:00+00:00')
+        for m, team1, team2 in ((match, t1, tl), (other, tl, gen)):
+            MatchTeamRelation.objects.create(match=m, team=team1, is_team1=True)
+            MatchTeamRelation.objects.create(match=m, team=team2, is_team1=False)
+            m.refresh_matchup()
+            m.save()
+
+        published = []
+        with mock.patch.object(feed.Broker, 'has_subscribers', True), \
+                mock.patch.object(feed.broker, 'publish', lambda event, data: published.append((event, data))), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.import_csv(self.CSV.replace(' T1 , T1 ', ' SK Telecom T1 , T1 '))
+
+        self.assertEqual(Match.objects.get(id=match.id).matchup, 'SK Telecom T1 vs Team Liquid')
+        self.assertEqual(Match.objects.get(id=other.id).matchup, 'Team Liquid vs Gen.G')
+        self.assertEqual(sorted(event for event, _ in published), ['matches', 'odds'])
+        matches = dict(published)['matches']
+        self.assertEqual([row['matchup'] for row in matches], ['SK Telecom T1 vs Team Liquid'])
+
+
+class SnapshotTests(RatingHistoryMixin, TestCase):
+    def contents(self, tournament):
+        # The tournament's rows without their ids
+        return (
+            list(tournament.teams.order_by('acronym').values_list(*TEAM_SNAPSHOT_FIELDS)),
+            list(tournament.matches.order_by('datetime').values_list('winner__acronym', *MATCH_SNAPSHOT_FIELDS)),
+            list(MatchTeamRelation.objects.filter(match__tournament=tournament)
+                 .order_by('match__datetime', '-is_team1').values_list('team__acronym', 'pr_delta', 'match_score')),
+            list(PRHistory.objects.filter(team__tournament=tournament).order_by('team__acronym', 'datetime')
+                 .values_list('team__acronym', 'match__datetime', 'datetime', 'pr')),
+            list(OddsHistory.objects.filter(match__tournament=tournament).order_by('match__datetime', 'datetime')
+                 .values_list('match__datetime', 'datetime', 'odds1', 'odds2')),
+        )
+
+    def test_round_trip(self):
+        tournament = Tournament.objects.default()
+        for match in tournament.matches.filter(is_concluded=False):
+            match.update_current_odds((1.5, 2.5))
+        # Sub-millisecond times survive the round trip
+        change = PRHistory.objects.filter(team__tournament=tournament).earliest('datetime')
+        change.datetime = change.datetime.replace(microsecond=123456)
+        change.save()
+        odds_changed_at = datetime(2023, 10, 1, 12, 0, 0, 654321, tzinfo=dt_timezone.utc)
+        OddsHistory.objects.filter(match__tournament=tournament).update(datetime=odds_changed_at)
+
+        snapshot = io.BytesIO()
+        counts = export_tournament(tournament, snapshot)
+        self.assertEqual(counts['match'], 60)
+        self.assertEqual(counts['odds_history'], tournament.matches.filter(is_concluded=False).count())
+
+        snapshot.seek(0)
+        copy, imported = import_tournament(snapshot, slug='copy')
+        self.assertEqual(imported, counts)
+        self.assertEqual(copy.name, tournament.name)
+        self.assertEqual(self.contents(copy), self.contents(tournament))
+
+    def test_commands_refuse_a_taken_slug(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'snapshot.ndjson.gz')
+        call_command('export_tournament', '--output', path, stdout=io.StringIO())
+
+        with self.assertRaisesMessage(CommandError, 'already exists'):
+            call_command('import_tournament', path, stdout=io.StringIO())
+        call_command('import_tournament', path, '--slug', 'copy', stdout=io.StringIO())
+
+        self.assertEqual(Tournament.objects.count(), 2)
+        self.assertEqual(Tournament.objects.get(slug='copy').teams.count(), 8)
+
+
+class ScrapeJobTests(TestCase):
+    def setUp(self):
+        jobs._current_job = jobs._last_job = None
+        self.release = threading.Event()
+        self.runs = 0
+        self.staff = Client()
+        self.staff.force_login(AdminUser.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    def fake_scrape(self, progress=None):
+        self.runs += 1
+        progress('fetch')
+        self.release.wait(5)
+        progress('ingest')
+        return 2, 1, 5, 3, 0
+
+    def wait_for_job(self, job):
+        for _ in range(500):
+            if not job.is_running:
+                return
+            time.sleep(0.01)
+        self.fail('The scrape job never finished')
+
+    def test_concurrent_triggers_join_one_run(self):
+        with mock.patch.object(jobs, 'run_scrape', self.fake_scrape):
+            first, created = jobs.enqueue_scrape()
+            second, second_created = jobs.enqueue_scrape()
+            self.assertTrue(created)
+            self.assertFalse(second_created)
+            self.assertIs(first, second)
+            self.release.set()
+            self.wait_for_job(first)
+
+        self.assertEqual(self.runs, 1)
+        status = self.staff.get(reverse('match_bet:scrape_status')).json()
+        self.assertEqual(status['phase'], 'done')
+        self.assertEqual(set(status['timings']), {'fetch', 'ingest'})
+        self.assertEqual(status['counts'], {'new': 2, 'updated': 1, 'unchanged': 5, 'skipped': 3, 'unknown': 0})
+        self.assertIsNone(status['error'])
+
+    def test_failed_scrape_reports_the_message_only(self):
+        def failing_scrape(progress=None):
+            progress('fetch')
+            raise RuntimeError('Schedule page returned 503')
+
+        with mock.patch.object(jobs, 'run_scrape', failing_scrape), mock.patch('sys.stderr', io.StringIO()) as err:
+            job, _ = jobs.enqueue_scrape()
+            self.wait_for_job(job)
+
+        status = self.staff.get(reverse('match_bet:scrape_status')).json()
+        self.assertEqual(status['phase'], 'failed')
+        self.assertEqual(status['error'], 'Schedule page returned 503')
+        self.assertIsNone(status['counts'])
+        self.assertIn('Traceback', err.getvalue())
+
+    def test_views_are_staff_only_and_trigger_is_post_only(self):
+        for url in (reverse('match_bet:scrape_matches'), reverse('match_bet:scrape_status')):
+            response = self.client.post(url) if url.endswith('scrape/') else self.client.get(url)
+            self.assertEqual(response.status_code, 302)
+            self.assertIn(reverse('admin:login'), response['Location'])
+
+        with mock.patch.object(jobs, 'run_scrape', self.fake_scrape):
+            self.assertEqual(self.staff.get(reverse('match_bet:scrape_matches')).status_code, 405)
+            self.assertIsNone(jobs._current_job)
+
+            response = self.staff.post(reverse('match_bet:scrape_matches'))
+            self.assertEqual(response.status_code, 302)
+            job = jobs._current_job
+            self.release.set()
+            self.wait_for_job(job)
+        self.assertEqual(self.runs, 1)
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.path = os.path.join(tmp_dir, 'metrics')
+
+    def test_disabled_by_default(self):
+        self.assertIs(phase('ingest'), NO_PHASE)
+        with recording('scrape_matches') as recorder:
+            self.assertIsNone(recorder)
+            self.assertEqual(connection.execute_wrappers, [])
+            self.assertIs(phase('ingest'), NO_PHASE)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_nested_phases_add_up(self):
+        with recording('test', always=True) as recorder:
+            with phase('outer'):
+                for _ in range(2):
+                    with phase('inner'):
+                        Team.objects.count()
+            # A nested recording records into the outer one
+            with recording('nested') as nested:
+                self.assertIs(nested, recorder)
+                Team.objects.count()
+        self.assertEqual(connection.execute_wrappers, [])
+
+        phases = recorder.as_dict()['phases']
+        self.assertEqual((phases['inner']['calls'], phases['inner']['queries']), (2, 2))
+        self.assertEqual((phases['outer']['calls'], phases['outer']['queries']), (1, 2))
+        self.assertEqual(phases['total']['queries'], 3)
+        self.assertGreaterEqual(phases['outer']['seconds'], phases['inner']['seconds'])
+
+    def test_admin_requests_as_prometheus_counters(self):
+        admin_user = AdminUser.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        url = reverse('admin:match_bet_match_changelist')
+        with override_settings(INSTRUMENTATION_PATH=self.path, INSTRUMENTATION_FORMAT='prometheus'):
+            # The middleware is only loaded when instrumentation is on
+            client = self.client_class()
+            client.force_login(admin_user)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(client.get(url).status_code, 200)
+            client.get(url)
+
+        with open(self.path) as metrics_file:
+            metrics = metrics_file.read()
+        self.assertIn('# TYPE octobet_phase_queries_total counter', metrics)
+        # Counters are totals over the process's requests, sum of both
+        run = 'run="admin:match_bet_match_changelist",phase="total"'
+        self.assertIn(f'octobet_phase_calls_total{{{run}}} 2', metrics)
+        count = next(line for line in metrics.splitlines() if line.startswith(f'octobet_phase_queries_total{{{run}}}'))
+        self.assertGreaterEqual(int(count.split()[-1]), len(queries))
+
+
+class BenchmarkSuiteTests(TestCase):
+    SCALE = {'teams': 8, 'matches': 40, 'users': 5, 'bets': 60}
+
+    def test_synthetic_league_is_consistent(self):
+        tournament = Tournament.objects.create(slug='league', name='League')
+        acronyms = create_synthetic_league(tournament, **self.SCALE)
+
+        self.assertEqual(tournament.teams.count(), 8)
+        self.assertEqual(tournament.matches.count(), 40)
+        self.assertEqual(Bet.objects.filter(match__tournament=tournament).count(), 60)
+        self.assertFalse(Bet.objects.filter(match__is_concluded=True).exists())
+        self.assertEqual(compare_exposure(), [])
+        self.assertEqual(check_balances(1000), [])
+
+        # The generated CSV round trips through create_teams
+        teams = synthetic_teams(acronyms)
+        with mock.patch('sys.stdin', io.StringIO(team_csv(teams))):
+            call_command('create_teams', '-', '--tournament', 'csv', stdout=io.StringIO())
+        self.assertEqual(list(Team.objects.filter(tournament__slug='csv').order_by('id')
+                              .values('name', 'acronym', 'base_pr', 'seed', 'origin')), list(teams.values()))
+
+    def test_suite_runs_every_case(self):
+        results, reference, changelist_queries = run_suite(self.SCALE, repeat=1)
+
+        self.assertEqual(set(results), set(BENCHMARK_CASES))
+        self.assertTrue(all(seconds > 0 and operations > 0 for seconds, operations in results.values()))
+        self.assertGreater(reference, 0)
+        self.assertEqual(changelist_queries, AdminQueryBudgetTests.MATCH_CHANGELIST_BUDGET)
+
+        # Relative times are per operation over the reference's time per operation
+        rows = {name: row for name, *row in compare({'elo': (2.0, 4), 'ingest': (3.0, 1)}, 0.5, {'elo': 0.5})}
+        self.assertEqual(rows['elo'], [0.5, 1.0, 0.5, 2.0])
+        self.assertEqual(rows['ingest'], [3.0, 6.0, None, None])
+
+
+class LeaguepediaAdapterTests(TestCase):
+    adapter = get_adapter('leaguepedia')
+
+    def test_decode(self):
+        date = '10 October 2023 08:00:00 +0000'
+        for cells, expected in [
+            ([f'T1{SEP}', date, f'{SEP}GEN'], ('T1', 'GEN', date, None, None)),
+            ([f'T1{SEP}', ' 3', '1 ', date, f'{SEP}GEN'], ('T1', 'GEN', date, 3, 1)),
+            ([f'TBD{SEP}', date, f'{SEP}TBD'], None),
+            ([f'TBD{SEP}', date, f'{SEP}GEN'], None),
+            ([f'T1{SEP}', date, f'{SEP}TBD'], None),
+            # Forfeits and broken rows are ignored
+            ([f'T1{SEP}', 'W', 'FF', date, f'{SEP}GEN'], None),
+            ([f'T1{SEP}', '3', date, f'{SEP}GEN'], None),
+        ]:
+            self.assertEqual(self.adapter.decode(cells), expected)
+
+    def test_parse_date(self):
+        # Stored in UTC+8, labelled as UTC, like every match so far
+        self.assertEqual(self.adapter.parse_date('9 October 2023 23:30:00 +0000, Monday'),
+                         datetime(2023, 10, 10, 7, 30, tzinfo=dt_timezone.utc))
+        self.assertEqual(self.adapter.parse_date('10 October 2023 08:00:00 -0530'),
+                         datetime(2023, 10, 10, 21, 30, tzinfo=dt_timezone.utc))
+        with self.assertRaises(ValueError):
+            self.adapter.parse_date('TBD')
+
+    def test_group(self):
+        rows = synthetic_fixtures(['T1', 'GEN', 'JDG'], 10)
+        self.assertEqual(list(self.adapter.group(cell for row in rows for cell in row)), rows)
+
+    def test_incomplete_adapters_are_refused(self):
+        class NoDates(ScheduleAdapter):
+            name = 'no-dates'
+
+            def group(self, elements):
+                yield list(elements)
+
+            def decode(self, cells):
+                return None
+
+        with self.assertRaisesMessage(TypeError, 'parse_date'):
+            register(NoDates)
+        self.assertNotIn('no-dates', ADAPTERS)
+
+        with mock.patch.dict(globals(), {'NoDates': NoDates}), \
+                self.assertRaisesMessage(ValueError, 'Invalid schedule adapter'):
+            get_adapter(f'{__name__}.NoDates')
+
+
+class PollIntervalTests(TestCase):
+    def setUp(self):
+        self.tournament = Tournament.objects.default()
+        self.now = datetime(2023, 10, 10, 8, tzinfo=dt_timezone.utc)
+        self.shift = get_adapter().shift
+
+    def add_match(self, starts_in, is_concluded=False):
+        # Stored like the adapter stores the times it scrapes
+        Match.objects.create(tournament=self.tournament, datetime=self.now + starts_in + self.shift,
+                             is_concluded=is_concluded)
+
+    def interval(self):
+        return watch.poll_interval(self.tournament, {self.shift}, fast=30, slow=900, now=self.now)
+
+    def test_slow_without_upcoming_matches(self):
+        self.add_match(timedelta(hours=-1), is_concluded=True)
+        self.assertEqual(self.interval(), (900, 0))
+
+    def test_fast_while_live(self):
+        self.add_match(timedelta(hours=-2))
+        self.add_match(timedelta(minutes=5))
+        self.assertEqual(self.interval(), (30, 2))
+
+    def test_wakes_up_for_the_next_match(self):
+        self.add_match(timedelta(minutes=15))
+        self.assertEqual(self.interval(), (300, 0))
+        Match.objects.all().delete()
+        self.add_match(timedelta(hours=3))
+        self.assertEqual(self.interval(), (900, 0))
@@ -1,10 +1,16 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'match_bet'
 
 urlpatterns = [
     path('scrape/', views.start_scraping_view, name='scrape_matches'),
+    path('scrape/status/', views.scrape_status_view, name='scrape_status'),
+    path('api/matches/', api.matches_view, name='api_matches'),
+    path('api/teams/', api.teams_view, name='api_teams'),
+    path('api/odds/', api.odds_view, name='api_odds'),
+    path('api/bets/', api.bets_view, name='api_bets'),
+    path('api/feed/', api.feed_view, name='api_feed'),
 
 ]
 
@@ -1,10 +1,26 @@
+from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
 from django.shortcuts import render, redirect
-from match_bet.management.commands.scrape_matches import Command
+from django.views.decorators.http import require_GET, require_POST
+from .jobs import enqueue_scrape, scrape_status
 
 # Create your views here.
+@staff_member_required
+@require_POST
 def start_scraping_view(request):
-    # Execute the management command
-    command = Command()
-    command.handle()
+    # Queue the scrape in the background, concurrent triggers join the running one
+    job, created = enqueue_scrape()
 
-    return redirect('/admin/match_bet/match/')
\ No newline at end of file
+    if created:
+        messages.info(request, 'Scrape started.')
+    else:
+        messages.info(request, 'A scrape is already in progress, joined the running scrape.')
+
+    return redirect('/admin/match_bet/match/')
+
+
+@staff_member_required
+@require_GET
+def scrape_status_view(request):
+    return JsonResponse(scrape_status())
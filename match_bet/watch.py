@@ -0,0 +1,98 @@
+import threading
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .instrumentation import recording
+from .management.commands.scrape_matches import run_scrape
+from .models import Match
+
+# Long-running scrape loop behind 'scrape_matches --watch'. The process keeps its
+# pooled HTTP session (conditional requests, so an unchanged page costs a 304) and
+# its DB connection between polls. It polls every FAST_INTERVAL seconds while a match
+# of the tournament is live, and otherwise every SLOW_INTERVAL seconds, or sooner when
+# the next match is about to start. Failed polls are retried with a doubling delay
+
+FAST_INTERVAL = 30
+SLOW_INTERVAL = 15 * 60
+# An unconcluded match is live from LIVE_BEFORE_START before its start until
+# LIVE_AFTER_START after it (a best of 5 can run for hours)
+LIVE_BEFORE_START = timedelta(minutes=10)
+LIVE_AFTER_START = timedelta(hours=6)
+
+
+def poll_interval(tournament, shifts, fast=FAST_INTERVAL, slow=SLOW_INTERVAL, now=None):
+    # (seconds until the next poll, live match count). shifts are the timedeltas the
+    # sources' adapters add to the times they store (see ScheduleAdapter.shift)
+    if now is None:
+        now = timezone.now()
+
+    live = 0
+    next_start = None
+    for shift in shifts:
+        stored_now = now + shift
+        upcoming = Match.objects.filter(tournament=tournament, is_concluded=False)
+        live += upcoming.filter(datetime__gte=stored_now - LIVE_AFTER_START,
+                                datetime__lte=stored_now + LIVE_BEFORE_START).count()
+        start = (upcoming.filter(datetime__gt=stored_now + LIVE_BEFORE_START)
+                 .order_by('datetime').values_list('datetime', flat=True).first())
+        if start is not None:
+            start -= shift
+            next_start = start if next_start is None else min(next_start, start)
+
+    if live:
+        return fast, live
+    if next_start is not None:
+        # Wake up when the next match becomes live
+        until_live = (next_start - LIVE_BEFORE_START - now).total_seconds()
+        return min(slow, max(fast, until_live)), 0
+    return slow, 0
+
+
+class Watcher:
+    def __init__(self, sources, tournament, stream=False, fast=FAST_INTERVAL, slow=SLOW_INTERVAL,
+                 report=print):
+        self.sources = sources
+        self.tournament = tournament
+        self.stream = stream
+        self.fast = fast
+        self.slow = slow
+        self.report = report
+        self.shifts = {adapter.shift for _, _, adapter in sources}
+        self.stop_event = threading.Event()
+        self.iterations = 0
+        self.failures = 0
+
+    def stop(self, *args):
+        # Also usable as a signal handler, the poll in progress is finished first
+        self.stop_event.set()
+
+    def poll(self):
+        # One scrape, returns (counts or None when unchanged, seconds, queries)
+        with recording('scrape_watch', always=True) as recorder:
+            counts = run_scrape(sources=self.sources, stream=self.stream, tournament=self.tournament)
+        seconds, queries = recorder.phases['total'][:2]
+        return counts, seconds, queries
+
+    def run(self, max_iterations=None):
+        while not self.stop_event.is_set():
+            self.iterations += 1
+            try:
+                counts, seconds, queries = self.poll()
+            except Exception as e:
+                self.failures += 1
+                delay = min(self.slow, self.fast * 2 ** self.failures)
+                self.report(f'Poll {self.iterations} failed, retrying in {delay:.0f}s: {e!r}')
+            else:
+                self.failures = 0
+                delay, live = poll_interval(self.tournament, self.shifts, self.fast, self.slow)
+                if counts is None:
+                    result = 'unchanged'
+                else:
+                    result = 'new {}, updated {}, unchanged {}, skipped {}, unknown teams {}'.format(*counts)
+                self.report(f'Poll {self.iterations}: {result} in {seconds:.2f}s ({queries} queries), '
+                            f'{live} live matches, next poll in {delay:.0f}s')
+
+            if max_iterations is not None and self.iterations >= max_iterations:
+                break
+            self.stop_event.wait(delay)
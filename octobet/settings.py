@@ -43,6 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so an admin view's totals include the queries of the other middleware.
+    # Only active with INSTRUMENTATION_PATH set
+    'match_bet.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,9 +83,25 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # File-backed so tests can use several connections at once (the default
+        # in-memory test database fails concurrent writers with 'table is locked')
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Pragmas run on every new SQLite connection (see match_bet/signals.py). WAL lets readers
+# and the writer work at the same time, busy_timeout (ms) makes a write wait for the
+# write lock instead of failing with 'database is locked', mmap_size (bytes) and
+# cache_size (negative: KiB) keep hot pages in memory. synchronous=NORMAL is durable
+# across application crashes in WAL mode, only a power loss can drop the last commits
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -124,3 +143,20 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Seconds between two odds recalculations of the same match, bets placed in between
+# are folded into the next one
+ODDS_REPRICE_INTERVAL = 5
+
+# Slug of the tournament the scraper, create_teams and the API use when none is given
+DEFAULT_TOURNAMENT = 'worlds-2023'
+
+# Seconds between two checks of the live feed for writes made by other processes (the
+# scrape_matches command, --watch), None to only publish the server process's own writes
+FEED_POLL_INTERVAL = 2
+
+# Per-phase wall time / query count / DB time of scrapes and admin requests (see
+# match_bet/instrumentation.py), written to this file when set. Format 'jsonl' (one
+# object per run) or 'prometheus' (a text exposition file of counters)
+INSTRUMENTATION_PATH = None
+INSTRUMENTATION_FORMAT = 'jsonl'